@@ -0,0 +1,187 @@
+import json
+import os
+import threading
+
+
+# Announcements on disk: a snapshot plus an append-only journal.
+#
+# <path>                  snapshot, {"version": 1, "announcements": [...]} latest first
+# <path>.journal          one JSON announcement per line, oldest first, appended and
+#                         fsynced as each announcement is created
+# <path>.journal.compact  a journal being folded into the snapshot
+#
+# Compaction moves the journal aside, writes a new snapshot to a temporary file,
+# fsyncs and renames it over the old one, then deletes the moved journal; the
+# snapshot is never missing and every announcement is always in the snapshot or a
+# journal. Loading replays both journals over the snapshot, skipping ids already
+# seen (a crash mid-compaction can leave one announcement in both). Snapshots
+# written here are trusted as sorted and valid; a legacy plain-list file is
+# validated and sorted once, then rewritten on the next compaction.
+ANNOUNCEMENT_SNAPSHOT_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+COMPACTING_SUFFIX = ".journal.compact"
+
+
+def _valid(announcement):
+    return isinstance(announcement, dict) and 'timestamp' in announcement and 'message' in announcement
+
+
+class AnnouncementStore:
+    """Journaled announcement file. snapshot() must return the current announcements, latest first."""
+
+    def __init__(self, path, snapshot, compact_after=100):
+        self.path = path
+        self.journal_path = path + JOURNAL_SUFFIX
+        self.compacting_path = path + COMPACTING_SUFFIX
+        self.compact_after = compact_after
+        self._snapshot = snapshot
+        self._journal = None
+        self._journal_entries = 0
+        self._lock = threading.Lock()            # journal file
+        self._compact_lock = threading.Lock()    # one compaction at a time
+        self._compacting = False
+
+    def load(self):
+        """Returns the stored announcements, latest first, and opens the journal for appends.
+           An unreadable snapshot is reported and treated as empty; the journal is still replayed."""
+        if os.path.exists(self.path) and not os.path.isfile(self.path):
+            # Never move a device or directory aside (e.g. a path pointed at /dev/null).
+            raise OSError(f"'{self.path}' is not a regular file")
+        try:
+            announcements = self._load_snapshot()
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            print(f"Error: Could not read announcements snapshot '{self.path}': {e}")
+            print(f"Moving it to '{self.path}.corrupt' and starting from the journal only.")
+            os.replace(self.path, self.path + ".corrupt")
+            announcements = []
+        replayed = self._read_journal(self.compacting_path) + self._read_journal(self.journal_path)
+        if replayed:
+            seen = {ann.get('id') for ann in announcements}
+            new = [ann for ann in replayed if ann.get('id') not in seen]
+            announcements = new[::-1] + announcements
+        self._journal = open(self.journal_path, 'ab')
+        self._journal_entries = len(replayed)
+        return announcements
+
+    def _load_snapshot(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data.get("version") == ANNOUNCEMENT_SNAPSHOT_VERSION:
+            return data["announcements"]
+
+        # Legacy announcements.json: a bare list in any order.
+        valid = []
+        for ann in data:
+            if _valid(ann):
+                valid.append(ann)
+            else:
+                print(f"Warning: Invalid announcement format found: {ann}")
+        valid.sort(key=lambda x: x['timestamp'], reverse=True)
+        return valid
+
+    def _read_journal(self, path):
+        """Reads journal entries, truncating a torn or corrupt tail left by a crash."""
+        if not os.path.exists(path):
+            return []
+        entries = []
+        offset = 0
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    if not line.endswith(b'\n'):
+                        raise ValueError("partial line")
+                    ann = json.loads(line)
+                    if not _valid(ann):
+                        raise ValueError("invalid announcement")
+                except ValueError:
+                    print(f"Announcements: Truncating journal '{path}' at byte {offset} (incomplete record).")
+                    break
+                entries.append(ann)
+                offset += len(line)
+        if offset != os.path.getsize(path):
+            with open(path, 'r+b') as f:
+                f.truncate(offset)
+        return entries
+
+    def append(self, announcement):
+        """Appends one announcement to the journal and fsyncs it; compacts in the
+           background once the journal holds compact_after entries."""
+        line = (json.dumps(announcement, ensure_ascii=False) + '\n').encode('utf-8')
+        with self._lock:
+            self._journal.write(line)
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+            self._journal_entries += 1
+            start_compaction = self._journal_entries >= self.compact_after and not self._compacting
+            if start_compaction:
+                self._compacting = True
+        if start_compaction:
+            threading.Thread(target=self._compact_in_background, name="announcement-compaction", daemon=True).start()
+
+    def _compact_in_background(self):
+        try:
+            self.compact()
+        except OSError as e:
+            print(f"Announcements: Compacting '{self.path}' failed; the journal is kept for the next compaction: {e}")
+
+    def compact(self):
+        """Folds the journal into a new snapshot. On failure (OSError) the journal stays
+           open for appends and everything journaled is kept for the next attempt."""
+        with self._compact_lock:
+            try:
+                with self._lock:
+                    self._compacting = True
+                    if self._journal_entries or not os.path.exists(self.compacting_path):
+                        self._move_journal_aside()
+                    # Everything in the moved journal was added to memory before it was journaled.
+                    announcements = self._snapshot()
+                tmp_path = self.path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({"version": ANNOUNCEMENT_SNAPSHOT_VERSION, "announcements": announcements}, f,
+                              ensure_ascii=False, separators=(',', ':'))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+                os.remove(self.compacting_path)
+                self._sync_directory()
+            finally:
+                with self._lock:
+                    self._compacting = False
+        return len(announcements)
+
+    def _move_journal_aside(self):
+        """Moves the journal's entries to the compacting journal; appends from here on go to
+           an empty journal. The open journal is only replaced once that has worked."""
+        if os.path.exists(self.compacting_path) and os.path.exists(self.journal_path):
+            # A previous compaction failed; keep its entries too, then empty the journal in place.
+            with open(self.compacting_path, 'ab') as old, open(self.journal_path, 'rb') as current:
+                old.write(current.read())
+                old.flush()
+                os.fsync(old.fileno())
+            self._journal.truncate(0)
+            os.fsync(self._journal.fileno())
+        else:
+            if not os.path.exists(self.compacting_path):
+                os.replace(self.journal_path, self.compacting_path)
+            # Until this succeeds, appends still reach the moved journal, which is replayed too.
+            journal = open(self.journal_path, 'ab')
+            self._journal.close()
+            self._journal = journal
+        self._journal_entries = 0
+
+    def _sync_directory(self):
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -0,0 +1,170 @@
+"""Server socket writes and CPU per delivered chat message, with and without broadcast batching.
+
+Runs the chat server (combined_server.py, threads or asyncio backend) in a child
+process for each CHAT_BATCH_WINDOW, connects loopback viewers from this process
+and sends chat messages at a fixed rate. Socket writes (one send() syscall each)
+are counted by the connections' outbound queues, CPU is the server process's.
+The server's per-message logging is silenced so it does not dominate.
+
+    python benchmarks/bench_chat_batching.py [--viewers 200] [--rate 500] [--windows 0 0.01 0.02 0.05]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def serve(backend, port, window, ready, measuring, done, results):
+    import combined_server as cs
+    cs.print = lambda *args, **kwargs: None
+    cs.TCP_HOST = '127.0.0.1'
+    cs.TCP_PORT = port
+    cs.CHAT_BATCH_WINDOW = window
+    cs.ANNOUNCEMENTS_FILE = os.path.join(tempfile.mkdtemp(prefix="bench-chat-"), "announcements.json")
+    cs.CHAT_LOG_ENABLED = False
+    listener = cs.tcp_announcement_listener_async if backend == "asyncio" else cs.tcp_announcement_listener
+    threading.Thread(target=listener, daemon=True).start()
+    ready.set()
+
+    def total_writes():
+        with cs.tcp_clients_lock:
+            return sum(connection.queue.writes for connection in cs.connected_tcp_clients.values())
+
+    measuring.wait()
+    writes, cpu = total_writes(), time.process_time()
+    done.wait()
+    results.put((total_writes() - writes, time.process_time() - cpu))
+    cs.stop_server_event.set()
+
+
+def connect(port):
+    for _ in range(100):
+        try:
+            return socket.create_connection(('127.0.0.1', port))
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError("chat server did not start")
+
+
+class Viewers:
+    """Loopback chat clients read from one thread; counts delivered messages and their latency."""
+
+    def __init__(self, port, count):
+        self.sockets = [connect(port) for _ in range(count)]
+        self.delivered = 0
+        self.latencies = []
+        self._buffers = {s: b'' for s in self.sockets}
+        self._stop = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _on_line(self, line):
+        message = json.loads(line)
+        if message["type"] == "chatMessage":
+            chats = [message["payload"]]
+        elif message["type"] == "chatBatch":
+            chats = message["payload"]
+        else:
+            return
+        now = time.perf_counter()
+        self.delivered += len(chats)
+        for chat in chats:
+            self.latencies.append(now - float(chat["message"]))
+
+    def _run(self):
+        selector = selectors.DefaultSelector()
+        for s in self.sockets:
+            selector.register(s, selectors.EVENT_READ)
+        while not self._stop:
+            for key, _ in selector.select(0.1):
+                data = key.fileobj.recv(262144)
+                if not data:
+                    selector.unregister(key.fileobj)
+                    continue
+                *lines, self._buffers[key.fileobj] = (self._buffers[key.fileobj] + data).split(b'\n')
+                for line in lines:
+                    self._on_line(line)
+
+    def close(self):
+        self._stop = True
+        self._thread.join()
+        for s in self.sockets:
+            s.close()
+
+
+def run(backend, port, window, viewers, rate, duration):
+    ctx = multiprocessing.get_context("spawn")
+    ready, measuring, done = ctx.Event(), ctx.Event(), ctx.Event()
+    results = ctx.Queue()
+    server = ctx.Process(target=serve, args=(backend, port, window, ready, measuring, done, results), daemon=True)
+    server.start()
+    ready.wait()
+
+    audience = Viewers(port, viewers)
+    sender = connect(port)
+    sender.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    time.sleep(0.5)
+    audience.delivered = 0
+    audience.latencies.clear()
+
+    measuring.set()
+    sent = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        due = int((time.perf_counter() - start) * rate)
+        while sent < due:
+            message = {"type": "chatMessage", "payload": {"message": repr(time.perf_counter()), "sender_id": "bench"}}
+            sender.sendall(json.dumps(message).encode('utf-8') + b'\n')
+            sent += 1
+        time.sleep(0.001)
+    expected = sent * viewers
+    deadline = time.perf_counter() + 10
+    while audience.delivered < expected and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    done.set()
+    writes, cpu = results.get()
+
+    delivered = audience.delivered
+    latencies = sorted(audience.latencies)
+    audience.close()
+    sender.close()
+    server.join(3)
+
+    p50 = latencies[len(latencies) // 2] * 1000 if latencies else float('nan')
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else float('nan')
+    label = "off" if window == 0 else f"{window * 1000:g} ms"
+    print(f"  window {label:<7} delivered {delivered:>9,}/{expected:,}  "
+          f"{writes / max(delivered, 1):6.3f} writes/msg  "
+          f"{cpu / max(delivered, 1) * 1e6:6.2f} us cpu/msg  latency p50 {p50:6.1f} ms  p99 {p99:6.1f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', choices=["threads", "asyncio"], nargs='+', default=["threads", "asyncio"])
+    parser.add_argument('--viewers', type=int, default=200)
+    parser.add_argument('--rate', type=int, default=500, help="chat messages per second")
+    parser.add_argument('--windows', type=float, nargs='+', default=[0, 0.01, 0.02, 0.05],
+                        help="CHAT_BATCH_WINDOW values in seconds (0 = no batching)")
+    parser.add_argument('--duration', type=float, default=3.0, help="seconds per measurement")
+    parser.add_argument('--port', type=int, default=14100)
+    args = parser.parse_args()
+
+    print(f"{args.viewers} viewers, {args.rate} chat messages/s for {args.duration:g}s")
+    port = args.port
+    for backend in args.backend:
+        print(f"{backend} backend:")
+        for window in args.windows:
+            run(backend, port, window, args.viewers, args.rate, args.duration)
+            port += 1
+
+
+if __name__ == "__main__":
+    main()
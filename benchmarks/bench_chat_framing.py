@@ -0,0 +1,104 @@
+"""Encode/decode throughput and bytes on the wire per chat event, JSON lines vs binary framing.
+
+Encodes a stream of realistic chat traffic (chatMessage broadcasts from a pool of
+senders, chatBatch messages, a loadOldChatMessages snapshot) with each framing of
+chat_protocol.py and decodes it again with a MessageReader, the way the server and
+client do. Binary sender definitions are counted once per sender, as a connection
+sees them. Both codecs are pure Python apart from the json module's C speedups, so
+the throughput numbers compare the implementations here, not the formats as such.
+
+    python benchmarks/bench_chat_framing.py [--messages 20000] [--senders 50] [--batch 20]
+"""
+import argparse
+import datetime
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chat_protocol import (FRAMING_BINARY, FRAMING_JSON, MessageReader, SenderTable, encode_binary_message,
+                           encode_json_message, encode_sender_definitions)
+
+WORDS = "hello stream nice lol great question audio video lag ok thanks when is the next slide".split()
+
+
+def make_messages(count, senders):
+    rng = random.Random(1)
+    names = [f"viewer-{rng.randrange(10**6):06d}" for _ in range(senders)]
+    start = datetime.datetime(2025, 5, 1, 18, 0)
+    return [{
+        "sender": rng.choice(names),
+        "message": " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 12))),
+        "timestamp": (start + datetime.timedelta(microseconds=i * 137_911)).isoformat(),
+        "id": i + 1,
+    } for i in range(count)]
+
+
+def workloads(messages, batch):
+    return [
+        ("chatMessage", [("chatMessage", m) for m in messages]),
+        (f"chatBatch x{batch}", [("chatBatch", messages[i:i + batch]) for i in range(0, len(messages), batch)]),
+        ("loadOldChatMessages x50", [("loadOldChatMessages", messages[i:i + 50]) for i in range(0, len(messages), 50)]),
+    ]
+
+
+def encode_stream(framing, items):
+    """Returns (encoded frames, seconds). Binary streams define each sender once, up front of its first use."""
+    senders = SenderTable()
+    known = {}
+    frames = []
+    start = time.perf_counter()
+    if framing == FRAMING_JSON:
+        for message_type, payload in items:
+            frames.append(encode_json_message(message_type, payload))
+    else:
+        for message_type, payload in items:
+            frame, used = encode_binary_message(message_type, payload, senders)
+            new = {i: name for i, name in used.items() if known.get(i) != name}
+            if new:
+                frames.append(encode_sender_definitions(new))
+                known.update(new)
+            frames.append(frame)
+    return frames, time.perf_counter() - start
+
+
+def decode_stream(framing, data, chunk=65536):
+    reader = MessageReader()
+    reader.framing = framing
+    decoded = 0
+    start = time.perf_counter()
+    for offset in range(0, len(data), chunk):
+        reader.feed(data[offset:offset + chunk])
+        while reader.next_message() is not None:
+            decoded += 1
+    return decoded, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20000, help="chat messages per workload")
+    parser.add_argument('--senders', type=int, default=50, help="distinct sender names")
+    parser.add_argument('--batch', type=int, default=20, help="chat messages per chatBatch")
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, args.senders)
+    print(f"{args.messages:,} chat messages from {args.senders} senders")
+    for name, items in workloads(messages, args.batch):
+        print(f"{name}:")
+        sizes = {}
+        for framing in (FRAMING_JSON, FRAMING_BINARY):
+            frames, encode_seconds = encode_stream(framing, items)
+            data = b''.join(frames)
+            decoded, decode_seconds = decode_stream(framing, data)
+            assert decoded == len(items), (decoded, len(items))
+            sizes[framing] = len(data)
+            print(f"  {framing:<8} {len(data) / len(messages):7.1f} bytes/chat message  "
+                  f"encode {len(messages) / encode_seconds:>10,.0f} msg/s  "
+                  f"decode {len(messages) / decode_seconds:>10,.0f} msg/s")
+        print(f"  binary is {sizes[FRAMING_BINARY] / sizes[FRAMING_JSON]:.0%} of the JSON bytes")
+
+
+if __name__ == "__main__":
+    main()
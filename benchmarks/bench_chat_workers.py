@@ -0,0 +1,153 @@
+"""Chat broadcast throughput with the chat served by 0 (in-process) to N worker processes.
+
+Runs the chat server in a child process for each --workers value: 0 serves chat
+from the hub process itself (the default), N > 0 forks N chat workers sharing
+the port through SO_REUSEPORT with the hub ordering events over chat_bus.py.
+Viewers are loopback clients spread over --readers reader processes. One sender
+posts --messages chat messages as fast as it can; throughput is deliveries
+(messages x viewers) per second until the last viewer has them all.
+Worker mode needs a platform with SO_REUSEPORT and fork (Linux/BSD), and only
+helps with more than one core.
+
+    python benchmarks/bench_chat_workers.py [--workers 0 1 2 4] [--viewers 400] [--messages 2000]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def serve(workers, backend, port, bus_path, ready, done):
+    import combined_server as cs
+    from chat_bus import ChatBusHub
+    cs.print = lambda *args, **kwargs: None
+    cs.TCP_HOST = '127.0.0.1'
+    cs.TCP_PORT = port
+    cs.CHAT_BACKEND = backend
+    cs.CHAT_WORKERS = workers
+    cs.CHAT_BUS_PATH = bus_path
+    cs.CHAT_LOG_ENABLED = False
+    cs.ANNOUNCEMENTS_FILE = os.path.join(tempfile.mkdtemp(prefix="bench-chat-"), "announcements.json")
+    processes = cs.start_chat_workers() if workers else []
+    cs.load_announcements_from_file()
+    if processes:
+        cs.chat_bus_hub = ChatBusHub(bus_path, cs.handle_chat_bus_message, cs.sync_chat_worker,
+                                     cs.stop_server_event).start()
+    else:
+        listener = cs.tcp_announcement_listener_async if backend == "asyncio" else cs.tcp_announcement_listener
+        threading.Thread(target=listener, daemon=True).start()
+    ready.set()
+    done.wait()
+    cs.stop_server_event.set()
+    for process in processes:
+        process.terminate()
+        process.join(2)
+
+
+def connect(port):
+    for _ in range(200):
+        try:
+            return socket.create_connection(('127.0.0.1', port))
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    raise RuntimeError("chat server did not start")
+
+
+def read_chat(port, viewers, expected, connected, results):
+    """Reader process: connects viewers and reports (deliveries, time of the last one)."""
+    sockets = [connect(port) for _ in range(viewers)]
+    connected.put(viewers)
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    for s in sockets:
+        selector.register(s, selectors.EVENT_READ)
+        buffers[s] = b''
+    delivered = 0
+    last = 0.0
+    deadline = time.time() + 60
+    while delivered < expected * viewers and time.time() < deadline:
+        for key, _ in selector.select(0.5):
+            data = key.fileobj.recv(262144)
+            if not data:
+                selector.unregister(key.fileobj)
+                continue
+            *lines, buffers[key.fileobj] = (buffers[key.fileobj] + data).split(b'\n')
+            for line in lines:
+                message = json.loads(line)
+                if message["type"] == "chatMessage":
+                    delivered += 1
+                elif message["type"] == "chatBatch":
+                    delivered += len(message["payload"])
+                else:
+                    continue
+                last = time.time()
+    results.put((delivered, last))
+    for s in sockets:
+        s.close()
+
+
+def run(workers, backend, port, viewers, readers, messages):
+    ctx = multiprocessing.get_context("spawn")
+    ready, done = ctx.Event(), ctx.Event()
+    connected, results = ctx.Queue(), ctx.Queue()
+    bus_path = os.path.join(tempfile.gettempdir(), f"bench-chat-bus-{port}.sock")
+    # Not a daemon: daemonic processes cannot start the chat workers.
+    server = ctx.Process(target=serve, args=(workers, backend, port, bus_path, ready, done))
+    server.start()
+    if not ready.wait(30):
+        server.terminate()
+        raise RuntimeError("chat server did not start")
+
+    per_reader = [viewers // readers + (i < viewers % readers) for i in range(readers)]
+    reader_processes = [ctx.Process(target=read_chat, args=(port, count, messages, connected, results), daemon=True)
+                        for count in per_reader]
+    for process in reader_processes:
+        process.start()
+    for _ in reader_processes:
+        connected.get()
+    sender = connect(port)
+    sender.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    time.sleep(1.0)
+
+    start = time.time()
+    for i in range(messages):
+        message = {"type": "chatMessage", "payload": {"message": f"message {i}", "sender_id": "bench"}}
+        sender.sendall(json.dumps(message).encode('utf-8') + b'\n')
+    reports = [results.get() for _ in reader_processes]
+    done.set()
+    sender.close()
+    for process in reader_processes + [server]:
+        process.join(5)
+
+    delivered = sum(count for count, _ in reports)
+    elapsed = max(last for _, last in reports) - start
+    label = "in-process" if workers == 0 else f"{workers} workers"
+    print(f"  {label:<11} delivered {delivered:>9,}/{messages * viewers:,} in {elapsed:6.2f}s  "
+          f"{delivered / elapsed:>10,.0f} deliveries/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 1, 2, 4])
+    parser.add_argument('--backend', choices=["threads", "asyncio"], default="threads")
+    parser.add_argument('--viewers', type=int, default=400)
+    parser.add_argument('--readers', type=int, default=2, help="viewer reader processes")
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--port', type=int, default=14500)
+    args = parser.parse_args()
+
+    print(f"{args.viewers} viewers, {args.messages} chat messages, {args.backend} backend, {os.cpu_count()} CPUs")
+    for offset, workers in enumerate(args.workers):
+        run(workers, args.backend, args.port + offset, args.viewers, args.readers, args.messages)
+
+
+if __name__ == "__main__":
+    main()
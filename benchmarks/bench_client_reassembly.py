@@ -0,0 +1,120 @@
+"""Client frame reassembly: packets/sec and buffer allocations, with and without the buffer pool.
+
+Packetizes --frames JPEG frames of a generated --width x --height clip (with FEC,
+dropping --loss of the data packets so recovery runs too), then feeds every datagram
+through the client's receive path as the UDP thread does: into one receive buffer,
+header parsed from a memoryview, payload copied into the frame's reassembly buffer,
+the finished frame decoded straight from that buffer and the buffer released.
+--pool-size 0 allocates a fresh buffer per frame, like the client before the pool.
+
+    python benchmarks/bench_client_reassembly.py [--frames 600] [--pool-size 0 8] [--fec rs] [--loss 0.02]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import combined_client as cc
+from video_fec import FEC_NONE, FEC_RS, FEC_XOR
+from video_protocol import FLAG_PARITY, VIDEO_HEADER_SIZE, packetize_frame, parse_packet_header, payload_size_for_datagram
+
+FEC_MODES = {"off": FEC_NONE, "xor": FEC_XOR, "rs": FEC_RS}
+
+
+def make_frames(count, width, height, quality):
+    """JPEG-encodes a few distinct frames and cycles through them."""
+    rng = np.random.default_rng(1)
+    background = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    encoded = []
+    for i in range(8):
+        frame = background.copy()
+        frame[height // 3:height // 2, i * width // 8:(i + 1) * width // 8] = (0, 0, 255)
+        encoded.append(cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes())
+    return [encoded[i % len(encoded)] for i in range(count)]
+
+
+def packetize(frames, fec_mode, loss):
+    fec_k, fec_m = (10, 2) if fec_mode == FEC_RS else (5, 1) if fec_mode == FEC_XOR else (0, 0)
+    chunk_size = payload_size_for_datagram(1200)
+    rng = random.Random(1)
+    streams = []
+    for frame_id, data in enumerate(frames):
+        packets = packetize_frame(frame_id, data, chunk_size, fec_mode, fec_k, fec_m)
+        # Lose at most one data packet per FEC group, so every frame can still be completed.
+        kept, lost_groups = [], set()
+        for packet in packets:
+            header = parse_packet_header(packet)
+            group = header.packet_index // fec_k if fec_k else header.packet_index
+            if (fec_mode != FEC_NONE and not header.flags & FLAG_PARITY and group not in lost_groups
+                    and rng.random() < loss):
+                lost_groups.add(group)
+                continue
+            kept.append(packet)
+        streams.append(kept)
+    return streams
+
+
+def run(streams, pool_size):
+    cc.frame_buffer_pool = cc.FrameBufferPool(pool_size)
+    recv_buffer = bytearray(cc.BUFFER_SIZE)
+    recv_view = memoryview(recv_buffer)
+    assemblies = {}
+    decoded = packets = 0
+    last_done = -1  # like last_displayed_frame_id: parity arriving after recovery is ignored
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    for stream in streams:
+        for packet in stream:
+            nbytes = len(packet)
+            recv_buffer[:nbytes] = packet  # stands in for recvfrom_into
+            packets += 1
+            header = parse_packet_header(recv_view[:nbytes])
+            if header.frame_id <= last_done:
+                continue
+            assembly = assemblies.get(header.frame_id)
+            if assembly is None:
+                assembly = assemblies[header.frame_id] = cc.FrameReassembly(header)
+            if assembly.add_packet(header, recv_view[VIDEO_HEADER_SIZE:nbytes]) and assembly.is_complete():
+                del assemblies[header.frame_id]
+                last_done = header.frame_id
+                frame = cv2.imdecode(np.frombuffer(assembly.frame_bytes(), np.uint8), cv2.IMREAD_COLOR)
+                decoded += frame is not None
+                assembly.release()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return decoded, packets, elapsed, cc.frame_buffer_pool.allocated, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--width', type=int, default=1280)
+    parser.add_argument('--height', type=int, default=720)
+    parser.add_argument('--quality', type=int, default=80)
+    parser.add_argument('--fec', choices=list(FEC_MODES), default="rs")
+    parser.add_argument('--loss', type=float, default=0.02, help="share of data packets dropped (FEC only)")
+    parser.add_argument('--pool-size', type=int, nargs='+', default=[0, 8])
+    args = parser.parse_args()
+
+    frames = make_frames(args.frames, args.width, args.height, args.quality)
+    streams = packetize(frames, FEC_MODES[args.fec], args.loss)
+    print(f"{args.frames} frames of {args.width}x{args.height}, ~{len(frames[0]) // 1024} KB each, "
+          f"{sum(map(len, streams)) / len(streams):.0f} packets/frame, FEC {args.fec}")
+    for pool_size in args.pool_size:
+        decoded, packets, elapsed, allocated, peak = run(streams, pool_size)
+        label = "no pool" if pool_size == 0 else f"pool of {pool_size}"
+        print(f"  {label:<10} {decoded} frames decoded  {packets / elapsed:>10,.0f} packets/s  "
+              f"{allocated:>5} buffers allocated  peak traced {peak / 1024:,.0f} KB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""Latency added per relay hop, for video packets and chat messages.
+
+Starts an origin server and a chain of --hops relays (RELAY_UPSTREAM_HOST), each
+relaying the one before it, all on loopback in separate processes. The origin
+streams a generated test video. One probe viewer per server subscribes with
+VIDEO_HELLO and records when each frame's first and last packets arrive; the same
+frame reaches every server, so its arrival time at hop N minus at the origin is
+the latency the relays added. A chat client per server then times --chat-messages
+messages sent to the origin. Everything shares one machine, so the numbers
+include scheduling between the processes and are best compared with each other.
+
+    python benchmarks/bench_relay_latency.py [--hops 3] [--seconds 10] [--tier full] [--chat-messages 50]
+"""
+import argparse
+import multiprocessing
+import os
+import selectors
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chat_protocol import MessageReader, encode_json_message
+from video_protocol import FLAG_PARITY, parse_packet_header
+
+
+def make_video(path, frames=90, size=(640, 360)):
+    """Writes a looping test clip: a noisy background with a moving block, so frames differ."""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, size)
+    rng = np.random.default_rng(1)
+    background = rng.integers(0, 255, (size[1], size[0], 3), dtype=np.uint8)
+    for i in range(frames):
+        frame = background.copy()
+        x = i * (size[0] - 80) // frames
+        frame[140:220, x:x + 80] = (0, 0, 255)
+        writer.write(frame)
+    writer.release()
+
+
+def serve(hop, tcp_port, udp_port, video_path, done):
+    import chat_upstream
+    import combined_server as cs
+    cs.print = chat_upstream.print = lambda *args, **kwargs: None
+    cs.TCP_HOST = '127.0.0.1'
+    cs.TCP_PORT = tcp_port + hop
+    cs.UDP_HOST = '127.0.0.1'
+    cs.UDP_VIDEO_SERVER_PORT = udp_port + hop
+    cs.CHAT_LOG_ENABLED = False
+    cs.ANNOUNCEMENTS_FILE = os.path.join(tempfile.mkdtemp(prefix="bench-relay-"), "announcements.json")
+    cs.VIDEO_CHANNELS = [("main", video_path, 30, cs.VIDEO_TIER_LADDER)]
+    if hop:
+        cs.RELAY_UPSTREAM_HOST = '127.0.0.1'
+        cs.RELAY_UPSTREAM_TCP_PORT = tcp_port + hop - 1
+        cs.RELAY_UPSTREAM_UDP_PORT = udp_port + hop - 1
+    threading.Thread(target=lambda: (done.wait(), cs.stop_server_event.set()), daemon=True).start()
+    cs.main_server()
+
+
+def probe_video(hops, udp_port, tier, seconds):
+    """Returns {hop: {frame_id: (first packet time, last packet time or None)}}."""
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for hop in range(hops + 1):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        s.bind(('127.0.0.1', 0))
+        s.setblocking(False)
+        selector.register(s, selectors.EVENT_READ, hop)
+        sockets.append(s)
+    hello = f"VIDEO_HELLO channel=main tier={tier}".encode('utf-8')
+    arrivals = {hop: {} for hop in range(hops + 1)}
+    received = {}  # (hop, frame_id) -> data packets received
+    next_hello = 0.0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if time.perf_counter() >= next_hello:
+            for hop, s in enumerate(sockets):
+                s.sendto(hello, ('127.0.0.1', udp_port + hop))
+            next_hello = time.perf_counter() + 1.0
+        for key, _ in selector.select(0.1):
+            while True:
+                try:
+                    packet = key.fileobj.recv(65536)
+                except BlockingIOError:
+                    break
+                now = time.perf_counter()
+                header = parse_packet_header(packet)
+                if header is None or header.flags & FLAG_PARITY:
+                    continue
+                hop, frame_id = key.data, header.frame_id
+                first, _ = arrivals[hop].setdefault(frame_id, (now, None))
+                count = received[hop, frame_id] = received.get((hop, frame_id), 0) + 1
+                if count == header.num_packets:
+                    arrivals[hop][frame_id] = (first, now)
+    for s in sockets:
+        s.close()
+    return arrivals
+
+
+def probe_chat(hops, tcp_port, messages):
+    """Returns {hop: {message text: arrival time}} and the send times."""
+    selector = selectors.DefaultSelector()
+    readers = {}
+    for hop in range(hops + 1):
+        s = socket.create_connection(('127.0.0.1', tcp_port + hop))
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.setblocking(False)
+        selector.register(s, selectors.EVENT_READ, hop)
+        readers[s] = MessageReader()
+    sender = next(iter(readers))
+    time.sleep(1.0)  # let every server finish sending its initial state
+
+    arrivals = {hop: {} for hop in range(hops + 1)}
+    sent = {}
+    next_send, index = time.perf_counter(), 0
+    deadline = time.perf_counter() + messages * 0.05 + 5
+    while time.perf_counter() < deadline and min(len(a) for a in arrivals.values()) < messages:
+        if index < messages and time.perf_counter() >= next_send:
+            text = f"probe {index}"
+            sent[text] = time.perf_counter()
+            sender.setblocking(True)
+            sender.sendall(encode_json_message("chatMessage", {"sender_id": "bench", "message": text}))
+            sender.setblocking(False)
+            index += 1
+            next_send += 0.05
+        for key, _ in selector.select(0.01):
+            reader = readers[key.fileobj]
+            try:
+                if not reader.receive(key.fileobj):
+                    selector.unregister(key.fileobj)
+                    continue
+            except BlockingIOError:
+                continue
+            now = time.perf_counter()
+            while True:
+                message = reader.next_message()
+                if message is None:
+                    break
+                message_type, payload = message
+                chat = [payload] if message_type == "chatMessage" else payload if message_type == "chatBatch" else []
+                for chat_message in chat:
+                    arrivals[key.data].setdefault(chat_message["message"], now)
+    for s in readers:
+        s.close()
+    return arrivals, sent
+
+
+def percentiles(values):
+    if not values:
+        return "no samples"
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f"median {statistics.median(values) * 1000:6.2f}ms  p95 {p95 * 1000:6.2f}ms  max {values[-1] * 1000:6.2f}ms"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--hops', type=int, default=3, help="relays chained after the origin")
+    parser.add_argument('--seconds', type=float, default=10.0, help="video measurement time")
+    parser.add_argument('--tier', default="full")
+    parser.add_argument('--chat-messages', type=int, default=50)
+    parser.add_argument('--tcp-port', type=int, default=14600)
+    parser.add_argument('--udp-port', type=int, default=15600)
+    args = parser.parse_args()
+
+    video_path = os.path.join(tempfile.mkdtemp(prefix="bench-relay-"), "clip.avi")
+    make_video(video_path)
+    ctx = multiprocessing.get_context("spawn")
+    done = ctx.Event()
+    servers = [ctx.Process(target=serve, args=(hop, args.tcp_port, args.udp_port, video_path, done))
+               for hop in range(args.hops + 1)]
+    for server in servers:
+        server.start()
+    time.sleep(2.0)
+
+    try:
+        print(f"origin + {args.hops} relays on loopback, tier '{args.tier}', {os.cpu_count()} CPUs")
+        video = probe_video(args.hops, args.udp_port, args.tier, args.seconds)
+        chat, sent = probe_chat(args.hops, args.tcp_port, args.chat_messages)
+    finally:
+        done.set()
+        for server in servers:
+            server.join(5)
+
+    # Frames the origin viewer saw in full, after every hop had subscribed.
+    origin = {frame_id: times for frame_id, times in video[0].items() if times[1] is not None}
+    common = [f for f in origin if all(f in video[hop] for hop in range(1, args.hops + 1))]
+    print(f"video: {len(origin)} frames complete at the origin viewer, {len(common)} seen at every hop")
+    for hop in range(1, args.hops + 1):
+        first = [video[hop][f][0] - origin[f][0] for f in common]
+        last = [video[hop][f][1] - origin[f][1] for f in common if video[hop][f][1] is not None]
+        complete = len(last) / len(common) if common else 0.0
+        print(f"  hop {hop}  first packet +{percentiles(first)}")
+        print(f"         last packet  +{percentiles(last)}  ({complete:.0%} of frames complete)")
+
+    print(f"chat: {len(sent)} messages sent to the origin")
+    for hop in range(args.hops + 1):
+        delays = [chat[hop][text] - sent[text] for text in sent if text in chat[hop]]
+        print(f"  hop {hop}  {len(delays):>4} delivered  {percentiles(delays)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Receive-side framing cost for large TCP messages: old split loop vs MessageReader.
+
+Builds a loadOldAnnouncements message of each size (the largest thing the server
+sends, all in one line) followed by a few chat messages, and reads it back in
+--chunk sized pieces the way a client does:
+
+  split     the loop the client and server used before chat_protocol.MessageReader:
+            buffer += recv(); while b'\\n' in buffer: buffer.split(b'\\n', 1)
+  reader    MessageReader.feed() / next_message()
+
+Both parse every message with json, so the difference is the framing. With
+--socket the payload also goes through a local socketpair, recv() for split and
+MessageReader.receive() (recv_into a reusable buffer) for reader.
+
+    python benchmarks/bench_tcp_framer.py [--sizes 1 4 16] [--chunk 4096] [--socket]
+"""
+import argparse
+import datetime
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from chat_protocol import MessageReader, encode_json_message
+
+
+def make_stream(megabytes):
+    announcement = {"id": "", "message": "x" * 200, "timestamp": datetime.datetime(2025, 5, 1).isoformat()}
+    count = megabytes * 1024 * 1024 // len(json.dumps(announcement))
+    announcements = [dict(announcement, id=str(i)) for i in range(count)]
+    chats = [encode_json_message("chatMessage", {"sender": "bench", "message": f"hi {i}"}) for i in range(10)]
+    return encode_json_message("loadOldAnnouncements", announcements) + b''.join(chats), 1 + len(chats)
+
+
+def split_loop(chunks):
+    messages = 0
+    buffer = b''
+    for data in chunks:
+        buffer += data
+        while b'\n' in buffer:
+            message_bytes, buffer = buffer.split(b'\n', 1)
+            json.loads(message_bytes.decode('utf-8').strip())
+            messages += 1
+    return messages
+
+
+def reader_loop(chunks):
+    messages = 0
+    reader = MessageReader()
+    for data in chunks:
+        reader.feed(data)
+        while reader.next_message() is not None:
+            messages += 1
+    return messages
+
+
+def socket_chunks(stream, chunk):
+    """Yields what recv(chunk) returns while another thread sends stream."""
+    sender, receiver = socket.socketpair()
+    threading.Thread(target=lambda: (sender.sendall(stream), sender.close()), daemon=True).start()
+    while True:
+        data = receiver.recv(chunk)
+        if not data:
+            break
+        yield data
+    receiver.close()
+
+
+def reader_socket(stream, chunk):
+    sender, receiver = socket.socketpair()
+    threading.Thread(target=lambda: (sender.sendall(stream), sender.close()), daemon=True).start()
+    messages = 0
+    reader = MessageReader(recv_size=chunk)
+    while reader.receive(receiver):
+        while reader.next_message() is not None:
+            messages += 1
+    receiver.close()
+    return messages
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 4, 16], help="announcement payload sizes in MB")
+    parser.add_argument('--chunk', type=int, default=4096, help="bytes per recv")
+    parser.add_argument('--socket', action='store_true', help="read through a socketpair instead of from memory")
+    args = parser.parse_args()
+
+    print(f"{args.chunk}-byte reads, {'socketpair' if args.socket else 'in memory'}")
+    for megabytes in args.sizes:
+        stream, expected = make_stream(megabytes)
+        if args.socket:
+            runs = [("split", lambda: split_loop(socket_chunks(stream, args.chunk))),
+                    ("reader", lambda: reader_socket(stream, args.chunk))]
+        else:
+            chunks = [stream[i:i + args.chunk] for i in range(0, len(stream), args.chunk)]
+            runs = [("split", lambda: split_loop(chunks)), ("reader", lambda: reader_loop(chunks))]
+        results = {}
+        for name, run in runs:
+            messages, seconds = timed(run)
+            assert messages == expected, (name, messages, expected)
+            results[name] = seconds
+            print(f"  {megabytes:>3} MB  {name:<6} {seconds * 1000:9.1f} ms  {len(stream) / seconds / 1e6:8.1f} MB/s")
+        print(f"  {megabytes:>3} MB  reader is {results['split'] / results['reader']:.1f}x faster")
+
+
+if __name__ == "__main__":
+    main()
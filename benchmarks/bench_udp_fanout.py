@@ -0,0 +1,83 @@
+"""Packets/sec of the UDP video fan-out against 1, 10, 100 and 500 loopback viewers.
+
+Compares the original per-(packet, viewer) sendto() loop from
+video_stream_server_udp with UdpFanoutSender (sendmmsg where available,
+sharded sendto otherwise).
+
+    python benchmarks/bench_udp_fanout.py [--packet-size 1200] [--packets-per-frame 50]
+"""
+import argparse
+import os
+import socket
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from udp_fanout import UdpFanoutSender
+
+
+def open_viewers(count):
+    """Opens loopback UDP sockets standing in for viewers. Nobody reads them; the kernel drops overflow."""
+    sockets = []
+    for _ in range(count):
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.bind(('127.0.0.1', 0))
+        sockets.append(s)
+    return sockets, [s.getsockname() for s in sockets]
+
+
+def naive_send(sock, packets, viewers):
+    for packet in packets:
+        for addr in viewers:
+            sock.sendto(packet, addr)
+    return len(packets) * len(viewers)
+
+
+def run(label, send_frame, duration):
+    sent = 0
+    frames = 0
+    start = time.perf_counter()
+    cpu_start = time.process_time()
+    while time.perf_counter() - start < duration:
+        sent += send_frame()
+        frames += 1
+    elapsed = time.perf_counter() - start
+    cpu = time.process_time() - cpu_start
+    print(f"  {label:<16} {sent / elapsed:>12,.0f} pkt/s  {frames / elapsed:>8,.1f} frames/s  cpu {cpu / elapsed * 100:5.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--viewers', type=int, nargs='+', default=[1, 10, 100, 500])
+    parser.add_argument('--packet-size', type=int, default=1200)
+    parser.add_argument('--packets-per-frame', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=2.0, help="seconds per measurement")
+    args = parser.parse_args()
+
+    packets = [os.urandom(args.packet_size) for _ in range(args.packets_per_frame)]
+    print(f"{args.packets_per_frame} packets x {args.packet_size} bytes per frame")
+
+    for count in args.viewers:
+        sockets, viewers = open_viewers(count)
+        print(f"{count} viewer(s):")
+        try:
+            naive_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            run("sendto loop", lambda: naive_send(naive_sock, packets, viewers), args.duration)
+            naive_sock.close()
+
+            fanout = UdpFanoutSender()
+            run(f"fanout/{fanout.mode}", lambda: fanout.send_packets(packets, viewers), args.duration)
+            fanout.close()
+
+            if fanout.mode == "sendmmsg":
+                sharded = UdpFanoutSender(use_sendmmsg=False)
+                run("fanout/sharded", lambda: sharded.send_packets(packets, viewers), args.duration)
+                sharded.close()
+        finally:
+            for s in sockets:
+                s.close()
+
+
+if __name__ == "__main__":
+    main()
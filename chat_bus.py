@@ -0,0 +1,177 @@
+import os
+import socket
+import threading
+import time
+
+from chat_protocol import MessageReader, encode_json_message
+
+
+# Local bus between the chat hub and chat worker processes.
+#
+# With CHAT_WORKERS > 0 the main server process is the hub: it owns the chat
+# history, the chat log and the announcement store, and accepts no chat clients.
+# Each worker process accepts chat clients on the shared TCP port (SO_REUSEPORT)
+# and forwards new chat messages and announcements to the hub, which records them
+# and publishes them to every worker, the sender's included, in one order. Workers
+# broadcast only what the hub publishes, so every client sees the same order and
+# ids whichever worker it is on.
+#
+# Messages are JSON lines {"type": ..., "payload": ...} over a Unix stream socket.
+# Hub -> worker: state (once, on connect), chatMessage, newAnnouncement, chatHistoryReply.
+# Worker -> hub: chatMessage, createAnnouncement, fetchChatHistory.
+CHAT_BUS_CONNECT_TIMEOUT = 10.0
+
+
+class BusPeer:
+    """One bus connection. send() is thread-safe; messages are written whole."""
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._send_lock = threading.Lock()
+
+    def send(self, message_type, payload):
+        self.send_bytes(encode_json_message(message_type, payload))
+
+    def send_bytes(self, data):
+        with self._send_lock:
+            self.sock.sendall(data)
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def _read_messages(peer, handle):
+    """Calls handle(message_type, payload) for each message until the peer closes.
+       Bus sockets stay blocking: a slow reader holds up the hub's publishes rather
+       than being dropped, and workers leave by closing their end."""
+    reader = MessageReader()
+    while True:
+        try:
+            if not reader.receive(peer.sock):
+                return
+        except OSError:
+            return
+        while True:
+            message = reader.next_message()
+            if message is None:
+                break
+            handle(*message)
+
+
+class ChatBusHub:
+    """Hub end of the bus. handle(worker, message_type, payload) and on_connect(worker)
+       run under the hub lock, so whatever they publish is totally ordered."""
+
+    def __init__(self, path, handle, on_connect, stop_event):
+        self.path = path
+        self.lock = threading.RLock()
+        self.events_published = 0
+        self._handle = handle
+        self._on_connect = on_connect
+        self._stop_event = stop_event
+        self._workers = []
+        self._server = None
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)  # left behind by an earlier run
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self.path)
+        self._server.listen()
+        self._server.settimeout(0.5)
+        threading.Thread(target=self._accept_loop, name="chat-bus", daemon=True).start()
+        return self
+
+    def _accept_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                sock, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                break
+            threading.Thread(target=self._serve_worker, args=(BusPeer(sock),), daemon=True).start()
+        self._server.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _serve_worker(self, worker):
+        with self.lock:
+            self._on_connect(worker)
+            self._workers.append(worker)
+
+        def handle(message_type, payload):
+            with self.lock:
+                try:
+                    self._handle(worker, message_type, payload)
+                except Exception as e:
+                    print(f"Chat Bus: Error handling '{message_type}' from a worker: {e}")
+
+        try:
+            _read_messages(worker, handle)
+        finally:
+            with self.lock:
+                if worker in self._workers:
+                    self._workers.remove(worker)
+            worker.close()
+
+    @property
+    def worker_count(self):
+        with self.lock:
+            return len(self._workers)
+
+    def publish(self, message_type, payload):
+        """Sends a message to every connected worker."""
+        data = encode_json_message(message_type, payload)
+        with self.lock:
+            for worker in list(self._workers):
+                try:
+                    worker.send_bytes(data)
+                except OSError as e:
+                    print(f"Chat Bus: Dropping worker after send error: {e}")
+                    self._workers.remove(worker)
+                    worker.close()
+            self.events_published += 1
+
+
+class ChatBusClient(BusPeer):
+    """Worker end of the bus. handle(message_type, payload) runs on the bus reader thread."""
+
+    def __init__(self, path, handle, stop_event):
+        self.path = path
+        self._handle = handle
+        self._stop_event = stop_event
+        super().__init__(None)
+
+    def connect(self, timeout=CHAT_BUS_CONNECT_TIMEOUT):
+        """Connects to the hub, retrying while it starts up."""
+        deadline = time.time() + timeout
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(self.path)
+                break
+            except OSError:
+                sock.close()
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.1)
+        self.sock = sock
+        return self
+
+    def start(self):
+        """Reads hub messages on a thread; losing the hub stops this worker."""
+        def run():
+            _read_messages(self, self._handle)
+            if not self._stop_event.is_set():
+                print("Chat Bus: Lost connection to the hub, stopping worker.")
+                self._stop_event.set()
+
+        threading.Thread(target=run, name="chat-bus", daemon=True).start()
+        return self
@@ -0,0 +1,350 @@
+import bisect
+import datetime
+import json
+import os
+import struct
+import threading
+
+
+# Durable append-only chat log.
+#
+# <log_dir>/chat-<first id>.log  one JSON chat message per line, ids increasing
+# <log_dir>/chat-<first id>.idx  sparse index: one CHAT_INDEX_ENTRY per
+#                                CHAT_LOG_INDEX_INTERVAL messages (and the first)
+#   CHAT_INDEX_ENTRY: message id (8 bytes), unix timestamp (8, double), byte offset (8)
+#
+# Appends are queued and written by one commit thread, which writes everything
+# queued since its last commit and fsyncs once (group commit), so chat handlers
+# never wait for the disk. A segment is closed and a new one started once it
+# passes segment_bytes. Reads seek to the nearest index entry and scan a few lines,
+# so only the sparse indexes are kept in memory. A crash can leave a partial last
+# line; opening the log truncates it and rebuilds the last segment's index. A commit
+# that fails (e.g. disk full) is rolled back by truncating the segment to where the
+# batch started, so later commits never follow torn bytes; if even that fails, the
+# log stops taking messages until the server restarts.
+CHAT_LOG_PREFIX = "chat-"
+CHAT_LOG_SUFFIX = ".log"
+CHAT_LOG_INDEX_SUFFIX = ".idx"
+CHAT_INDEX_ENTRY = struct.Struct('!QdQ')
+CHAT_LOG_INDEX_INTERVAL = 64
+
+
+def message_time(message):
+    """Unix time of a chat message's ISO timestamp, 0.0 if it has none."""
+    try:
+        return datetime.datetime.fromisoformat(message["timestamp"]).timestamp()
+    except (KeyError, TypeError, ValueError):
+        return 0.0
+
+
+class _Segment:
+    __slots__ = ("first_id", "path", "index_path", "size", "ids", "times", "offsets", "since_index")
+
+    def __init__(self, log_dir, first_id):
+        self.first_id = first_id
+        base = os.path.join(log_dir, f"{CHAT_LOG_PREFIX}{first_id:012d}")
+        self.path = base + CHAT_LOG_SUFFIX
+        self.index_path = base + CHAT_LOG_INDEX_SUFFIX
+        self.size = 0
+        self.ids = []        # sparse index, parallel lists
+        self.times = []
+        self.offsets = []
+        self.since_index = 0  # messages written since the last index entry
+
+    def add_index_entry(self, message_id, timestamp, offset):
+        self.ids.append(message_id)
+        self.times.append(timestamp)
+        self.offsets.append(offset)
+        self.since_index = 0
+
+
+class ChatLog:
+    """Append-only, segment-rotated chat message log with a sparse id/time index."""
+
+    def __init__(self, log_dir, segment_bytes=8 * 1024 * 1024, index_interval=CHAT_LOG_INDEX_INTERVAL):
+        self.log_dir = log_dir
+        self.segment_bytes = segment_bytes
+        self.index_interval = index_interval
+        self.last_id = 0
+        self.commits = 0
+        self.messages_written = 0
+        self.failed = False  # a failed commit could not be rolled back; appends are dropped
+
+        self._segments = []
+        self._lock = threading.Lock()       # segment list and indexes
+        self._cond = threading.Condition()  # pending appends
+        self._pending = []
+        self._closing = False
+        self._data_file = None
+        self._index_file = None
+        self._thread = None
+
+    def open(self):
+        """Loads segment indexes, repairs the last segment and starts the commit thread."""
+        os.makedirs(self.log_dir, exist_ok=True)
+        first_ids = sorted(
+            int(name[len(CHAT_LOG_PREFIX):-len(CHAT_LOG_SUFFIX)])
+            for name in os.listdir(self.log_dir)
+            if name.startswith(CHAT_LOG_PREFIX) and name.endswith(CHAT_LOG_SUFFIX)
+            and name[len(CHAT_LOG_PREFIX):-len(CHAT_LOG_SUFFIX)].isdigit()
+        )
+        for position, first_id in enumerate(first_ids):
+            segment = _Segment(self.log_dir, first_id)
+            segment.size = os.path.getsize(segment.path)
+            if position == len(first_ids) - 1 or not self._load_index(segment):
+                self._rebuild_segment(segment)
+            self._segments.append(segment)
+        while self._segments and not self._segments[-1].size:
+            self._remove_segment(self._segments.pop())
+        if self._segments:
+            self.last_id = self._last_id_in(self._segments[-1])
+            self._open_active(self._segments[-1])
+
+        self._thread = threading.Thread(target=self._commit_loop, name="chat-log", daemon=True)
+        self._thread.start()
+        return self
+
+    def _load_index(self, segment):
+        try:
+            with open(segment.index_path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return False
+        if not data or len(data) % CHAT_INDEX_ENTRY.size:
+            return False
+        for message_id, timestamp, offset in CHAT_INDEX_ENTRY.iter_unpack(data):
+            segment.add_index_entry(message_id, timestamp, offset)
+        return segment.offsets[-1] < segment.size
+
+    def _rebuild_segment(self, segment):
+        """Rescans a segment: truncates a partial or corrupt tail and rewrites its index."""
+        segment.ids, segment.times, segment.offsets = [], [], []
+        segment.since_index = 0
+        entries = []
+        offset = 0
+        with open(segment.path, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    print(f"Chat Log: Truncating '{segment.path}' at byte {offset} (incomplete record).")
+                    break
+                try:
+                    message = json.loads(line)
+                    message_id = message["id"]
+                except (ValueError, KeyError, TypeError):
+                    # Readers skip it too; the complete records after it are kept.
+                    print(f"Chat Log: Skipping a corrupt record in '{segment.path}' at byte {offset}.")
+                    offset += len(line)
+                    continue
+                if not segment.ids or segment.since_index + 1 >= self.index_interval:
+                    segment.add_index_entry(message_id, message_time(message), offset)
+                    entries.append(CHAT_INDEX_ENTRY.pack(message_id, segment.times[-1], offset))
+                else:
+                    segment.since_index += 1
+                offset += len(line)
+        if offset != segment.size:
+            with open(segment.path, 'r+b') as f:
+                f.truncate(offset)
+                os.fsync(f.fileno())
+            segment.size = offset
+        with open(segment.index_path, 'wb') as f:
+            f.write(b''.join(entries))
+            os.fsync(f.fileno())
+
+    def _remove_segment(self, segment):
+        for path in (segment.path, segment.index_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _last_id_in(self, segment):
+        if not segment.ids:
+            return segment.first_id - 1  # no readable records
+        last_id = segment.ids[-1]
+        for message in self._scan([segment], 0, segment.offsets[-1]):
+            last_id = message["id"]
+        return last_id
+
+    def _open_active(self, segment):
+        self._data_file = open(segment.path, 'ab')
+        self._index_file = open(segment.index_path, 'ab')
+
+    @property
+    def first_id(self):
+        with self._lock:
+            return self._segments[0].first_id if self._segments else None
+
+    def has_before(self, message_id):
+        """True if the log holds messages with ids below message_id."""
+        first_id = self.first_id
+        return first_id is not None and first_id < message_id
+
+    def append(self, message):
+        """Queues a chat message (with an "id" above every earlier one) for the next commit."""
+        with self._cond:
+            self._pending.append(message)
+            self._cond.notify()
+
+    def close(self):
+        """Commits everything queued and stops the commit thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join()
+        for f in (self._data_file, self._index_file):
+            if f is not None:
+                f.close()
+
+    def _commit_loop(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closing:
+                    self._cond.wait()
+                batch, self._pending = self._pending, []
+                closing = self._closing
+            if batch and not self.failed:
+                try:
+                    self._commit(batch)
+                except OSError as e:
+                    print(f"Chat Log: Error writing {len(batch)} messages to '{self.log_dir}': {e}")
+            if closing:
+                with self._cond:
+                    if not self._pending:
+                        return
+
+    def _commit(self, batch):
+        segment = self._segments[-1] if self._segments else None
+        rollback = self._rollback_point(segment)
+        data, index, new_entries = [], [], []
+        last_id = None
+        for message in batch:
+            line = (json.dumps(message, ensure_ascii=False) + '\n').encode('utf-8')
+            if segment is None or (segment.size and segment.size + len(line) > self.segment_bytes):
+                if segment is not None:
+                    self._write_segment(segment, rollback, data, index, new_entries, last_id)
+                    data, index, new_entries = [], [], []
+                    self._data_file.close()
+                    self._index_file.close()
+                segment = _Segment(self.log_dir, message["id"])
+                with self._lock:
+                    self._segments.append(segment)
+                self._open_active(segment)
+                rollback = self._rollback_point(segment)
+            if not segment.size or segment.since_index + 1 >= self.index_interval:
+                timestamp = message_time(message)
+                index.append(CHAT_INDEX_ENTRY.pack(message["id"], timestamp, segment.size))
+                new_entries.append((message["id"], timestamp, segment.size))
+                segment.since_index = 0
+            else:
+                segment.since_index += 1
+            data.append(line)
+            segment.size += len(line)
+            last_id = message["id"]
+        self._write_segment(segment, rollback, data, index, new_entries, last_id)
+        self.commits += 1
+
+    def _rollback_point(self, segment):
+        """(data size, since_index, index size) of the active segment before a batch is written."""
+        if segment is None:
+            return None
+        return segment.size, segment.since_index, os.fstat(self._index_file.fileno()).st_size
+
+    def _write_segment(self, segment, rollback, data, index, new_entries, last_id):
+        """Writes and fsyncs one segment's part of a batch, then publishes its index entries
+           (readers only see index entries whose data is on disk). On failure the segment's
+           files are truncated back to rollback and the error is re-raised."""
+        try:
+            self._write_and_sync(data, index)
+        except OSError:
+            self._roll_back(segment, rollback)
+            raise
+        with self._lock:
+            for message_id, timestamp, offset in new_entries:
+                segment.ids.append(message_id)
+                segment.times.append(timestamp)
+                segment.offsets.append(offset)
+        self.last_id = last_id
+        self.messages_written += len(data)
+
+    def _roll_back(self, segment, rollback):
+        size, since_index, index_size = rollback
+        segment.size, segment.since_index = size, since_index
+        # Closing drops whatever the failed write left buffered; the files are then
+        # cut back to the batch's start and reopened for the next commit.
+        for f in (self._data_file, self._index_file):
+            try:
+                f.close()
+            except OSError:
+                pass
+        try:
+            os.truncate(segment.path, size)
+            os.truncate(segment.index_path, index_size)
+            self._open_active(segment)
+        except OSError as e:
+            self.failed = True
+            print(f"Chat Log: Could not roll back '{segment.path}' after a failed write ({e}); "
+                  f"chat is not logged until the server restarts.")
+
+    def _write_and_sync(self, data, index):
+        self._data_file.write(b''.join(data))
+        self._data_file.flush()
+        os.fsync(self._data_file.fileno())
+        if index:
+            self._index_file.write(b''.join(index))
+            self._index_file.flush()
+            os.fsync(self._index_file.fileno())
+
+    def _scan(self, segments, position, offset):
+        """Yields complete messages from byte offset of segments[position] on, across later segments."""
+        for segment in segments[position:]:
+            with open(segment.path, 'rb') as f:
+                f.seek(offset)
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        return
+                    try:
+                        message = json.loads(line)
+                    except ValueError:
+                        continue  # a corrupt record, e.g. left by a failed write
+                    if isinstance(message, dict) and "id" in message:
+                        yield message
+            offset = 0
+
+    def _indexed_segments(self):
+        with self._lock:
+            return [s for s in self._segments if s.ids]
+
+    def read_before(self, before_id, limit):
+        """Returns (messages, has_more): up to limit committed messages with ids below
+           before_id, oldest first; has_more tells whether older messages exist."""
+        segments = self._indexed_segments()
+        if not segments or limit <= 0:
+            return [], False
+        first_id = segments[0].first_id
+        before_id = min(before_id, self.last_id + 1)
+        start_id = max(first_id, before_id - limit)
+        position = max(0, bisect.bisect_right([s.first_id for s in segments], start_id) - 1)
+        segment = segments[position]
+        offset = segment.offsets[max(0, bisect.bisect_right(segment.ids, start_id) - 1)]
+
+        messages = []
+        for message in self._scan(segments, position, offset):
+            if message["id"] >= before_id:
+                break
+            if message["id"] >= start_id:
+                messages.append(message)
+        return messages, start_id > first_id
+
+    def id_at_time(self, timestamp):
+        """Id of the first committed message at or after a unix timestamp (last id + 1 if none)."""
+        segments = self._indexed_segments()
+        entries = [(t, position, offset) for position, s in enumerate(segments) for t, offset in zip(s.times, s.offsets)]
+        entry = bisect.bisect_left(entries, (timestamp,))
+        if entries:
+            # Messages between the previous index entry and this one may already be new enough.
+            _, position, offset = entries[max(0, entry - 1)]
+            for message in self._scan(segments, position, offset):
+                if message_time(message) >= timestamp:
+                    return message["id"]
+        return self.last_id + 1
@@ -0,0 +1,255 @@
+import collections
+import itertools
+import selectors
+import socket
+import threading
+import time
+
+
+# Bounded per-connection outbound queues for the chat server.
+#
+# Every message for a client is queued and written without blocking, so one slow
+# viewer only ever fills its own queue. When a queue would grow past its byte
+# limit the connection's overflow policy decides what gives:
+#   drop_oldest - drop the oldest queued chat messages; other messages are never dropped
+#   disconnect  - close the connection
+#   coalesce    - replace every queued chat message with one snapshot message
+# If a queue is still over its limit after dropping what it may, the connection is closed.
+# Unbounded messages (the initial state sent on connect) are queued outside the limit,
+# so a long announcement list can't push a new client over it before it reads anything.
+OUTBOUND_POLICIES = ("drop_oldest", "disconnect", "coalesce")
+
+# Largest single write handed to a socket or transport.
+OUTBOUND_WRITE_CHUNK = 64 * 1024
+
+
+class OutboundQueue:
+    """Thread-safe bounded queue of encoded messages waiting to be written to one connection."""
+
+    def __init__(self, max_bytes, policy="drop_oldest", snapshot=None):
+        if policy not in OUTBOUND_POLICIES:
+            raise ValueError(f"Unknown outbound queue policy: {policy}")
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self._snapshot = snapshot      # callable returning encoded bytes, for "coalesce"
+        self._items = collections.deque()  # [data, droppable, bounded]
+        self._bytes = 0                # queued bytes of bounded messages
+        self._unbounded_bytes = 0
+        self._head_offset = 0          # bytes of the first item already written
+        self._lock = threading.Lock()
+
+        self.max_depth = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.writes = 0
+        self.bytes_written = 0
+
+    @property
+    def depth(self):
+        return len(self._items)
+
+    @property
+    def queued_bytes(self):
+        return self._bytes + self._unbounded_bytes - self._head_offset
+
+    def push(self, data, droppable=False, bounded=True):
+        """Queues a message. Returns False if the connection must be closed (overflow).
+           An unbounded message is always queued and doesn't count towards max_bytes."""
+        with self._lock:
+            if not bounded:
+                self._append(data, False, False)
+                return True
+            if self._bytes and self._bytes + len(data) > self.max_bytes:
+                if self.policy == "disconnect":
+                    return False
+                if self.policy == "coalesce" and self._snapshot is not None:
+                    self._drop_queued_chat()
+                    self.coalesced += 1
+                    snapshot = self._snapshot()
+                    self._append(snapshot, True, True)
+                    if droppable:
+                        return self._bytes <= self.max_bytes  # the snapshot already holds it
+                else:
+                    self._drop_queued_chat(len(data))
+                if self._bytes and self._bytes + len(data) > self.max_bytes:
+                    if droppable:
+                        self.dropped += 1
+                        return True
+                    return False
+            self._append(data, droppable, True)
+            return True
+
+    def _append(self, data, droppable, bounded):
+        self._items.append([data, droppable, bounded])
+        if bounded:
+            self._bytes += len(data)
+        else:
+            self._unbounded_bytes += len(data)
+        if len(self._items) > self.max_depth:
+            self.max_depth = len(self._items)
+
+    def _drop_queued_chat(self, room_needed=None):
+        """Drops queued chat messages oldest first (all of them when room_needed is None).
+           A partly written head message is kept."""
+        kept = collections.deque()
+        for index, item in enumerate(self._items):
+            data, droppable, _ = item
+            enough_room = room_needed is not None and self._bytes + room_needed <= self.max_bytes
+            if droppable and not enough_room and not (index == 0 and self._head_offset):
+                self._bytes -= len(data)
+                self.dropped += 1
+            else:
+                kept.append(item)
+        self._items = kept
+
+    def peek_chunk(self, max_bytes=OUTBOUND_WRITE_CHUNK):
+        """Returns up to max_bytes of queued data (several messages joined), or b'' if empty."""
+        with self._lock:
+            if not self._items:
+                return b''
+            parts = [memoryview(self._items[0][0])[self._head_offset:]]
+            size = len(parts[0])
+            for data, _, _ in itertools.islice(self._items, 1, None):
+                if size + len(data) > max_bytes:
+                    break
+                parts.append(data)
+                size += len(data)
+            return parts[0].tobytes() if len(parts) == 1 else b''.join(parts)
+
+    def consume(self, written):
+        """Removes written bytes from the front of the queue; called once per socket write."""
+        with self._lock:
+            self.writes += 1
+            self.bytes_written += written
+            written += self._head_offset
+            while self._items and written >= len(self._items[0][0]):
+                data, _, bounded = self._items.popleft()
+                written -= len(data)
+                if bounded:
+                    self._bytes -= len(data)
+                else:
+                    self._unbounded_bytes -= len(data)
+            self._head_offset = written if self._items else 0
+
+
+class SocketWriter:
+    """Drains the outbound queues of blocking-mode chat connections from one thread.
+
+    Connections call notify() after queueing. Each has a non-blocking duplicate of its
+    socket (write_sock) and a flush() method that writes until the socket would block
+    and returns True while data remains; those wait on a selector for writability.
+    """
+
+    def __init__(self, stop_event, poll_interval=0.5):
+        self._stop_event = stop_event
+        self._poll_interval = poll_interval
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._signaled = False
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def notify(self, connection):
+        with self._lock:
+            self._pending.add(connection)
+            if self._signaled:
+                return
+            self._signaled = True
+        try:
+            self._wake_w.send(b'\0')
+        except OSError:
+            pass
+
+    def _drain_wakeup(self):
+        with self._lock:
+            self._signaled = False
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except (BlockingIOError, OSError):
+            pass
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._drain_wakeup()
+            with self._lock:
+                pending = list(self._pending)
+                self._pending.clear()
+            blocked = [connection for connection in pending if connection.flush()]
+            with self._lock:
+                self._pending.update(blocked)
+
+            # Sockets come and go, so the selector is rebuilt each round instead of
+            # keeping registrations for closed file descriptors.
+            with selectors.DefaultSelector() as selector:
+                selector.register(self._wake_r, selectors.EVENT_READ)
+                for connection in blocked:
+                    try:
+                        selector.register(connection.write_sock, selectors.EVENT_WRITE)
+                    except (ValueError, KeyError, OSError):
+                        pass
+                selector.select(self._poll_interval)
+
+        for sock in (self._wake_r, self._wake_w):
+            sock.close()
+
+
+class BroadcastBatcher:
+    """Gathers items for up to `window` seconds and delivers them together.
+
+    The first item added to an empty batch starts the window; deliver(items) is then
+    called once, from the batcher's thread, with every item added in the meantime.
+    """
+
+    def __init__(self, window, deliver, stop_event):
+        self.window = window
+        self._deliver = deliver
+        self._stop_event = stop_event
+        self._items = []
+        self._deadline = None
+        self._cond = threading.Condition()
+        self._deliver_lock = threading.Lock()  # batches are delivered one at a time, in order
+        self._thread = threading.Thread(target=self._run, name="chat-batcher", daemon=True)
+
+        self.batches = 0
+        self.items_delivered = 0
+
+    def start(self):
+        self._thread.start()
+
+    def add(self, item, urgent=False):
+        """Queues an item; urgent delivers it, and everything queued before it, without waiting."""
+        with self._cond:
+            self._items.append(item)
+            if urgent:
+                self._deadline = time.monotonic()
+                self._cond.notify()
+            elif self._deadline is None:
+                self._deadline = time.monotonic() + self.window
+                self._cond.notify()
+
+    def _deliver_pending(self):
+        with self._deliver_lock:
+            with self._cond:
+                items, self._items = self._items, []
+                self._deadline = None
+            if items:
+                self.batches += 1
+                self.items_delivered += len(items)
+                self._deliver(items)
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            with self._cond:
+                if self._deadline is None:
+                    self._cond.wait(0.5)
+                    continue
+                remaining = self._deadline - time.monotonic()
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            self._deliver_pending()
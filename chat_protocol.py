@@ -0,0 +1,378 @@
+import collections
+import datetime
+import json
+import struct
+import threading
+
+
+# Framing of the TCP chat/announcement protocol.
+#
+# Every connection starts with newline-delimited JSON, {"type": ..., "payload": ...}
+# per line. A client that supports the binary framing sends
+#   {"type": "hello", "payload": {"framing": ["binary1"]}}
+# as its first line and then waits. The server answers with the JSON line
+#   {"type": "framing", "payload": {"framing": "binary1"}}
+# after which both directions use binary frames; anything the server sent before
+# that line (initial state) is still JSON. Servers without binary framing answer
+# hello with a serverError, and the client stays on JSON lines.
+#
+# A binary frame is a varint body length followed by the body:
+#   message type  varint: index + 1 into BINARY_MESSAGE_TYPES, or 0 and a string
+#   payload       one value
+# Values start with a one-byte tag (VALUE_*). Dict keys are a varint: index + 1
+# into BINARY_KEYS, or 0 and a string. Integers are zigzag varints, strings a
+# varint length and UTF-8. ISO timestamps that round-trip exactly are varint
+# microseconds since 1970 (VALUE_TIMESTAMP). Recently used sender names are
+# interned: a defineSenders frame [[id, name], ...] precedes the first frame that
+# refers to them on each connection, then VALUE_SENDER carries the id alone. The
+# server reuses the ids of names it has not seen for a while, so a later
+# defineSenders may give an id a new name.
+# Both lists are append-only; new entries need a new framing name.
+FRAMING_JSON = "json"
+FRAMING_BINARY = "binary1"
+
+BINARY_MESSAGE_TYPES = (
+    "chatMessage", "chatBatch", "loadOldChatMessages", "newAnnouncement", "loadOldAnnouncements",
+    "createAnnouncement", "announcementError", "serverError", "fetchChatHistory", "chatHistoryPage",
+    "defineSenders", "hello", "framing",
+)
+BINARY_KEYS = (
+    "type", "payload", "sender", "sender_id", "message", "timestamp", "id", "before", "before_time",
+    "limit", "has_more", "messages", "framing",
+)
+SENDER_KEYS = ("sender", "sender_id")
+# Sender names a SenderTable keeps ids for; the least recently used one gives up its id.
+SENDER_TABLE_SIZE = 1024
+
+VALUE_NULL = 0
+VALUE_FALSE = 1
+VALUE_TRUE = 2
+VALUE_INT = 3
+VALUE_FLOAT = 4
+VALUE_STR = 5
+VALUE_LIST = 6
+VALUE_DICT = 7
+VALUE_TIMESTAMP = 8
+VALUE_SENDER = 9
+
+_MESSAGE_TYPE_CODES = {name: i + 1 for i, name in enumerate(BINARY_MESSAGE_TYPES)}
+_KEY_CODES = {name: i + 1 for i, name in enumerate(BINARY_KEYS)}
+_FLOAT = struct.Struct('!d')
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+class ProtocolError(ValueError):
+    """A malformed message; the reader has already skipped past it."""
+
+
+class FrameTooLarge(ValueError):
+    """A message longer than the reader's max_frame_bytes; the stream cannot be read further."""
+
+
+def encode_json_message(message_type, payload):
+    """Encodes one newline-delimited JSON protocol message."""
+    return json.dumps({"type": message_type, "payload": payload}).encode('utf-8') + b'\n'
+
+
+def _write_varint(out, value):
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, pos, end):
+    result = shift = 0
+    while True:
+        if pos >= end:
+            raise IndexError("truncated varint")
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ProtocolError("varint too long")
+
+
+def _write_str(out, text):
+    raw = text.encode('utf-8')
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _timestamp_micros(text):
+    """Microseconds since 1970 if text is a naive ISO timestamp that round-trips exactly, else None."""
+    try:
+        dt = datetime.datetime.fromisoformat(text)
+    except ValueError:
+        return None
+    if dt.tzinfo is not None or dt < _EPOCH or dt.isoformat() != text:
+        return None
+    return (dt - _EPOCH) // _MICROSECOND
+
+
+class SenderTable:
+    """Server-wide sender name -> id interning table (thread-safe).
+
+    Holds at most `capacity` names; interning a new name when full hands it the id of
+    the least recently used one, so client-chosen names can't grow the table.
+    """
+
+    def __init__(self, capacity=SENDER_TABLE_SIZE):
+        self.capacity = capacity
+        self._ids = collections.OrderedDict()  # name -> id, least recently used first
+        self._lock = threading.Lock()
+
+    def intern(self, name):
+        with self._lock:
+            sender_id = self._ids.get(name)
+            if sender_id is not None:
+                self._ids.move_to_end(name)
+            elif len(self._ids) < self.capacity:
+                sender_id = self._ids[name] = len(self._ids)
+            else:
+                _, sender_id = self._ids.popitem(last=False)
+                self._ids[name] = sender_id
+        return sender_id
+
+
+def _write_value(out, value, senders, used_senders, key=None):
+    if isinstance(value, str):
+        if senders is not None and key in SENDER_KEYS:
+            sender_id = senders.intern(value)
+            # A frame with more senders than the table holds can see an id reused; the
+            # later names are then written out.
+            if used_senders.setdefault(sender_id, value) == value:
+                out.append(VALUE_SENDER)
+                _write_varint(out, sender_id)
+                return
+        if key == "timestamp":
+            micros = _timestamp_micros(value)
+            if micros is not None:
+                out.append(VALUE_TIMESTAMP)
+                _write_varint(out, micros)
+                return
+        out.append(VALUE_STR)
+        _write_str(out, value)
+    elif value is None:
+        out.append(VALUE_NULL)
+    elif value is True:
+        out.append(VALUE_TRUE)
+    elif value is False:
+        out.append(VALUE_FALSE)
+    elif isinstance(value, int):
+        out.append(VALUE_INT)
+        _write_varint(out, (value << 1) if value >= 0 else ((-value << 1) - 1))
+    elif isinstance(value, float):
+        out.append(VALUE_FLOAT)
+        out += _FLOAT.pack(value)
+    elif isinstance(value, dict):
+        out.append(VALUE_DICT)
+        _write_varint(out, len(value))
+        for k, v in value.items():
+            code = _KEY_CODES.get(k)
+            if code is None:
+                out.append(0)
+                _write_str(out, k)
+            else:
+                out.append(code)
+            _write_value(out, v, senders, used_senders, k)
+    elif isinstance(value, (list, tuple)):
+        out.append(VALUE_LIST)
+        _write_varint(out, len(value))
+        for item in value:
+            _write_value(out, item, senders, used_senders)
+    else:
+        raise TypeError(f"Cannot encode {type(value).__name__} in a binary frame")
+
+
+def encode_binary_message(message_type, payload, senders=None):
+    """Encodes one binary frame. Returns (frame bytes, {sender id: name} for the interned
+       senders it refers to); with senders=None names are written out in full and the dict is empty."""
+    body = bytearray()
+    code = _MESSAGE_TYPE_CODES.get(message_type)
+    if code is None:
+        body.append(0)
+        _write_str(body, message_type)
+    else:
+        body.append(code)
+    used_senders = {}
+    _write_value(body, payload, senders, used_senders)
+    frame = bytearray()
+    _write_varint(frame, len(body))
+    frame += body
+    return bytes(frame), used_senders
+
+
+def encode_sender_definitions(definitions):
+    """The defineSenders frame a connection needs before frames using definitions ({id: name})."""
+    frame, _ = encode_binary_message("defineSenders", [[i, definitions[i]] for i in sorted(definitions)])
+    return frame
+
+
+class BinaryDecoder:
+    """Decodes binary frame bodies; remembers sender definitions for its connection."""
+
+    def __init__(self):
+        self.senders = {}
+
+    def decode(self, data, pos, end):
+        """Returns (message_type, payload) for the body data[pos:end], or None for a
+           defineSenders frame, which is applied here."""
+        try:
+            code, pos = _read_varint(data, pos, end)
+            if code == 0:
+                length, pos = _read_varint(data, pos, end)
+                message_type = bytes(data[pos:pos + length]).decode('utf-8')
+                pos += length
+            else:
+                message_type = BINARY_MESSAGE_TYPES[code - 1]
+            payload, pos = self._read_value(data, pos, end)
+        except (IndexError, KeyError, UnicodeDecodeError, struct.error) as e:
+            raise ProtocolError(f"Malformed binary frame: {e}") from None
+        if pos != end:
+            raise ProtocolError("Trailing bytes in binary frame")
+        if message_type == "defineSenders":
+            for sender_id, name in payload:
+                self.senders[sender_id] = name
+            return None
+        return message_type, payload
+
+    def _read_value(self, data, pos, end):
+        if pos >= end:
+            raise IndexError("truncated value")
+        tag = data[pos]
+        pos += 1
+        if tag == VALUE_STR:
+            length, pos = _read_varint(data, pos, end)
+            if pos + length > end:
+                raise IndexError("truncated string")
+            return bytes(data[pos:pos + length]).decode('utf-8'), pos + length
+        if tag == VALUE_DICT:
+            count, pos = _read_varint(data, pos, end)
+            result = {}
+            for _ in range(count):
+                code, pos = _read_varint(data, pos, end)
+                if code == 0:
+                    length, pos = _read_varint(data, pos, end)
+                    key = bytes(data[pos:pos + length]).decode('utf-8')
+                    pos += length
+                else:
+                    key = BINARY_KEYS[code - 1]
+                result[key], pos = self._read_value(data, pos, end)
+            return result, pos
+        if tag == VALUE_LIST:
+            count, pos = _read_varint(data, pos, end)
+            result = []
+            for _ in range(count):
+                item, pos = self._read_value(data, pos, end)
+                result.append(item)
+            return result, pos
+        if tag == VALUE_INT:
+            value, pos = _read_varint(data, pos, end)
+            return (value >> 1) ^ -(value & 1), pos
+        if tag == VALUE_SENDER:
+            sender_id, pos = _read_varint(data, pos, end)
+            return self.senders[sender_id], pos
+        if tag == VALUE_TIMESTAMP:
+            micros, pos = _read_varint(data, pos, end)
+            return (_EPOCH + micros * _MICROSECOND).isoformat(), pos
+        if tag == VALUE_NULL:
+            return None, pos
+        if tag == VALUE_TRUE:
+            return True, pos
+        if tag == VALUE_FALSE:
+            return False, pos
+        if tag == VALUE_FLOAT:
+            if pos + _FLOAT.size > end:
+                raise IndexError("truncated float")
+            return _FLOAT.unpack_from(data, pos)[0], pos + _FLOAT.size
+        raise ProtocolError(f"Unknown value tag {tag}")
+
+
+class MessageReader:
+    """Splits a received byte stream into (message_type, payload) messages.
+
+    framing starts as FRAMING_JSON and may be switched to FRAMING_BINARY between
+    messages; bytes already buffered after the switch point are read as binary.
+    Work is linear in the bytes received however a message is split: consumed
+    bytes are dropped only once they are half the buffer, and a partial JSON line
+    is not searched again for its newline. A message over max_frame_bytes raises
+    FrameTooLarge as soon as that is known, so a peer cannot make it buffer more.
+    """
+
+    def __init__(self, max_frame_bytes=None, recv_size=65536):
+        self.framing = FRAMING_JSON
+        self.decoder = BinaryDecoder()
+        self.max_frame_bytes = max_frame_bytes
+        self._buffer = bytearray()
+        self._pos = 0   # start of the first unread message
+        self._scan = 0  # the current JSON line has no newline before this offset
+        self.recv_size = recv_size
+        self._recv_buffer = None  # allocated by the first receive(); feed()-only readers never need it
+
+    def feed(self, data):
+        if self._pos and self._pos >= len(self._buffer) // 2:
+            del self._buffer[:self._pos]
+            self._scan = max(0, self._scan - self._pos)
+            self._pos = 0
+        self._buffer += data
+
+    def receive(self, sock):
+        """Reads once from sock into a reusable buffer and feeds the bytes. Returns the
+           number of bytes read, 0 at end of stream; socket errors propagate."""
+        if self._recv_buffer is None:
+            self._recv_buffer = memoryview(bytearray(self.recv_size))
+        count = sock.recv_into(self._recv_buffer)
+        if count:
+            self.feed(self._recv_buffer[:count])
+        return count
+
+    def buffered_bytes(self):
+        return len(self._buffer) - self._pos
+
+    def next_message(self):
+        """Returns the next complete message, or None if more data is needed.
+           Raises ProtocolError for a malformed message, after skipping it."""
+        while True:
+            if self.framing == FRAMING_JSON:
+                return self._next_json()
+            message = self._next_binary()
+            if message is not False:
+                return message
+
+    def _check_size(self, size):
+        if self.max_frame_bytes is not None and size > self.max_frame_bytes:
+            raise FrameTooLarge(f"Message of {size} bytes or more exceeds the {self.max_frame_bytes} byte limit")
+
+    def _next_json(self):
+        end = self._buffer.find(b'\n', max(self._pos, self._scan))
+        if end < 0:
+            self._scan = len(self._buffer)
+            self._check_size(self.buffered_bytes())
+            return None
+        self._check_size(end - self._pos)
+        line = self._buffer[self._pos:end]
+        self._pos = self._scan = end + 1
+        try:
+            message = json.loads(line)
+            return message.get("type"), message.get("payload")
+        except (ValueError, AttributeError):
+            raise ProtocolError(f"Invalid JSON line: {bytes(line[:200])!r}") from None
+
+    def _next_binary(self):
+        """Returns a message, None if incomplete, or False after a defineSenders frame."""
+        try:
+            length, body_start = _read_varint(self._buffer, self._pos, len(self._buffer))
+        except IndexError:
+            return None
+        self._check_size(length)
+        end = body_start + length
+        if end > len(self._buffer):
+            return None
+        self._pos = end
+        message = self.decoder.decode(self._buffer, body_start, end)
+        return False if message is None else message
@@ -0,0 +1,146 @@
+import socket
+import threading
+import time
+
+from chat_protocol import FRAMING_BINARY, FRAMING_JSON, MessageReader, encode_binary_message, encode_json_message
+
+
+# Chat connection from a relay server to its upstream server (RELAY_UPSTREAM_HOST in
+# combined_server.py). The relay is an ordinary chat client of the upstream: it offers
+# the binary framing, receives the initial state and every broadcast, and passes on
+# the chat messages and history requests of its own clients. Only the origin stamps
+# chat ids, so every server in a relay tree shows the same messages with the same ids.
+UPSTREAM_CONNECT_TIMEOUT = 5.0
+UPSTREAM_HELLO_TIMEOUT = 5.0
+UPSTREAM_RECONNECT_DELAY = 2.0
+UPSTREAM_MAX_MESSAGE_BYTES = 64 * 1024 * 1024  # the upstream's initial state can be large
+
+
+class UpstreamChatClient:
+    """Keeps a chat connection to host:port open, reconnecting, until stop_event is set.
+       on_connect() and handle(message_type, payload) run on the client's thread:
+       on_connect() once per connection, before anything from it is handled."""
+
+    def __init__(self, host, port, handle, on_connect, stop_event, binary_framing=True):
+        self.host = host
+        self.port = port
+        self.binary_framing = binary_framing
+        self.connected = False
+        self._handle = handle
+        self._on_connect = on_connect
+        self._stop_event = stop_event
+        self._sock = None
+        self._framing = FRAMING_JSON
+        self._send_lock = threading.Lock()
+
+    def start(self):
+        threading.Thread(target=self._run, name="chat-upstream", daemon=True).start()
+        return self
+
+    def send(self, message_type, payload):
+        """Sends a message upstream in the negotiated framing. Returns False if there is no connection."""
+        with self._send_lock:
+            if not self.connected:
+                return False
+            if self._framing == FRAMING_BINARY:
+                data, _ = encode_binary_message(message_type, payload)
+            else:
+                data = encode_json_message(message_type, payload)
+            try:
+                self._sock.sendall(data)
+            except OSError as e:
+                # The reader thread sees the broken connection and reconnects.
+                print(f"Chat Upstream: Error sending '{message_type}': {e}")
+                return False
+        return True
+
+    def close(self):
+        with self._send_lock:
+            sock, self._sock, self.connected = self._sock, None, False
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+    def _run(self):
+        failures = 0
+        while not self._stop_event.is_set():
+            try:
+                sock = socket.create_connection((self.host, self.port), timeout=UPSTREAM_CONNECT_TIMEOUT)
+            except OSError as e:
+                if failures == 0:
+                    print(f"Chat Upstream: Could not connect to {self.host}:{self.port}, retrying: {e}")
+                failures += 1
+                self._stop_event.wait(UPSTREAM_RECONNECT_DELAY)
+                continue
+            failures = 0
+            print(f"Chat Upstream: Connected to {self.host}:{self.port}")
+            try:
+                self._serve(sock)
+            except (OSError, ValueError) as e:
+                if not self._stop_event.is_set():
+                    print(f"Chat Upstream: Lost connection to {self.host}:{self.port}: {e}")
+            finally:
+                self.close()
+                sock.close()
+            self._stop_event.wait(UPSTREAM_RECONNECT_DELAY)
+        print("Chat Upstream: Thread exited.")
+
+    def _serve(self, sock):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sock.settimeout(1.0)
+        reader = MessageReader(UPSTREAM_MAX_MESSAGE_BYTES)
+        self._on_connect()
+        early_messages = self._negotiate_framing(sock, reader)
+        with self._send_lock:
+            self._sock, self._framing, self.connected = sock, reader.framing, True
+        for message in early_messages:
+            self._dispatch(*message)
+
+        while not self._stop_event.is_set():
+            try:
+                if not reader.receive(sock):
+                    print(f"Chat Upstream: {self.host}:{self.port} closed the connection.")
+                    return
+            except socket.timeout:
+                continue
+            while True:
+                message = reader.next_message()
+                if message is None:
+                    break
+                self._dispatch(*message)
+
+    def _negotiate_framing(self, sock, reader):
+        """Offers the binary framing and waits for the answer, like combined_client.py.
+           Returns the messages (the initial state) that arrived before it."""
+        if not self.binary_framing:
+            return []
+        sock.sendall(encode_json_message("hello", {"framing": [FRAMING_BINARY]}))
+        early_messages = []
+        deadline = time.time() + UPSTREAM_HELLO_TIMEOUT
+        while time.time() < deadline:
+            message = reader.next_message()
+            if message is None:
+                try:
+                    if not reader.receive(sock):
+                        raise ConnectionResetError("Upstream closed the connection during the handshake.")
+                except socket.timeout:
+                    pass
+                continue
+            message_type, payload = message
+            if message_type == "framing":
+                if payload.get("framing") == FRAMING_BINARY:
+                    reader.framing = FRAMING_BINARY
+                return early_messages
+            if message_type == "serverError":
+                return early_messages
+            early_messages.append(message)
+        print("Chat Upstream: No answer to the framing hello, using JSON lines.")
+        return early_messages
+
+    def _dispatch(self, message_type, payload):
+        try:
+            self._handle(message_type, payload)
+        except Exception as e:
+            print(f"Chat Upstream: Error handling '{message_type}': {e}")
@@ -3,14 +3,19 @@ from tkinter import scrolledtext
 from tkinter import messagebox
 from tkinter import simpledialog  
 import socket
-import json
 import threading
+import bisect
+import collections
 import datetime
 import time
 import cv2
 import numpy as np
-from collections import defaultdict
 import sys 
+from chat_protocol import (FRAMING_BINARY, FRAMING_JSON, MessageReader, ProtocolError, encode_binary_message,
+                           encode_json_message)
+from video_protocol import (FLAG_DELTA, FLAG_PARITY, MAX_VIDEO_FRAME_BYTES, VIDEO_HEADER_SIZE, format_nack_messages,
+                            parse_delta_payload, parse_packet_header)
+from video_fec import FEC_NONE, FEC_XOR, recover_group
 
 
 TCP_HOST = '192.168.100.199' 
@@ -23,24 +28,401 @@ DEFAULT_UDP_VIDEO_CLIENT_PORT = 5001
 
 MAX_UDP_PACKET_SIZE = 65000
 BUFFER_SIZE = 65536 
+# Frames are reassembled in recycled buffers (FrameBufferPool): free buffers kept per size class.
+FRAME_BUFFER_POOL_SIZE = 8
+FRAME_BUFFER_MIN_BYTES = 64 * 1024
+# MTU-sized packets mean hundreds of datagrams per frame; give the kernel room to queue a few frames.
+UDP_RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
+# Offer to receive video by multicast (VIDEO_HELLO multicast=1). A server in multicast
+# mode answers with the group to join (VIDEO_MULTICAST); other servers ignore the offer.
+UDP_MULTICAST_ENABLED = True
+UDP_MULTICAST_INTERFACE = '0.0.0.0'  # local interface address to join groups on (any)
 
 tcp_client_socket = None
 tcp_connected = False
+tcp_framing = FRAMING_JSON  # negotiated with the server after each connect
+# How long to wait for the server to answer the framing hello before staying on JSON lines.
+TCP_HELLO_TIMEOUT = 5.0
+# Longest message accepted from the server; initial history can run to a few megabytes.
+TCP_MAX_MESSAGE_BYTES = 64 * 1024 * 1024
 
-frame_buffers = defaultdict(dict) 
-frame_total_packets = {}          
+# Older chat history is fetched a page at a time when the chat pane is scrolled to the top.
+CHAT_HISTORY_PAGE_SIZE = 50
+
+frame_assemblies = {}             # frame_id -> FrameReassembly
 udp_data_lock = threading.Lock()  
 last_displayed_frame_id = -1      
 last_udp_hello_sent_time = 0      
 LAST_UDP_ACTIVITY_CHECK_INTERVAL = 5 
 
+# Receiver reports sent to the server's handshake port for adaptive bitrate.
+RECEIVER_REPORT_INTERVAL = 1.0
+last_receiver_report_time = 0
+receiver_stats = {"frames": 0, "dropped": 0, "received": 0, "lost": 0, "bytes": 0, "latency_total": 0.0,
+                  "recovered": 0, "nacked": 0}
+fec_totals = {"frames_recovered": 0, "packets_recovered": 0}
+
+# NACKs for missing packets: a frame is NACKed once no packet arrived for NACK_GAP_DELAY
+# or a newer frame has started, at most NACK_MAX_ATTEMPTS times, NACK_RETRY_INTERVAL apart,
+# and never once NACK_DEADLINE has passed since its first packet.
+NACK_ENABLED = True
+NACK_CHECK_INTERVAL = 0.005
+NACK_GAP_DELAY = 0.015
+NACK_RETRY_INTERVAL = 0.04
+NACK_MAX_ATTEMPTS = 2
+NACK_DEADLINE = 0.2
+last_nack_check_time = 0
+
+# Jitter buffer: complete frames are shown at their capture time (from the packet header)
+# plus a playout delay that covers JITTER_BUFFER_PERCENTILE of the recent arrival jitter,
+# so frames keep the server's cadence however bursty the network. When several frames
+# are due at once only the newest is shown.
+JITTER_BUFFER_ENABLED = True
+JITTER_BUFFER_MIN_DELAY = 0.01
+JITTER_BUFFER_MAX_DELAY = 0.2     # never hold frames longer; later ones are shown late instead
+JITTER_BUFFER_WINDOW = 90         # frames of arrival history the delay is computed from
+JITTER_BUFFER_PERCENTILE = 0.95
+JITTER_BUFFER_DECAY = 0.02        # share of the way the delay falls towards its target per frame
+FRAME_PROCESS_INTERVAL_MS = 10    # longest wait between checks for due frames
+
+# JPEG frames are decoded on worker threads, started ahead of their playout time by
+# about the recent decode time, and only the newest due frame is decoded. When the video
+# is drawn at most half, a quarter or an eighth of the frame's size, the JPEG decoder
+# scales it down while decoding (IMREAD_REDUCED_COLOR_*), which is much cheaper.
+DECODE_THREADS = 2
+DECODE_LEAD_TIME_MAX = 0.03       # seconds; decoding never starts earlier than this
+VIDEO_REDUCED_DECODE = True
+REDUCED_DECODE_MODES = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+# Delta frames patch the last shown frame of the same tier; when that is impossible
+# (no keyframe yet, tier switch, missed base frame) a VIDEO_KEYFRAME is requested.
+KEYFRAME_REQUEST_INTERVAL = 0.5
+keyframe_request_pending = False
+last_keyframe_request_time = 0
+video_canvas = {"frame": None, "frame_id": -1, "tier": -1, "deltas": False}
+last_shown_frame_id = -1          # newest frame put on screen
+
+# Channel the current frame ids belong to; frame ids restart when it changes.
+receiving_channel = None
+
 stop_client_event = threading.Event()
 
+
+class FrameBufferPool:
+    """Recycles frame reassembly buffers, so steady streaming allocates none.
+
+    Buffers come in power-of-two size classes of at least FRAME_BUFFER_MIN_BYTES and up
+    to FRAME_BUFFER_POOL_SIZE free ones are kept per class. Buffers larger than
+    MAX_VIDEO_FRAME_BYTES are allocated to size and never kept. Thread-safe: frames are
+    started on the receive threads and released by whichever thread finishes with them.
+    """
+
+    def __init__(self, max_free=FRAME_BUFFER_POOL_SIZE):
+        self.max_free = max_free
+        self.allocated = 0   # buffers ever created; flat once streaming is steady
+        self._free = {}      # size class -> [bytearray, ...]
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        size_class = max(FRAME_BUFFER_MIN_BYTES, 1 << (size - 1).bit_length())
+        with self._lock:
+            free = self._free.get(size_class)
+            if free:
+                return free.pop()
+            self.allocated += 1
+        return bytearray(size_class if size_class <= MAX_VIDEO_FRAME_BYTES else size)
+
+    def release(self, buffer):
+        if len(buffer) > MAX_VIDEO_FRAME_BYTES:
+            return
+        with self._lock:
+            free = self._free.setdefault(len(buffer), [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+
+
+frame_buffer_pool = FrameBufferPool()
+
+
+class FrameReassembly:
+    """Collects one frame's packets directly into a pooled buffer (packet i lands at i * chunk_size).
+
+    The buffer holds the frame padded to whole chunks, so FEC groups can be viewed as
+    equal-length rows and missing packets rebuilt in place, followed by a row per parity
+    packet and a byte per data packet marking it received. release() returns the buffer
+    to frame_buffer_pool; frame_bytes() views are invalid after that.
+    """
+
+    __slots__ = ("frame_id", "frame_size", "num_packets", "chunk_size", "fec_mode", "fec_k", "fec_m",
+                 "tier", "channel", "flags", "capture_time", "buffer", "data", "rows", "parity_rows", "received", "received_count",
+                 "parity", "recovered_count", "first_packet_time", "last_packet_time", "nack_attempts", "next_nack_time")
+
+    def __init__(self, header):
+        self.frame_id = header.frame_id
+        self.frame_size = header.frame_size
+        self.num_packets = header.num_packets
+        self.chunk_size = header.chunk_size
+        self.fec_mode = header.fec_mode
+        self.fec_k = header.fec_k
+        self.fec_m = header.fec_m
+        self.tier = header.tier
+        self.channel = header.channel
+        self.flags = header.flags & FLAG_DELTA
+        self.capture_time = header.capture_time
+
+        num_parity = 0
+        if self.fec_mode != FEC_NONE and self.fec_k:
+            num_parity = (self.num_packets + self.fec_k - 1) // self.fec_k * self.fec_m
+        data_size = self.num_packets * self.chunk_size
+        parity_end = data_size + num_parity * self.chunk_size
+        self.buffer = frame_buffer_pool.acquire(parity_end + self.num_packets)
+        array = np.frombuffer(self.buffer, dtype=np.uint8, count=parity_end + self.num_packets)
+        # FEC parity covers the last chunk's zero padding (parse_packet_header only
+        # accepts frames that end in the last chunk).
+        array[max(self.frame_size, data_size - self.chunk_size):data_size] = 0
+        array[parity_end:] = 0
+        self.data = memoryview(self.buffer)[:data_size]
+        self.rows = array[:data_size].reshape(self.num_packets, self.chunk_size)
+        self.parity_rows = array[data_size:parity_end].reshape(num_parity, self.chunk_size)
+        self.received = array[parity_end:]
+        self.received_count = 0
+        self.parity = {}              # group -> {parity row: np.ndarray view into parity_rows}
+        self.recovered_count = 0
+        self.first_packet_time = self.last_packet_time = time.time()
+        self.nack_attempts = 0
+        self.next_nack_time = 0.0
+
+    def matches(self, header):
+        return (self.frame_size, self.num_packets, self.chunk_size, self.fec_mode, self.fec_k, self.fec_m) == \
+            (header.frame_size, header.num_packets, header.chunk_size, header.fec_mode, header.fec_k, header.fec_m)
+
+    def frame_bytes(self):
+        return self.data[:self.frame_size]
+
+    def release(self):
+        """Returns the buffer to the pool. Safe to call more than once."""
+        if self.buffer is not None:
+            self.data = self.rows = self.parity_rows = self.received = None
+            frame_buffer_pool.release(self.buffer)
+            self.buffer = None
+
+    def add_packet(self, header, payload):
+        """Stores a data or parity packet and rebuilds lost packets when FEC allows it.
+           Returns False for duplicates and payloads that do not fit."""
+        self.last_packet_time = time.time()
+        if header.flags & FLAG_PARITY:
+            group, parity_row = divmod(header.packet_index, self.fec_m)
+            group_parity = self.parity.setdefault(group, {})
+            if parity_row in group_parity or len(payload) != self.chunk_size:
+                return False
+            row = self.parity_rows[header.packet_index]
+            row[:] = payload
+            group_parity[parity_row] = row
+            self._try_recover(group)
+            return True
+
+        packet_index = header.packet_index
+        if self.received[packet_index]:
+            return False
+        offset = packet_index * self.chunk_size
+        end = offset + len(payload)
+        expected_end = min(offset + self.chunk_size, self.frame_size)
+        if end != expected_end:
+            return False
+        self.data[offset:end] = payload
+        self.received[packet_index] = 1
+        self.received_count += 1
+        if self.fec_mode != FEC_NONE and self.fec_k:
+            self._try_recover(packet_index // self.fec_k)
+        return True
+
+    def _try_recover(self, group):
+        group_parity = self.parity.get(group)
+        if not group_parity:
+            return
+        start = group * self.fec_k
+        end = min(start + self.fec_k, self.num_packets)
+        present = self.received[start:end]
+        missing = (end - start) - int(present.sum())
+        if missing == 0 or missing > len(group_parity) or (self.fec_mode == FEC_XOR and missing != 1):
+            return
+
+        rebuilt = recover_group(self.fec_mode, self.fec_k, self.rows[start:end], [bool(p) for p in present], group_parity)
+        for i in rebuilt:
+            self.received[start + i] = 1
+        self.received_count += len(rebuilt)
+        self.recovered_count += len(rebuilt)
+
+    def is_complete(self):
+        return self.received_count == self.num_packets
+
+    def missing_packet_indexes(self):
+        return np.flatnonzero(self.received == 0).tolist()
+
+
+class JitterBuffer:
+    """Holds complete frames until their playout time: capture time plus a playout delay.
+
+    Capture times are on the server's clock, so they are mapped onto ours through the
+    shortest transit time (arrival - capture) of the last JITTER_BUFFER_WINDOW frames.
+    The delay is the JITTER_BUFFER_PERCENTILE transit above that shortest one, clamped to
+    [JITTER_BUFFER_MIN_DELAY, JITTER_BUFFER_MAX_DELAY]; it rises at once and falls slowly.
+    Not thread-safe: callers hold udp_data_lock.
+    """
+
+    def __init__(self):
+        self.delay = JITTER_BUFFER_MIN_DELAY   # latency added on top of the fastest transit
+        self.late_frames = 0                   # due frames skipped because a newer one was due too
+        self._frames = []                      # sorted [(frame_id, playout time)]
+        self._transits = collections.deque(maxlen=JITTER_BUFFER_WINDOW)
+        self._last_capture = None              # (capture_time field, unwrapped seconds)
+
+    @property
+    def depth(self):
+        return len(self._frames)
+
+    def push(self, frame_id, capture_time, arrival):
+        """Schedules a complete frame. capture_time is the header field; arrival is time.monotonic()."""
+        if not JITTER_BUFFER_ENABLED:
+            bisect.insort(self._frames, (frame_id, arrival))
+            return
+        capture = self._unwrap(capture_time)
+        self._transits.append(arrival - capture)
+        transits = sorted(self._transits)
+        fastest = transits[0]
+        target = transits[int((len(transits) - 1) * JITTER_BUFFER_PERCENTILE)] - fastest
+        target = min(JITTER_BUFFER_MAX_DELAY, max(JITTER_BUFFER_MIN_DELAY, target))
+        if target > self.delay:
+            self.delay = target
+        else:
+            self.delay += JITTER_BUFFER_DECAY * (target - self.delay)
+        bisect.insort(self._frames, (frame_id, capture + fastest + self.delay))
+
+    def _unwrap(self, capture_time):
+        """Converts the wrapping millisecond capture_time into seconds, continuing from the last frame."""
+        if self._last_capture is None:
+            seconds = capture_time / 1000.0
+        else:
+            last_field, last_seconds = self._last_capture
+            step = (capture_time - last_field) & 0xFFFFFFFF
+            if step >= 0x80000000:
+                step -= 0x100000000  # an older frame completing after a newer one
+            seconds = last_seconds + step / 1000.0
+        self._last_capture = (capture_time, seconds)
+        return seconds
+
+    def pop_due(self, now):
+        """Removes and returns the (frame id, playout time) of frames due by now, oldest first.
+           The caller shows the last one; the others were superseded before being shown."""
+        due = 0
+        while due < len(self._frames) and self._frames[due][1] <= now:
+            due += 1
+        frames = self._frames[:due]
+        del self._frames[:due]
+        self.late_frames += max(0, due - 1)
+        return frames
+
+    def next_playout(self):
+        """Earliest playout time still waiting, or None."""
+        return min((playout for _, playout in self._frames), default=None)
+
+
+jitter_buffer = JitterBuffer()   # frames completed by the receive thread, not yet displayed
+
+
+DecodedFrame = collections.namedtuple("DecodedFrame", "frame_id playout channel tier factor frame frame_size")
+
+
+class FrameDecodePool:
+    """Decodes JPEG frames on worker threads (cv2.imdecode releases the GIL), so the Tk
+    main thread only has to show them.
+
+    Only the newest submitted frame waits for a worker: submitting drops a frame still
+    waiting, which would be superseded before it could be shown. Workers release each
+    frame's reassembly buffer once decoded. The threads start with the first frame.
+    """
+
+    def __init__(self, threads=DECODE_THREADS):
+        self.lead_time = 0.005   # recent decode time, with some margin
+        self.skipped = 0         # frames superseded before a worker was free
+        self._num_threads = threads
+        self._threads = []
+        self._pending = None
+        self._ready = []
+        self._cond = threading.Condition()
+
+    def submit(self, assembly, frame_id, playout, decode_flag, factor):
+        with self._cond:
+            if not self._threads:
+                self._threads = [threading.Thread(target=self._run, name=f"video-decode-{i}", daemon=True)
+                                 for i in range(self._num_threads)]
+                for thread in self._threads:
+                    thread.start()
+            if self._pending is not None:
+                self._pending[0].release()
+                self.skipped += 1
+            self._pending = (assembly, frame_id, playout, decode_flag, factor)
+            self._cond.notify()
+
+    def take_due(self, now):
+        """Removes and returns the decoded frames whose playout time has come, oldest first."""
+        with self._cond:
+            due = [decoded for decoded in self._ready if decoded.playout <= now]
+            self._ready = [decoded for decoded in self._ready if decoded.playout > now]
+        due.sort(key=lambda decoded: decoded.frame_id)
+        return due
+
+    def next_playout(self):
+        """Earliest playout time of a decoded or waiting frame, or None."""
+        with self._cond:
+            playouts = [decoded.playout for decoded in self._ready]
+            if self._pending is not None:
+                playouts.append(self._pending[2])
+        return min(playouts, default=None)
+
+    def _run(self):
+        while not stop_client_event.is_set():
+            with self._cond:
+                if self._pending is None:
+                    self._cond.wait(0.5)
+                    continue
+                assembly, frame_id, playout, decode_flag, factor = self._pending
+                self._pending = None
+            start = time.monotonic()
+            try:
+                frame = cv2.imdecode(np.frombuffer(assembly.frame_bytes(), np.uint8), decode_flag)
+            except cv2.error:
+                frame = None
+            finally:
+                assembly.release()
+            elapsed = time.monotonic() - start
+            with self._cond:
+                self.lead_time = min(DECODE_LEAD_TIME_MAX, max(0.9 * self.lead_time, 1.5 * elapsed + 0.002))
+                self._ready.append(DecodedFrame(frame_id, playout, assembly.channel, assembly.tier, factor, frame,
+                                                assembly.frame_size))
+
+
+frame_decode_pool = FrameDecodePool()
+
+
 class CombinedClient(tk.Tk):
-    def __init__(self, udp_port, is_host=False): 
+    def __init__(self, udp_port, is_host=False, video_tier=None, video_channel=None): 
         super().__init__()
         self.udp_listen_port = udp_port 
         self.is_host = is_host 
+        self.video_tier = video_tier
+        self.video_channel = video_channel
+        self.multicast_offered = UDP_MULTICAST_ENABLED
+        self.multicast_group = None         # (group, port) joined, or None while on unicast
+        self.multicast_socket = None
+        self.video_visible = True           # window neither minimized nor fully covered
+        self.video_last_frame = None        # last frame shown, redrawn when the video area is resized
+        self.video_render_buffers = None    # (size, scaled BGR array, PPM bytearray, RGB view into it)
+        self.full_frame_sizes = {}          # tier -> (width, height) of its last decoded frame, before reduction
+        self.oldest_chat_id = None          # id of the oldest chat message shown
+        self.chat_history_has_more = False
+        self.chat_history_request_pending = False
         
         self.device_name = self._prompt_for_device_name()
         self.client_id = self.device_name  
@@ -286,19 +668,22 @@ class CombinedClient(tk.Tk):
         )
         self.video_error_label.pack(pady=(0, 10))
 
-        # Video preview frame
-        video_preview_frame = tk.Frame(video_panel, bg="#3c3c3c", relief="sunken", bd=2)
-        video_preview_frame.pack(fill="both", expand=True, pady=(0, 10))
-        
-        video_instruction = tk.Label(
-            video_preview_frame,
-            text="📺 Video Stream\n\nVideo will appear in a separate OpenCV window\n\nPress 'Q' in the video window to quit",
+        # Video display: frames are drawn into one PhotoImage, scaled to fit the canvas
+        self.video_display = tk.Canvas(video_panel, bg="#000000", relief="sunken", bd=2, highlightthickness=0)
+        self.video_display.pack(fill="both", expand=True, pady=(0, 10))
+        self.video_photo = tk.PhotoImage(master=self)
+        self.video_image_item = self.video_display.create_image(0, 0, image=self.video_photo, anchor="center")
+        self.video_placeholder_item = self.video_display.create_text(
+            0, 0,
+            text="📺 Video Stream\n\nVideo will appear here once the stream starts",
             font=("Segoe UI", 11),
-            bg="#3c3c3c",
-            fg="#b3b3b3",
+            fill="#b3b3b3",
             justify="center"
         )
-        video_instruction.pack(expand=True)
+        self.video_display.bind("<Configure>", self._on_video_display_configure)
+        self.video_display.bind("<Visibility>", self._on_video_display_visibility)
+        self.bind("<Unmap>", self._on_window_map_change)
+        self.bind("<Map>", self._on_window_map_change)
 
         # Right Panel - Chat
         chat_panel = tk.LabelFrame(
@@ -361,6 +746,7 @@ class CombinedClient(tk.Tk):
             pady=5
         )
         self.chat_text.pack(fill="both", expand=True)
+        self.chat_text.config(yscrollcommand=self._on_chat_scroll)
         
         # Configure text tags for different message types
         self.chat_text.tag_configure("own_message", foreground="#00d4aa", font=("Segoe UI", 10, "bold"))
@@ -514,8 +900,7 @@ class CombinedClient(tk.Tk):
         if tcp_connected and tcp_client_socket:
             try:
                 payload = {"sender_id": self.device_name, "message": message_text}
-                message_to_send = json.dumps({"type": "chatMessage", "payload": payload}) + '\n'
-                tcp_client_socket.sendall(message_to_send.encode('utf-8'))
+                self._send_tcp_message("chatMessage", payload)
                 self.chat_input.delete(1.0, tk.END) 
                 self._clear_tcp_error_message() 
                 
@@ -547,14 +932,16 @@ class CombinedClient(tk.Tk):
                     tcp_client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                     tcp_client_socket.connect((TCP_HOST, TCP_PORT))
                     tcp_client_socket.settimeout(1.0)
+                    reader = MessageReader(max_frame_bytes=TCP_MAX_MESSAGE_BYTES)
+                    self._negotiate_tcp_framing(reader)
 
                     tcp_connected = True
                     retries = 0 
                     self.update_tcp_status("Connected", "green")
                     self.after(0, self._clear_tcp_error_message)
-                    print(f"TCP Client: Successfully connected to server at {TCP_HOST}:{TCP_PORT}")
+                    print(f"TCP Client: Successfully connected to server at {TCP_HOST}:{TCP_PORT} ({tcp_framing} framing)")
 
-                    self._tcp_receive_messages_loop() 
+                    self._tcp_receive_messages_loop(reader)
 
                 except socket.timeout:
                     print("TCP Client: Socket operation timed out during connection.")
@@ -581,24 +968,63 @@ class CombinedClient(tk.Tk):
         print("TCP Client: Connection loop exited.")
 
 
-    def _tcp_receive_messages_loop(self):
+    def _negotiate_tcp_framing(self, reader):
+        """Offers the binary framing and waits for the server's answer, handling the
+           initial state that arrives before it. Servers without binary framing answer
+           the hello with a serverError; the connection then stays on JSON lines."""
+        global tcp_framing
+        tcp_framing = FRAMING_JSON
+        tcp_client_socket.sendall(encode_json_message("hello", {"framing": [FRAMING_BINARY]}))
+        deadline = time.time() + TCP_HELLO_TIMEOUT
+        while time.time() < deadline:
+            message = reader.next_message()
+            if message is None:
+                try:
+                    received = reader.receive(tcp_client_socket)
+                except socket.timeout:
+                    continue
+                if not received:
+                    raise ConnectionResetError("Server closed connection during handshake.")
+                continue
+            msg_type, msg_payload = message
+            if msg_type == "framing":
+                if msg_payload.get("framing") == FRAMING_BINARY:
+                    reader.framing = tcp_framing = FRAMING_BINARY
+                return
+            if msg_type == "serverError":
+                return
+            self.after(0, lambda m=message: self._process_tcp_server_message(*m))
+        print("TCP Client: Server did not answer the framing hello, using JSON lines.")
+
+    def _send_tcp_message(self, message_type, payload):
+        """Sends one message to the server in the negotiated framing."""
+        if tcp_framing == FRAMING_BINARY:
+            data, _ = encode_binary_message(message_type, payload)
+        else:
+            data = encode_json_message(message_type, payload)
+        tcp_client_socket.sendall(data)
+
+    def _tcp_receive_messages_loop(self, reader):
         """Receives and processes messages from the TCP server in a loop."""
         global tcp_connected
-        buffer = b''
         while tcp_connected and not stop_client_event.is_set():
             try:
-                data = tcp_client_socket.recv(4096)
-                if not data:
+                if not reader.receive(tcp_client_socket):
                     print("TCP Client: Server closed connection gracefully.")
                     self._handle_tcp_disconnect()
                     break
 
-                buffer += data
-                while b'\n' in buffer:
-                    message_bytes, buffer = buffer.split(b'\n', 1)
-                    message_str = message_bytes.decode('utf-8').strip()
-
-                    self.after(0, lambda msg=message_str: self._process_tcp_server_message(msg))
+                while True:
+                    try:
+                        message = reader.next_message()
+                    except ProtocolError:
+                        if reader.framing == FRAMING_BINARY:
+                            raise  # the stream cannot be resynchronised
+                        self.after(0, lambda: self.show_tcp_error_message("Invalid JSON received from server."))
+                        continue
+                    if message is None:
+                        break
+                    self.after(0, lambda m=message: self._process_tcp_server_message(*m))
 
             except socket.timeout:
                 pass 
@@ -618,13 +1044,9 @@ class CombinedClient(tk.Tk):
         print("TCP Client: Receive loop exited.")
 
 
-    def _process_tcp_server_message(self, message_str):
+    def _process_tcp_server_message(self, msg_type, msg_payload):
         """Processes a single message received from the TCP server."""
         try:
-            message = json.loads(message_str)
-            msg_type = message.get("type")
-            msg_payload = message.get("payload")
-
             if msg_type == "loadOldAnnouncements":
                 self.announcements_text.config(state='normal')
                 self.announcements_text.delete(1.0, tk.END) 
@@ -641,9 +1063,13 @@ class CombinedClient(tk.Tk):
                 self._show_no_announcements_message(False)
                 self._display_new_announcement_at_top(msg_payload)
 
-            elif msg_type == "chatMessage": 
+            elif msg_type == "chatMessage":
                 self._display_chat_message_in_gui(msg_payload)
-            
+
+            elif msg_type == "chatBatch":
+                for chat_msg in msg_payload:
+                    self._display_chat_message_in_gui(chat_msg)
+
             elif msg_type == "loadOldChatMessages":
                 self.chat_text.config(state='normal')
                 self.chat_text.delete(1.0, tk.END) 
@@ -655,6 +1081,8 @@ class CombinedClient(tk.Tk):
                     self.chat_text.insert(tk.END, "💬 No chat history yet. Be the first to say something!\n\n", "system_message")
                 else:
                     self.chat_text.insert(tk.END, "📜 Chat History:\n", "system_message")
+                    self.chat_text.mark_set("chat_history_top", "end-1c")
+                    self.chat_text.mark_gravity("chat_history_top", tk.LEFT)
                     for chat_msg in msg_payload:
                         self._display_chat_message_in_gui(chat_msg)
                     self.chat_text.insert(tk.END, "\n🔴 You are now live in chat!\n", "system_message")
@@ -662,6 +1090,13 @@ class CombinedClient(tk.Tk):
                 self.chat_text.insert(tk.END, "═══════════════════════════\n", "timestamp")
                 self.chat_text.see(tk.END) 
                 self.chat_text.config(state='disabled')
+                self.oldest_chat_id = msg_payload[0].get("id") if msg_payload else None
+                self.chat_history_has_more = self.oldest_chat_id is not None
+                self.chat_history_request_pending = False
+                self.chat_text.after_idle(self._fill_chat_pane)
+
+            elif msg_type == "chatHistoryPage":
+                self._display_chat_history_page(msg_payload)
 
             elif msg_type == "announcementError":
                 self.show_tcp_error_message(f"Server Error (Announcement): {msg_payload.get('message', 'Unknown Error')}")
@@ -672,8 +1107,6 @@ class CombinedClient(tk.Tk):
             else:
                 self.show_tcp_error_message(f"Unknown message type from server: {msg_type}")
 
-        except json.JSONDecodeError:
-            self.show_tcp_error_message("Invalid JSON received from server.")
         except Exception as e:
             self.show_tcp_error_message(f"Error processing server message: {e}")
 
@@ -765,8 +1198,7 @@ class CombinedClient(tk.Tk):
         if tcp_connected and tcp_client_socket:
             try:
                 payload = {"message": message_text}
-                message_to_send = json.dumps({"type": "createAnnouncement", "payload": payload}) + '\n'
-                tcp_client_socket.sendall(message_to_send.encode('utf-8'))
+                self._send_tcp_message("createAnnouncement", payload)
                 self.announcement_input.delete(1.0, tk.END)
                 self._clear_tcp_error_message()
             except socket.error as e:
@@ -833,8 +1265,8 @@ class CombinedClient(tk.Tk):
         self.after(0, lambda: self.tcp_error_label.config(text=""))
 
 
-    def _display_chat_message_in_gui(self, chat_message):
-        """Appends a chat message to the chat Text widget."""
+    def _display_chat_message_in_gui(self, chat_message, index=tk.END):
+        """Inserts a chat message into the chat Text widget, at the end unless index is given."""
         self.chat_text.config(state='normal')
         try:
             dt_object = datetime.datetime.fromisoformat(chat_message['timestamp'])
@@ -845,10 +1277,57 @@ class CombinedClient(tk.Tk):
         formatted_chat = (
             f"[{time_str}] {chat_message['sender']}: {chat_message['message']}\n"
         )
-        self.chat_text.insert(tk.END, formatted_chat)
-        self.chat_text.see(tk.END) 
+        self.chat_text.insert(index, formatted_chat)
+        if index == tk.END:
+            self.chat_text.see(tk.END)
         self.chat_text.config(state='disabled')
 
+    def _on_chat_scroll(self, first, last):
+        """yscrollcommand of the chat pane: fetches older history once it is scrolled to the top."""
+        self.chat_text.vbar.set(first, last)
+        if float(first) <= 0.0 and float(last) < 1.0:
+            self._request_older_chat_history()
+
+    def _request_older_chat_history(self):
+        global tcp_connected, tcp_client_socket
+        if (not self.chat_history_has_more or self.chat_history_request_pending
+                or self.oldest_chat_id is None or not (tcp_connected and tcp_client_socket)):
+            return
+        try:
+            payload = {"before": self.oldest_chat_id, "limit": CHAT_HISTORY_PAGE_SIZE}
+            self._send_tcp_message("fetchChatHistory", payload)
+            self.chat_history_request_pending = True
+        except socket.error as e:
+            print(f"TCP Client: Error requesting chat history: {e}")
+            self._handle_tcp_disconnect()
+
+    def _display_chat_history_page(self, page):
+        """Inserts an older page of chat history above the messages already shown."""
+        self.chat_history_request_pending = False
+        if page.get("before") != self.oldest_chat_id or "chat_history_top" not in self.chat_text.mark_names():
+            return  # the history was reloaded since this page was requested
+        messages = page.get("messages") or []
+        self.chat_history_has_more = bool(page.get("has_more")) and bool(messages)
+        if not messages:
+            return
+
+        # Insert oldest first at a right-gravity mark so the page keeps its order, then
+        # keep the view on the message that was at the top so paging does not cascade.
+        self.chat_text.mark_set("chat_page_insert", "chat_history_top")
+        self.chat_text.mark_gravity("chat_page_insert", tk.RIGHT)
+        for chat_msg in messages:
+            self._display_chat_message_in_gui(chat_msg, index="chat_page_insert")
+        self.chat_text.yview("chat_page_insert")
+        self.oldest_chat_id = messages[0].get("id")
+        self.chat_text.after_idle(self._fill_chat_pane)
+
+    def _fill_chat_pane(self):
+        """Fetches older history while what is shown doesn't fill the chat pane, since
+           a pane without a scrollbar can't be scrolled to the top to ask for more."""
+        first, last = self.chat_text.yview()
+        if first <= 0.0 and last >= 1.0:
+            self._request_older_chat_history()
+
     def send_chat_message(self):
         """Sends the chat message from the input field to the server."""
         message_text = self.chat_input.get(1.0, tk.END).strip()
@@ -863,8 +1342,7 @@ class CombinedClient(tk.Tk):
         if tcp_connected and tcp_client_socket:
             try:
                 payload = {"sender_id": self.device_name, "message": message_text}
-                message_to_send = json.dumps({"type": "chatMessage", "payload": payload}) + '\n'
-                tcp_client_socket.sendall(message_to_send.encode('utf-8'))
+                self._send_tcp_message("chatMessage", payload)
                 self.chat_input.delete(1.0, tk.END) 
                 self._clear_tcp_error_message() 
                 
@@ -887,43 +1365,35 @@ class CombinedClient(tk.Tk):
         udp_client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
             udp_client_socket.bind((UDP_HOST, self.udp_listen_port)) 
-            udp_client_socket.settimeout(0.1) 
+            udp_client_socket.settimeout(NACK_GAP_DELAY if NACK_ENABLED else 0.1) 
+            try:
+                udp_client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER_BYTES)
+            except OSError as e:
+                print(f"UDP Client: Could not enlarge receive buffer: {e}")
 
             print(f"UDP Client: Listening for video on {UDP_HOST}:{self.udp_listen_port}")
             self.update_video_status(f"Listening for video on port {self.udp_listen_port}...", "blue")
 
-            global frame_buffers, frame_total_packets, last_displayed_frame_id, last_udp_hello_sent_time
+            global last_udp_hello_sent_time, last_receiver_report_time
+
+            recv_buffer = bytearray(BUFFER_SIZE)
+            recv_view = memoryview(recv_buffer)
 
             self._send_udp_hello(udp_client_socket)
             last_udp_hello_sent_time = time.time()
+            last_receiver_report_time = time.time()
 
             while not stop_client_event.is_set():
                 try:
-                    data, addr = udp_client_socket.recvfrom(BUFFER_SIZE)
-                    
-                    if time.time() - last_udp_hello_sent_time > LAST_UDP_ACTIVITY_CHECK_INTERVAL:
-                        self._send_udp_hello(udp_client_socket)
-                        last_udp_hello_sent_time = time.time()
-
-                    if len(data) < 8: 
-                        print("UDP Client: Received malformed packet (too short header).")
+                    nbytes, addr = udp_client_socket.recvfrom_into(recv_buffer)
+                    self._send_periodic_control_messages(udp_client_socket)
+                    if nbytes > 6 and recv_buffer.startswith(b"VIDEO_"):
+                        self._handle_udp_control_message(udp_client_socket, bytes(recv_view[:nbytes]))
                         continue
-
-                    frame_id = int.from_bytes(data[0:4], 'big')
-                    packet_index = int.from_bytes(data[4:6], 'big')
-                    total_packets = int.from_bytes(data[6:8], 'big')
-                    packet_data = data[8:]
-
-                    with udp_data_lock:
-                        frame_buffers[frame_id][packet_index] = packet_data
-                        frame_total_packets[frame_id] = total_packets 
-
+                    self._handle_video_packet(recv_view, nbytes)
 
                 except socket.timeout:
-                    if time.time() - last_udp_hello_sent_time > LAST_UDP_ACTIVITY_CHECK_INTERVAL:
-                        self._send_udp_hello(udp_client_socket)
-                        last_udp_hello_sent_time = time.time()
-                    pass
+                    self._send_periodic_control_messages(udp_client_socket)
                 except Exception as e:
                     print(f"UDP Client: Error receiving packet: {e}")
                     self.update_video_status(f"Video Error: {e}", "darkred")
@@ -938,6 +1408,7 @@ class CombinedClient(tk.Tk):
             print(f"UDP Client: Critical UDP receive loop error: {e}")
             self.show_video_error_message(f"Critical Video Error: {e}")
         finally:
+            self._leave_multicast()
             if udp_client_socket:
                 try:
                     udp_client_socket.close()
@@ -945,10 +1416,127 @@ class CombinedClient(tk.Tk):
                     print(f"UDP Client: Error closing UDP socket: {e}")
             print("UDP Client: UDP receive loop exited.")
 
+    def _handle_video_packet(self, recv_view, nbytes):
+        """Adds one received video datagram (unicast or multicast) to its frame's reassembly."""
+        header = parse_packet_header(recv_view[:nbytes])
+        if header is None: 
+            print("UDP Client: Received malformed packet (bad header).")
+            return
+        frame_id = header.frame_id
+
+        with udp_data_lock:
+            if header.channel != receiving_channel:
+                self._reset_video_state(header.channel)
+            receiver_stats["received"] += 1
+            receiver_stats["bytes"] += nbytes
+            if frame_id <= last_displayed_frame_id:
+                return  # late packet for a frame we already showed or gave up on
+
+            assembly = frame_assemblies.get(frame_id)
+            if assembly is None:
+                assembly = FrameReassembly(header)
+                frame_assemblies[frame_id] = assembly
+            elif assembly.is_complete() or not assembly.matches(header):
+                return
+
+            if assembly.add_packet(header, recv_view[VIDEO_HEADER_SIZE:nbytes]) and assembly.is_complete():
+                jitter_buffer.push(frame_id, assembly.capture_time, time.monotonic())
+
+    def _handle_udp_control_message(self, udp_socket, message):
+        """Handles a text message from the server's handshake port: VIDEO_MULTICAST group=<ip> port=<n>, or off."""
+        command, *parts = message.decode('utf-8', 'replace').split()
+        if command != "VIDEO_MULTICAST":
+            print(f"UDP Client: Ignoring unknown control message '{command}'.")
+            return
+        options = dict(part.partition('=')[::2] for part in parts)
+        if "group" not in options:
+            self._leave_multicast()
+            return
+        try:
+            group = (options["group"], int(options["port"]))
+        except (KeyError, ValueError):
+            print(f"UDP Client: Malformed multicast assignment: {message!r}")
+            return
+        if group != self.multicast_group:
+            self._join_multicast(udp_socket, group)
+
+    def _join_multicast(self, udp_socket, group):
+        """Joins a multicast group and receives it on its own thread. If joining fails the
+           offer is withdrawn, so the server keeps sending by unicast."""
+        self._leave_multicast()
+        address, port = group
+        multicast_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            # Viewers on the same host all bind the group's port.
+            multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                multicast_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_RECEIVE_BUFFER_BYTES)
+            except OSError:
+                pass
+            multicast_socket.bind(('', port))
+            membership = socket.inet_aton(address) + socket.inet_aton(UDP_MULTICAST_INTERFACE)
+            multicast_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        except OSError as e:
+            print(f"UDP Client: Could not join multicast group {address}:{port}, staying on unicast: {e}")
+            multicast_socket.close()
+            self.multicast_offered = False
+            self._send_udp_hello(udp_socket)
+            return
+        multicast_socket.settimeout(0.5)
+        self.multicast_socket, self.multicast_group = multicast_socket, group
+        print(f"UDP Client: Receiving video from multicast group {address}:{port}")
+        threading.Thread(target=self._multicast_receive_loop, args=(multicast_socket,), daemon=True).start()
+
+    def _leave_multicast(self):
+        multicast_socket, self.multicast_socket, self.multicast_group = self.multicast_socket, None, None
+        if multicast_socket is not None:
+            print("UDP Client: Left multicast group, receiving video by unicast.")
+            multicast_socket.close()  # closing drops the membership
+
+    def _multicast_receive_loop(self, multicast_socket):
+        recv_buffer = bytearray(BUFFER_SIZE)
+        recv_view = memoryview(recv_buffer)
+        while not stop_client_event.is_set() and self.multicast_socket is multicast_socket:
+            try:
+                nbytes = multicast_socket.recv_into(recv_buffer)
+                self._handle_video_packet(recv_view, nbytes)
+            except socket.timeout:
+                continue
+            except OSError:
+                break  # socket closed by _leave_multicast
+            except Exception as e:
+                print(f"UDP Client: Error receiving multicast packet: {e}")
+
+    def _send_periodic_control_messages(self, udp_socket):
+        """Sends whichever of HELLO, receiver report, NACKs and keyframe request are due."""
+        global last_udp_hello_sent_time, last_keyframe_request_time, keyframe_request_pending
+        now = time.time()
+        if now - last_udp_hello_sent_time > LAST_UDP_ACTIVITY_CHECK_INTERVAL:
+            self._send_udp_hello(udp_socket)
+            last_udp_hello_sent_time = now
+        if now - last_receiver_report_time > RECEIVER_REPORT_INTERVAL:
+            self._send_receiver_report(udp_socket)
+        if NACK_ENABLED and now - last_nack_check_time > NACK_CHECK_INTERVAL:
+            self._send_nacks(udp_socket)
+        if keyframe_request_pending and now - last_keyframe_request_time > KEYFRAME_REQUEST_INTERVAL:
+            keyframe_request_pending = False
+            last_keyframe_request_time = now
+            try:
+                udp_socket.sendto(b"VIDEO_KEYFRAME", (UDP_SERVER_HOST, UDP_VIDEO_SERVER_PORT))
+            except Exception as e:
+                print(f"UDP Client: Error sending keyframe request from {self.udp_listen_port}: {e}")
+
     def _send_udp_hello(self, udp_socket):
-        """Sends a 'VIDEO_HELLO' message to the server's handshake port."""
+        """Sends a 'VIDEO_HELLO' message (with the requested channel and quality tier, if any) to the server's handshake port."""
         try:
-            hello_message = "VIDEO_HELLO".encode('utf-8')
+            hello_text = "VIDEO_HELLO"
+            if self.video_channel:
+                hello_text += f" channel={self.video_channel}"
+            if self.video_tier:
+                hello_text += f" tier={self.video_tier}"
+            if self.multicast_offered:
+                hello_text += " multicast=1"
+            hello_message = hello_text.encode('utf-8')
             udp_socket.sendto(hello_message, (UDP_SERVER_HOST, UDP_VIDEO_SERVER_PORT))
             print(f"UDP Client: Sent 'HELLO' from {self.udp_listen_port} to server's video handshake port {UDP_VIDEO_SERVER_PORT}")
             self.after(0, self._clear_video_error_message) 
@@ -957,85 +1545,299 @@ class CombinedClient(tk.Tk):
             self.show_video_error_message(f"Could not send HELLO to server: {e}")
 
 
-    def _process_buffered_frames(self):
-        """Attempts to reassemble and display frames from the buffer.
-           This function is called periodically by Tkinter's after method."""
-        global last_displayed_frame_id
-        
-        frame_ids_to_check = []
+    def _send_receiver_report(self, udp_socket):
+        """Sends a 'VIDEO_REPORT' with reception stats since the last report, so the server can adapt our bitrate."""
+        global last_receiver_report_time
+        now = time.time()
+        interval_ms = (now - last_receiver_report_time) * 1000
+        last_receiver_report_time = now
+
         with udp_data_lock:
-            frame_ids_to_check = sorted([f_id for f_id in frame_buffers.keys() if f_id >= last_displayed_frame_id])
-
-        processed_any_frame = False
-        for f_id in frame_ids_to_check:
-            if f_id <= last_displayed_frame_id and last_displayed_frame_id != -1:
-                with udp_data_lock:
-                    if f_id in frame_buffers:
-                        del frame_buffers[f_id]
-                    if f_id in frame_total_packets:
-                        del frame_total_packets[f_id]
-                continue
+            stats = dict(receiver_stats)
+            for key in receiver_stats:
+                receiver_stats[key] = 0
+
+        latency_ms = stats["latency_total"] * 1000 / stats["frames"] if stats["frames"] else 0.0
+        report = (
+            f"VIDEO_REPORT frames={stats['frames']} dropped={stats['dropped']} "
+            f"received={stats['received']} lost={stats['lost']} recovered={stats['recovered']} "
+            f"nacked={stats['nacked']} bytes={stats['bytes']} "
+            f"latency_ms={latency_ms:.1f} interval_ms={interval_ms:.0f}"
+        )
+        try:
+            udp_socket.sendto(report.encode('utf-8'), (UDP_SERVER_HOST, UDP_VIDEO_SERVER_PORT))
+        except Exception as e:
+            print(f"UDP Client: Error sending receiver report from {self.udp_listen_port}: {e}")
 
+    def _send_nacks(self, udp_socket):
+        """Asks the server to resend missing packets of incomplete frames that stalled or were overtaken."""
+        global last_nack_check_time
+        now = time.time()
+        last_nack_check_time = now
 
-            with udp_data_lock:
-                current_frame_packets = frame_buffers.get(f_id)
-                expected_total = frame_total_packets.get(f_id)
-
-            if current_frame_packets and expected_total is not None:
-                if len(current_frame_packets) == expected_total:
-                    assembled_data = b''
-                    all_packets_found = True
-                    for i in range(expected_total):
-                        if i not in current_frame_packets:
-                            all_packets_found = False
-                            break
-                        assembled_data += current_frame_packets[i]
-                    
-                    if all_packets_found:
-                        self._display_video_frame(assembled_data, f_id)
-                        last_displayed_frame_id = max(last_displayed_frame_id, f_id) 
-                        processed_any_frame = True
+        requests = []
+        with udp_data_lock:
+            newest_frame_id = max(frame_assemblies, default=-1)
+            for f_id, assembly in frame_assemblies.items():
+                if assembly.is_complete() or assembly.nack_attempts >= NACK_MAX_ATTEMPTS:
+                    continue
+                if now < assembly.next_nack_time or now - assembly.first_packet_time > NACK_DEADLINE:
+                    continue
+                if f_id == newest_frame_id and now - assembly.last_packet_time < NACK_GAP_DELAY:
+                    continue
+                missing = assembly.missing_packet_indexes()
+                assembly.nack_attempts += 1
+                assembly.next_nack_time = now + NACK_RETRY_INTERVAL
+                receiver_stats["nacked"] += len(missing)
+                requests.append((assembly.tier, f_id, missing))
+
+        for message in format_nack_messages(requests):
+            try:
+                udp_socket.sendto(message.encode('utf-8'), (UDP_SERVER_HOST, UDP_VIDEO_SERVER_PORT))
+            except Exception as e:
+                print(f"UDP Client: Error sending NACK from {self.udp_listen_port}: {e}")
+                break
 
-                        with udp_data_lock:
-                            frame_buffers.pop(f_id, None)
-                            frame_total_packets.pop(f_id, None)
+    def _reset_video_state(self, channel):
+        """Forgets all frames of the previous channel. Caller holds udp_data_lock."""
+        global receiving_channel, last_displayed_frame_id, last_shown_frame_id, jitter_buffer
+        if receiving_channel is not None:
+            print(f"UDP Client: Now receiving channel {channel}.")
+        receiving_channel = channel
+        for assembly in frame_assemblies.values():
+            assembly.release()
+        frame_assemblies.clear()
+        jitter_buffer = JitterBuffer()
+        last_displayed_frame_id = last_shown_frame_id = -1
+        video_canvas.update(frame=None, frame_id=-1, tier=-1, deltas=False)
+
+    def _drop_buffered_frame(self, f_id):
+        """Discards an incomplete or stale frame and counts it as dropped. Caller holds udp_data_lock."""
+        assembly = frame_assemblies.pop(f_id, None)
+        receiver_stats["dropped"] += 1
+        if assembly is not None:
+            receiver_stats["lost"] += assembly.num_packets - assembly.received_count
+            assembly.release()
 
-                elif f_id < last_displayed_frame_id - 100: 
-                    with udp_data_lock:
-                        frame_buffers.pop(f_id, None)
-                        frame_total_packets.pop(f_id, None)
+    def _process_buffered_frames(self):
+        """Hands the newest reassembled frame due soon to the decode pool, and shows the
+           newest decoded frame whose playout time has come. This function is called by
+           Tkinter's after method, when the next frame is due."""
+        global last_displayed_frame_id
 
-        self._opencv_gui_update_and_reschedule_frame_processing()
+        with udp_data_lock:
+            due_frames = jitter_buffer.pop_due(time.monotonic() + frame_decode_pool.lead_time)
+            # A delta frame needs every frame since the last keyframe applied, so frames
+            # it supersedes are still applied, just not shown.
+            newest = frame_assemblies.get(due_frames[-1][0]) if due_frames else None
+            apply_superseded = newest is not None and newest.flags & FLAG_DELTA
+
+        for i, (f_id, playout) in enumerate(due_frames):
+            show = i == len(due_frames) - 1
+            with udp_data_lock:
+                if f_id <= last_displayed_frame_id:
+                    self._drop_buffered_frame(f_id)
+                    continue
+                assembly = frame_assemblies.pop(f_id, None)
+                if assembly is None:
+                    continue
+                if assembly.channel == receiving_channel:
+                    last_displayed_frame_id = f_id
+                receiver_stats["frames"] += 1
+                receiver_stats["latency_total"] += time.time() - assembly.first_packet_time
+                if assembly.recovered_count:
+                    receiver_stats["recovered"] += assembly.recovered_count
+                    fec_totals["frames_recovered"] += 1
+                    fec_totals["packets_recovered"] += assembly.recovered_count
+
+            if assembly.flags & FLAG_DELTA or apply_superseded or video_canvas["deltas"]:
+                # Delta streams patch the canvas in order, on this thread.
+                self._display_video_frame(assembly, f_id, show)
+                assembly.release()
+            elif show and self.video_visible:
+                frame_decode_pool.submit(assembly, f_id, playout, *self._decode_mode(assembly.tier))
+            else:
+                assembly.release()  # superseded, or nowhere to show it: never decoded
 
+        self._show_decoded_frames()
 
-    def _display_video_frame(self, assembled_data, current_frame_id):
-        """Decodes and displays a single video frame. Called from main thread."""
+        # Incomplete frames older than the one on screen can no longer be shown.
+        with udp_data_lock:
+            stale_frame_ids = [f_id for f_id in frame_assemblies if f_id <= last_displayed_frame_id]
+            for f_id in stale_frame_ids:
+                self._drop_buffered_frame(f_id)
+
+        self._schedule_frame_processing()
+
+
+    def _apply_delta_frame(self, assembly, current_frame_id):
+        """Patches the changed tiles of a delta frame into the last shown frame in place.
+           Returns the patched frame, or None (and requests a keyframe) if it cannot be applied."""
+        global keyframe_request_pending
+        video_canvas["deltas"] = True
+        base_frame_id, width, height, tiles = parse_delta_payload(assembly.frame_bytes())
+        canvas = video_canvas["frame"]
+        if (canvas is None or video_canvas["tier"] != assembly.tier or video_canvas["frame_id"] < base_frame_id
+                or canvas.shape[:2] != (height, width)):
+            keyframe_request_pending = True
+            return None
+
+        for x, y, tile_data in tiles:
+            tile = cv2.imdecode(np.frombuffer(tile_data, np.uint8), cv2.IMREAD_COLOR)
+            if tile is None:
+                video_canvas["frame"] = None  # partly patched, no longer usable as a base
+                keyframe_request_pending = True
+                return None
+            canvas[y:y + tile.shape[0], x:x + tile.shape[1]] = tile[:height - y, :width - x]
+        video_canvas["frame_id"] = current_frame_id
+        return canvas
+
+    def _display_video_frame(self, assembly, current_frame_id, show=True):
+        """Decodes and displays a single video frame. Called from main thread.
+           With show=False the frame only becomes the base for the delta frames after it."""
         try:
-            np_arr = np.frombuffer(assembled_data, np.uint8)
-            frame = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
+            if assembly.flags & FLAG_DELTA:
+                frame = self._apply_delta_frame(assembly, current_frame_id)
+                if frame is None:
+                    self.update_video_status("Waiting for keyframe...", "blue")
+                    return
+            else:
+                frame = cv2.imdecode(np.frombuffer(assembly.frame_bytes(), np.uint8), cv2.IMREAD_COLOR)
+                if frame is not None:
+                    video_canvas.update(frame=frame, frame_id=current_frame_id, tier=assembly.tier)
 
             if frame is not None:
-                cv2.imshow("Video Stream", frame)
-                self.update_video_status(f"Streaming (Frame {current_frame_id})", "green")
-                self.after(0, self._clear_video_error_message) 
+                if show:
+                    self._show_video_frame(frame, current_frame_id)
             else:
-                print(f"Warning: Failed to decode frame {current_frame_id}. Data size: {len(assembled_data)}")
-                self.show_video_error_message(f"Failed to decode frame {current_frame_id}. (Corrupted data?)")
+                self._report_decode_failure(current_frame_id, assembly.frame_size)
         except Exception as e:
             print(f"Error displaying frame {current_frame_id}: {e}")
             self.show_video_error_message(f"Error displaying frame {current_frame_id}: {e}")
 
-    def _opencv_gui_update_and_reschedule_frame_processing(self):
-        """Handles OpenCV's required GUI updates (waitKey) and reschedules frame processing."""
+    def _show_decoded_frames(self):
+        """Shows the newest frame from the decode pool whose playout time has come."""
+        due = frame_decode_pool.take_due(time.monotonic())
+        if not due:
+            return
+        jitter_buffer.late_frames += len(due) - 1
+        decoded = due[-1]
+        if decoded.channel != receiving_channel or decoded.frame_id <= last_shown_frame_id:
+            return  # overtaken by a frame shown in the meantime
+        if decoded.frame is None:
+            self._report_decode_failure(decoded.frame_id, decoded.frame_size)
+            return
+        height, width = decoded.frame.shape[:2]
+        self.full_frame_sizes[decoded.tier] = (width * decoded.factor, height * decoded.factor)
+        if decoded.factor == 1:
+            video_canvas.update(frame=decoded.frame, frame_id=decoded.frame_id, tier=decoded.tier)
+        try:
+            self._show_video_frame(decoded.frame, decoded.frame_id)
+        except Exception as e:
+            print(f"Error displaying frame {decoded.frame_id}: {e}")
+            self.show_video_error_message(f"Error displaying frame {decoded.frame_id}: {e}")
+
+    def _show_video_frame(self, frame, current_frame_id):
+        global last_shown_frame_id
+        last_shown_frame_id = current_frame_id
+        self.video_last_frame = frame
+        self._render_video_frame(frame)
+        status = (f"Streaming (Frame {current_frame_id}) | buffer {jitter_buffer.depth} frames, "
+                  f"+{jitter_buffer.delay * 1000:.0f} ms")
+        if fec_totals["frames_recovered"]:
+            status += f" | FEC recovered {fec_totals['frames_recovered']} frames"
+        self.update_video_status(status, "green")
+        self.after(0, self._clear_video_error_message) 
+
+    def _report_decode_failure(self, current_frame_id, frame_size):
+        print(f"Warning: Failed to decode frame {current_frame_id}. Data size: {frame_size}")
+        self.show_video_error_message(f"Failed to decode frame {current_frame_id}. (Corrupted data?)")
+
+    def _decode_mode(self, tier):
+        """(imdecode flag, scale factor) for a tier's next frame: the smallest reduced decode
+           still at least as large as the frame will be drawn in the video display."""
+        display_size = self._video_display_size()
+        full_size = self.full_frame_sizes.get(tier)
+        if not VIDEO_REDUCED_DECODE or display_size is None or full_size is None:
+            return cv2.IMREAD_COLOR, 1
+        scale = min(display_size[0] / full_size[0], display_size[1] / full_size[1])
+        for factor, decode_flag in REDUCED_DECODE_MODES:
+            if scale * factor <= 1.0:
+                return decode_flag, factor
+        return cv2.IMREAD_COLOR, 1
+
+    def _video_display_size(self):
+        """(width, height) of the video display, or None before it is laid out."""
+        width, height = self.video_display.winfo_width(), self.video_display.winfo_height()
+        return (width, height) if width > 1 and height > 1 else None
+
+    def _render_video_frame(self, frame):
+        """Draws a BGR frame into the video display, scaled to fit. The PhotoImage and the
+           scaling and PPM buffers are reused for as long as the drawn size stays the same."""
+        display_size = self._video_display_size()
+        if not self.video_visible or display_size is None:
+            return
+        height, width = frame.shape[:2]
+        scale = min(display_size[0] / width, display_size[1] / height)
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+
+        if self.video_render_buffers is None or self.video_render_buffers[0] != size:
+            header = f"P6 {size[0]} {size[1]} 255\n".encode('ascii')
+            ppm = bytearray(len(header) + size[0] * size[1] * 3)
+            ppm[:len(header)] = header
+            rgb = np.frombuffer(ppm, dtype=np.uint8, offset=len(header)).reshape(size[1], size[0], 3)
+            scaled = np.empty((size[1], size[0], 3), dtype=np.uint8)
+            self.video_render_buffers = (size, scaled, ppm, rgb)
+        _, scaled, ppm, rgb = self.video_render_buffers
+
+        if size != (width, height):
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            frame = cv2.resize(frame, size, dst=scaled, interpolation=interpolation)
+        cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=rgb)
+        # Tk takes image data as bytes only, so this is the one copy per drawn frame.
+        self.video_photo.configure(data=bytes(ppm), format="PPM")
+        self.video_display.coords(self.video_image_item, display_size[0] // 2, display_size[1] // 2)
+        self.video_display.itemconfigure(self.video_placeholder_item, state="hidden")
+
+    def _on_video_display_configure(self, event):
+        self.video_display.coords(self.video_placeholder_item, event.width // 2, event.height // 2)
+        if self.video_last_frame is not None:
+            self._render_video_frame(self.video_last_frame)
+
+    def _on_video_display_visibility(self, event):
+        """Stops decoding and drawing while the video display is completely covered (X11 only)."""
+        self._set_video_visible(event.state != "VisibilityFullyObscured")
+
+    def _on_window_map_change(self, event):
+        """Stops decoding and drawing while the window is minimized."""
+        if event.widget is self:
+            self._set_video_visible(event.type == tk.EventType.Map)
+
+    def _set_video_visible(self, visible):
+        was_visible, self.video_visible = self.video_visible, visible
+        if visible and not was_visible and self.video_last_frame is not None:
+            self._render_video_frame(self.video_last_frame)
+
+    def _schedule_frame_processing(self):
+        """Schedules the next _process_buffered_frames for when the next frame is due."""
         if not stop_client_event.is_set():
-            if cv2.waitKey(1) & 0xFF == ord('q'): 
-                self.on_closing() 
-                return
-            
-            self.after(10, self._process_buffered_frames)
+            self.after(self._next_frame_check_delay_ms(), self._process_buffered_frames)
         else:
-            print("Client: Not rescheduling _opencv_gui_update_and_reschedule_frame_processing due to shutdown event.")
+            print("Client: Not rescheduling frame processing due to shutdown event.")
 
+    def _next_frame_check_delay_ms(self):
+        """Milliseconds until the next buffered frame is due for decoding or showing, at most
+           FRAME_PROCESS_INTERVAL_MS so frames completed in the meantime are picked up."""
+        with udp_data_lock:
+            next_playout = jitter_buffer.next_playout()
+        if next_playout is not None:
+            next_playout -= frame_decode_pool.lead_time
+        decoded_playout = frame_decode_pool.next_playout()
+        if decoded_playout is not None and (next_playout is None or decoded_playout < next_playout):
+            next_playout = decoded_playout
+        if next_playout is None:
+            return FRAME_PROCESS_INTERVAL_MS
+        return max(1, min(FRAME_PROCESS_INTERVAL_MS, int((next_playout - time.monotonic()) * 1000) + 1))
 
     def update_video_status(self, message, color):
         status_symbols = {
@@ -1089,8 +1891,6 @@ class CombinedClient(tk.Tk):
                 tcp_client_socket = None
         
 
-        cv2.destroyAllWindows()
-
         print("Client: Waiting for threads to finish (briefly)...")
         time.sleep(0.5) 
 
@@ -1103,6 +1903,22 @@ if __name__ == "__main__":
     
     client_udp_port = DEFAULT_UDP_VIDEO_CLIENT_PORT
     is_host_client = False 
+    video_tier = None
+    video_channel = None
+
+    if '--tier' in sys.argv[1:]:
+        tier_arg_index = sys.argv.index('--tier') + 1
+        if tier_arg_index < len(sys.argv):
+            video_tier = sys.argv[tier_arg_index]
+        else:
+            print("Missing value for --tier. Using the server's default tier.")
+
+    if '--channel' in sys.argv[1:]:
+        channel_arg_index = sys.argv.index('--channel') + 1
+        if channel_arg_index < len(sys.argv):
+            video_channel = sys.argv[channel_arg_index]
+        else:
+            print("Missing value for --channel. Using the server's default channel.")
 
     if len(sys.argv) > 1:
         try:
@@ -1114,6 +1930,8 @@ if __name__ == "__main__":
                     is_host_client = True
             elif sys.argv[1] == '--host': 
                 is_host_client = True
+            elif sys.argv[1].startswith('--'):
+                is_host_client = '--host' in sys.argv[2:]
             else:
                 print(f"Invalid argument provided: {sys.argv[1]}. Using default port {DEFAULT_UDP_VIDEO_CLIENT_PORT}.")
                 client_udp_port = DEFAULT_UDP_VIDEO_CLIENT_PORT
@@ -1123,6 +1941,6 @@ if __name__ == "__main__":
         except IndexError: 
             pass 
 
-    app = CombinedClient(client_udp_port, is_host_client)
+    app = CombinedClient(client_udp_port, is_host_client, video_tier, video_channel)
     app.mainloop()
     print("Combined Client: mainloop exited.")
\ No newline at end of file
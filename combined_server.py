@@ -1,45 +1,230 @@
 import socket
-import json
+import asyncio
+import argparse
 import threading
 import datetime
 import time
 import cv2
 import numpy as np
 import os 
+import collections
+import itertools
+import ipaddress
+import multiprocessing
+import selectors
+from udp_fanout import UdpFanoutSender
+from video_protocol import (DEFAULT_VIDEO_DATAGRAM_SIZE, DELTA_HEADER, FLAG_DELTA, FLAG_PARITY, capture_timestamp,
+                            data_packet_position, format_nack_messages, pack_delta_payload, packetize_frame, parse_nack_entries,
+                            parse_packet_header, payload_size_for_datagram)
+from announcement_store import AnnouncementStore
+from chat_bus import CHAT_BUS_CONNECT_TIMEOUT, ChatBusClient, ChatBusHub
+from chat_upstream import UpstreamChatClient
+from chat_log import ChatLog, message_time
+from chat_protocol import (FRAMING_BINARY, FRAMING_JSON, FrameTooLarge, MessageReader, ProtocolError, SenderTable,
+                           encode_binary_message, encode_json_message, encode_sender_definitions)
+from chat_outbound import OUTBOUND_WRITE_CHUNK, BroadcastBatcher, OutboundQueue, SocketWriter
+from video_cache import EncodedFrameCache
+from video_fec import FEC_MODES, fec_group_params
 
 
 TCP_HOST = '0.0.0.0'
 TCP_PORT = 4000
+# "threads": one thread per chat connection. "asyncio": every chat connection on a
+# single event loop thread, for rooms with thousands of mostly idle viewers.
+# Overridden by --chat-backend.
+CHAT_BACKEND = "threads"
+CHAT_LISTEN_BACKLOG = 1024
+# With CHAT_WORKERS > 0, that many worker processes accept chat clients on TCP_PORT
+# together (SO_REUSEPORT, Linux/BSD) so fan-out uses more than one core. This
+# process becomes the hub of chat_bus.py: it keeps the history, chat log and
+# announcements and orders every event. Overridden by --chat-workers.
+CHAT_WORKERS = 0
+CHAT_BUS_PATH = 'chat_bus.sock'
+# Longest message a client may send; a longer one gets a serverError and the connection is closed.
+CHAT_MAX_MESSAGE_BYTES = 1024 * 1024
+# Offer the compact binary framing (chat_protocol.py) to clients that say hello with
+# it; clients that don't keep getting JSON lines.
+CHAT_BINARY_FRAMING = True
+
+# Every chat connection has a bounded outbound queue drained by non-blocking writes,
+# so a slow viewer cannot stall delivery to the others. When a queue overflows:
+# "drop_oldest" drops its oldest queued chat messages, "disconnect" closes the
+# connection, "coalesce" replaces its queued chat messages with one
+# loadOldChatMessages of the last CHAT_HISTORY_ON_CONNECT messages.
+CHAT_OUTBOUND_MAX_BYTES = 256 * 1024
+CHAT_OUTBOUND_POLICY = "drop_oldest"
+CHAT_STATS_INTERVAL = 30.0
+
+# Chat messages arriving within CHAT_BATCH_WINDOW seconds of each other are sent
+# to every client as one chatBatch message (one encode and one write per client).
+# Announcements are never delayed. 0 broadcasts every chat message on its own.
+CHAT_BATCH_WINDOW = 0.02
+CHAT_BATCH_MAX_MESSAGES = 64  # keeps each chatBatch well under CHAT_OUTBOUND_MAX_BYTES
+
+# The server keeps the last CHAT_HISTORY_MAX_MESSAGES chat messages in memory. New
+# clients get the last CHAT_HISTORY_ON_CONNECT and page further back with
+# fetchChatHistory {"before": <message id>, "limit": n} (or {"before_time": <ISO
+# timestamp>}), up to CHAT_HISTORY_PAGE_MAX messages per chatHistoryPage reply. A
+# "request" value in fetchChatHistory is echoed in the chatHistoryPage or serverError
+# answering it, so a relay can match replies to the clients that asked.
+CHAT_HISTORY_MAX_MESSAGES = 2000
+CHAT_HISTORY_ON_CONNECT = 50
+CHAT_HISTORY_PAGE_MAX = 100
+
+# Every chat message is also appended to a segmented log in CHAT_LOG_DIR (fsynced in
+# groups by a background thread). On startup the newest messages are reloaded from
+# it, and pages older than the in-memory history are read from it.
+CHAT_LOG_ENABLED = True
+CHAT_LOG_DIR = 'chat_log'
+CHAT_LOG_SEGMENT_BYTES = 8 * 1024 * 1024
 
 
 UDP_HOST = '0.0.0.0' 
 UDP_VIDEO_SERVER_PORT = 5000 
 
 MAX_UDP_PACKET_SIZE = 65000 
+# "mtu": frames are split into VIDEO_DATAGRAM_SIZE datagrams that never need IP
+# fragmentation. "jumbo": the old MAX_UDP_PACKET_SIZE datagrams, left to the IP layer.
+PACKETIZER_MODE = "mtu"
+VIDEO_DATAGRAM_SIZE = DEFAULT_VIDEO_DATAGRAM_SIZE
+
+# Forward error correction: "off", "xor" (one parity packet per group) or "rs"
+# (Reed-Solomon-style, FEC_RS_GROUP_SIZE data packets per group). FEC_OVERHEAD is
+# the parity/data ratio, e.g. 0.2 lets clients rebuild 1 lost packet in 5.
+FEC_MODE = "off"
+FEC_OVERHEAD = 0.2
+FEC_RS_GROUP_SIZE = 20
+
+# NACK-based retransmission: recently sent frames are kept in a per-tier ring and
+# missing packets are resent on request, but never once a frame is older than
+# RETRANSMIT_MAX_AGE (it would miss its playout deadline anyway).
+RETRANSMIT_ENABLED = True
+RETRANSMIT_RING_FRAMES = 64
+RETRANSMIT_MAX_AGE = 0.25
+RETRANSMIT_MAX_PACKETS_PER_NACK = 256
 FPS = 30 
 FRAME_DELAY = 1.0 / FPS
+UDP_CLIENT_TIMEOUT = 10
+
+# Multicast mode for LAN viewers: each channel tier is sent once, to its own group and
+# port (see multicast_group_address), instead of once per viewer. Viewers that offer
+# it (VIDEO_HELLO multicast=1) are told their group with VIDEO_MULTICAST and join it;
+# hellos and receiver reports carry on as before for presence, ABR and NACKs. A viewer
+# whose reports show nothing received for MULTICAST_FALLBACK_REPORTS reports in a row
+# while its group was being sent is switched back to unicast for good.
+MULTICAST_ENABLED = False
+MULTICAST_GROUP_BASE = '239.255.42.0'
+MULTICAST_PORT_BASE = 5100
+MULTICAST_MAX_TIERS = 8       # groups and ports reserved per channel
+MULTICAST_TTL = 1             # stay on the local network
+MULTICAST_FALLBACK_REPORTS = 3
+
+VIDEO_FILE_PATH = 'C:\\Users\\abdul\\Videos\\Captures\\sample_video.mp4' 
+
+# Simulcast ladder: (name, scale, JPEG quality). Each tier with at least one
+# subscribed viewer is encoded once per frame; tier 0 is the default.
+VIDEO_TIER_LADDER = [
+    ("full", 1.0, 80),
+    ("half", 0.5, 70),
+    ("quarter", 0.25, 60),
+]
+
+# Channels served by this process: (name, source, FPS, tier ladder). Viewers pick one
+# with VIDEO_HELLO channel=<name|index> (default: the first); the channel index is
+# carried in every video packet. All channels share one UDP fan-out sender.
+VIDEO_CHANNELS = [
+    ("main", VIDEO_FILE_PATH, FPS, VIDEO_TIER_LADDER),
+]
+
+# Receiver-report driven adaptive bitrate: each viewer is moved down the
+# ladder (then to a lower frame rate) when its reports show loss, and back
+# up after a run of clean reports if the next step fits its measured capacity.
+ABR_ENABLED = True
+ABR_LOSS_HIGH = 0.05
+ABR_LOSS_LOW = 0.01
+ABR_UPGRADE_REPORTS = 5
+ABR_CAPACITY_HEADROOM = 0.85
+ABR_CAPACITY_PROBE_GROWTH = 1.02
+ABR_MAX_FRAME_DIVISOR = 4
+
+# Video pipeline: capture -> encoder pool -> sender, joined by latest-wins queues.
+ENCODER_THREADS = max(1, min(4, (os.cpu_count() or 2) - 1))
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_STATS_INTERVAL = 5.0
+
+# Delta mode for mostly static sources (slides, screen content): frames are cut into
+# DELTA_TILE_SIZE tiles and only tiles that changed since the last frame sent on a tier
+# are JPEG-encoded and sent. A full keyframe goes out every DELTA_KEYFRAME_INTERVAL
+# frames, when a client asks for one (VIDEO_KEYFRAME), or when most tiles changed anyway.
+# ABR frame-rate halving is disabled in this mode since every viewer needs every delta.
+VIDEO_DELTA_MODE = False
+DELTA_TILE_SIZE = 64              # full-resolution pixels; multiple of 16 keeps tier tiles block-aligned
+DELTA_TILE_THRESHOLD = 8          # per-pixel difference at or below this is decoder noise, not a change
+DELTA_KEYFRAME_INTERVAL = 90
+DELTA_MAX_TILE_FRACTION = 0.5     # send a keyframe instead when more tiles than this changed
+DELTA_KEYFRAME_REQUEST_MIN_INTERVAL = 0.5
+
+# Cache mode for looping file sources: the file is encoded and packetized once into
+# VIDEO_CACHE_DIR and then replayed from a memory-mapped file with no decode or encode
+# work. A new cache is built whenever the source file or the encode settings change.
+# Ignored in delta mode, whose packets depend on what each tier was last sent.
+VIDEO_CACHE_ENABLED = False
+VIDEO_CACHE_DIR = 'video_cache'
+
+# Relay mode: with RELAY_UPSTREAM_HOST set this server has no video sources and no
+# chat storage of its own. It subscribes to the upstream server like a viewer -
+# VIDEO_HELLO for each channel tier that has local viewers, one chat connection -
+# and re-serves both to its own viewers, which may be further relays. Packets are
+# forwarded unchanged, so VIDEO_CHANNELS must list the upstream's channels with the
+# same names, FPS and tier ladders (the sources are unused). Overridden by --relay-from.
+RELAY_UPSTREAM_HOST = None
+RELAY_UPSTREAM_TCP_PORT = 4000
+RELAY_UPSTREAM_UDP_PORT = 5000
+RELAY_HELLO_INTERVAL = 2.0                  # well inside the upstream's UDP_CLIENT_TIMEOUT
+RELAY_RECEIVE_BUFFER_BYTES = 4 * 1024 * 1024
+RELAY_BURST_PACKETS = 64                    # packets read before forwarding what has arrived
 
 
 HOST_IP = '192.168.100.199' 
 
 
 ANNOUNCEMENTS_FILE = 'announcements.json'  
+# New announcements are appended to ANNOUNCEMENTS_FILE + '.journal'; after this many
+# the journal is folded into ANNOUNCEMENTS_FILE by a background compaction.
+ANNOUNCEMENT_COMPACT_AFTER = 100
 
 
 announcements = []
 connected_tcp_clients = {} 
 tcp_clients_lock = threading.Lock()
 announcements_lock = threading.Lock()
+announcement_store = None  # AnnouncementStore, set by load_announcements_from_file
 
 
-chat_history = [] 
+chat_history = collections.deque(maxlen=CHAT_HISTORY_MAX_MESSAGES)  # oldest first
 chat_history_lock = threading.Lock()
-
-active_udp_clients = {}
+next_chat_message_id = 1  # ids increase by one per message, so the ring holds a contiguous range
+chat_log = None  # ChatLog when CHAT_LOG_ENABLED
+
+chat_writer = None  # SocketWriter for the threads backend
+chat_batcher = None  # BroadcastBatcher when CHAT_BATCH_WINDOW > 0
+chat_outbound_totals = {"overflow_disconnects": 0}
+chat_senders = SenderTable()  # sender names interned for binary framing, shared by all connections
+
+chat_bus_hub = None  # ChatBusHub in the main process when CHAT_WORKERS > 0
+chat_bus_client = None  # ChatBusClient in a chat worker process
+chat_worker_ready = threading.Event()  # set once a worker has the hub's state
+pending_history_requests = {}  # chat worker: bus request id -> connection waiting for the page
+history_request_ids = itertools.count(1)
+chat_upstream = None  # UpstreamChatClient in relay mode
+upstream_history_requests = {}  # relay: upstream request id -> (connection, the client's own request id)
+upstream_history_lock = threading.Lock()
+
+active_udp_clients = {}  # addr -> UdpViewer
 udp_clients_lock = threading.Lock() 
 
-video_capture_object = None 
 video_mode_active = False
+video_pipelines = {}  # channel index -> VideoPipeline
 
 
 stop_server_event = threading.Event()
@@ -49,200 +234,517 @@ stop_server_event = threading.Event()
 
 
 def load_announcements_from_file():
-    """Loads announcements from file into memory, sorted by timestamp (latest first)."""
-    global announcements
-    
-    if not os.path.exists(ANNOUNCEMENTS_FILE):
-        print(f"Announcements file '{ANNOUNCEMENTS_FILE}' not found. Starting with empty announcements.")
-        announcements = []
-        return
-    
-    try:
-        with open(ANNOUNCEMENTS_FILE, 'r', encoding='utf-8') as f:
-            loaded_announcements = json.load(f)
-            
-
-        valid_announcements = []
-        for ann in loaded_announcements:
-            if isinstance(ann, dict) and 'timestamp' in ann and 'message' in ann:
-                valid_announcements.append(ann)
-            else:
-                print(f"Warning: Invalid announcement format found: {ann}")
-        
+    """Loads announcements (latest first) from the snapshot and journal into memory."""
+    global announcements, announcement_store
 
-        valid_announcements.sort(key=lambda x: x['timestamp'], reverse=True)
-        
-        with announcements_lock:
-            announcements = valid_announcements
-            
-        print(f"Loaded {len(announcements)} announcements from '{ANNOUNCEMENTS_FILE}'")
-        
-    except json.JSONDecodeError as e:
-        print(f"Error: Invalid JSON in announcements file '{ANNOUNCEMENTS_FILE}': {e}")
-        print("Starting with empty announcements.")
-        announcements = []
-    except Exception as e:
+    announcement_store = AnnouncementStore(ANNOUNCEMENTS_FILE, snapshot=announcements_snapshot,
+                                           compact_after=ANNOUNCEMENT_COMPACT_AFTER)
+    try:
+        loaded_announcements = announcement_store.load()
+    except OSError as e:
         print(f"Error loading announcements from file '{ANNOUNCEMENTS_FILE}': {e}")
-        print("Starting with empty announcements.")
-        announcements = []
+        print("Starting with empty announcements; new announcements will not be saved.")
+        announcement_store = None
+        loaded_announcements = []
+
+    with announcements_lock:
+        announcements = loaded_announcements
+    print(f"Loaded {len(announcements)} announcements from '{ANNOUNCEMENTS_FILE}'")
+
+def announcements_snapshot():
+    with announcements_lock:
+        return announcements.copy()
 
 def save_announcements_to_file():
-    """Saves current announcements to file."""
+    """Compacts the announcement journal into a fresh snapshot file."""
+    if announcement_store is None:
+        return
     try:
-        if os.path.exists(ANNOUNCEMENTS_FILE):
-            backup_file = f"{ANNOUNCEMENTS_FILE}.backup"
-            try:
-                os.rename(ANNOUNCEMENTS_FILE, backup_file)
-            except OSError:
-                pass  
-        
-        with announcements_lock:
-            announcements_copy = announcements.copy()
-        
-        with open(ANNOUNCEMENTS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(announcements_copy, f, indent=2, ensure_ascii=False)
-        
-        print(f"Saved {len(announcements_copy)} announcements to '{ANNOUNCEMENTS_FILE}'")
-        
+        saved = announcement_store.compact()
+        print(f"Saved {saved} announcements to '{ANNOUNCEMENTS_FILE}'")
     except Exception as e:
         print(f"Error saving announcements to file '{ANNOUNCEMENTS_FILE}': {e}")
 
 def add_announcement_and_save(announcement):
-    """Adds a new announcement to memory and saves to file."""
+    """Adds a new announcement to memory and appends it to the journal."""
     with announcements_lock:
         announcements.insert(0, announcement)
-    
-    save_announcements_to_file()
+
+    if announcement_store is None:
+        return
+    try:
+        announcement_store.append(announcement)
+    except OSError as e:
+        print(f"Error saving announcement to journal '{announcement_store.journal_path}': {e}")
 
 
 # TCP Announcement and Chat Server Functions
 
 
-def handle_tcp_client(client_socket, addr):
-    """Handles a single TCP client connection for announcements and chat."""
-    print(f"TCP Server: Client connected from: {addr}")
+def encode_tcp_message(message_type, payload):
+    """Encodes one newline-delimited JSON protocol message."""
+    return encode_json_message(message_type, payload)
+
 
+def open_chat_log():
+    """Opens the chat log and reloads the newest messages from it into the history ring."""
+    global chat_log, next_chat_message_id
+    if not CHAT_LOG_ENABLED:
+        return
+    try:
+        chat_log = ChatLog(CHAT_LOG_DIR, CHAT_LOG_SEGMENT_BYTES).open()
+        messages, _ = chat_log.read_before(chat_log.last_id + 1, CHAT_HISTORY_MAX_MESSAGES)
+    except (OSError, ValueError) as e:
+        print(f"Error opening chat log '{CHAT_LOG_DIR}': {e}")
+        print("Chat history will not be saved.")
+        chat_log = None
+        return
+    with chat_history_lock:
+        chat_history.extend(messages)
+        next_chat_message_id = chat_log.last_id + 1
+    print(f"Loaded {len(messages)} chat messages from '{CHAT_LOG_DIR}' (last id {chat_log.last_id})")
+
+
+def close_chat_log():
+    if chat_log is not None:
+        chat_log.close()
+
+
+def add_chat_message(chat_message):
+    """Stamps a chat message with the next id, appends it to the history ring and queues it for the log."""
+    global next_chat_message_id
+    with chat_history_lock:
+        chat_message["id"] = next_chat_message_id
+        next_chat_message_id += 1
+        chat_history.append(chat_message)
+        if chat_log is not None:
+            chat_log.append(chat_message)
+
+
+def record_chat_message(chat_message):
+    """Appends a chat message the hub (or a relay's upstream) has already stamped to the history ring."""
+    global next_chat_message_id
+    with chat_history_lock:
+        chat_history.append(chat_message)
+        next_chat_message_id = chat_message["id"] + 1
+
+
+def chat_history_page(before=None, limit=CHAT_HISTORY_ON_CONNECT):
+    """Returns (messages, has_more): up to limit messages with ids below before
+       (the newest ones when before is None), oldest first. Pages older than the
+       in-memory history are read from the chat log."""
+    with chat_history_lock:
+        ring_first_id = chat_history[0]["id"] if chat_history else next_chat_message_id
+        if before is None:
+            before = next_chat_message_id
+        end = max(0, min(len(chat_history), before - ring_first_id))
+        start = max(0, end - limit)
+        messages = list(itertools.islice(chat_history, start, end))
+    if start > 0 or chat_log is None:
+        return messages, start > 0
+
+    older_before = min(before, ring_first_id)
+    if len(messages) == limit:
+        return messages, chat_log.has_before(older_before)
+    older, has_more = chat_log.read_before(older_before, limit - len(messages))
+    return older + messages, has_more
+
+
+def chat_id_at_time(timestamp):
+    """Id of the first chat message at or after a unix timestamp, for fetchChatHistory's before_time."""
+    with chat_history_lock:
+        if chat_history and message_time(chat_history[0]) <= timestamp:
+            return next((m["id"] for m in chat_history if message_time(m) >= timestamp), next_chat_message_id)
+        ring_first_id = chat_history[0]["id"] if chat_history else next_chat_message_id
+    if chat_log is None:
+        return ring_first_id
+    return min(chat_log.id_at_time(timestamp), ring_first_id)
+
+
+def fetch_chat_history(request):
+    """Answers a fetchChatHistory payload with ("chatHistoryPage", page) or ("serverError", error)."""
+    before = request.get("before")
+    if before is None and request.get("before_time"):
+        before = chat_id_at_time(message_time({"timestamp": request["before_time"]}))
+    limit = request.get("limit", CHAT_HISTORY_ON_CONNECT)
+    if (before is not None and not isinstance(before, int)) or not isinstance(limit, int):
+        return "serverError", history_reply(request, {"message": "fetchChatHistory needs integer 'before' and 'limit'."})
+    messages, has_more = chat_history_page(before, max(1, min(limit, CHAT_HISTORY_PAGE_MAX)))
+    return "chatHistoryPage", history_reply(request, {"before": before, "messages": messages, "has_more": has_more})
+
+
+def history_reply(request, reply):
+    """Copies a fetchChatHistory request's "request" id, if any, into its reply."""
+    if isinstance(request, dict) and "request" in request:
+        reply["request"] = request["request"]
+    return reply
+
+
+def recent_chat_snapshot(framing=FRAMING_JSON):
+    """Encoded loadOldChatMessages with the latest messages; replaces a coalesced chat backlog.
+       Binary snapshots spell sender names out, so they stand alone if queued data is dropped."""
+    messages, _ = chat_history_page()
+    if framing == FRAMING_BINARY:
+        return encode_binary_message("loadOldChatMessages", messages)[0]
+    return encode_tcp_message("loadOldChatMessages", messages)
+
+
+class ChatConnection:
+    """Protocol state shared by both chat backends: the negotiated framing, the
+       sender names this client already knows and the input reader."""
+
+    def _init_protocol(self):
+        self.framing = FRAMING_JSON
+        self.reader = MessageReader(max_frame_bytes=CHAT_MAX_MESSAGE_BYTES)
+        self.known_senders = {}  # sender id -> name, as this client last had it defined
+        self._framing_lock = threading.RLock()
+        self.queue = OutboundQueue(CHAT_OUTBOUND_MAX_BYTES, CHAT_OUTBOUND_POLICY,
+                                   snapshot=lambda: recent_chat_snapshot(self.framing))
+
+    def send(self, message_type, payload, droppable=False, encoded=None, bounded=True):
+        """Encodes a message in this connection's framing and queues it. encoded caches
+           encodings across the connections of one broadcast; bounded=False queues it
+           outside the outbound queue's byte limit."""
+        if encoded is None:
+            encoded = {}
+        with self._framing_lock:
+            if self.framing == FRAMING_JSON:
+                data = encoded.get(FRAMING_JSON)
+                if data is None:
+                    data = encoded[FRAMING_JSON] = encode_tcp_message(message_type, payload)
+                self.send_bytes(data, droppable, bounded)
+                return
+            frame = encoded.get(FRAMING_BINARY)
+            if frame is None:
+                frame = encoded[FRAMING_BINARY] = encode_binary_message(message_type, payload, chat_senders)
+            data, used_senders = frame
+            new_senders = {i: name for i, name in used_senders.items() if self.known_senders.get(i) != name}
+            if new_senders:
+                # Definitions are never droppable, unlike the chat messages that use them.
+                self.send_bytes(encode_sender_definitions(new_senders), bounded=bounded)
+                self.known_senders.update(new_senders)
+            self.send_bytes(data, droppable, bounded)
+
+    def switch_framing(self, framing):
+        """Acknowledges a hello; everything queued after the acknowledgement uses framing."""
+        with self._framing_lock:
+            self.send("framing", {"framing": framing})
+            self.framing = framing
+
+
+class TcpClientConnection(ChatConnection):
+    """A chat client served by its own thread (threads backend). Writes are queued and
+       flushed without blocking, by the sending thread while the socket accepts data and
+       by the shared chat writer thread once it does not."""
+
+    def __init__(self, client_socket, addr):
+        self.sock = client_socket
+        self.addr = addr
+        self._init_protocol()
+        self.closed = False
+        # The reader thread keeps the original socket; writes go through a
+        # non-blocking duplicate so a full send buffer never blocks a sender.
+        self.write_sock = client_socket.dup()
+        self.write_sock.setblocking(False)
+        self._flush_lock = threading.Lock()
+
+    def send_bytes(self, data, droppable=False, bounded=True):
+        if self.closed:
+            return
+        if not self.queue.push(data, droppable, bounded):
+            drop_slow_tcp_client(self)
+            return
+        # Write straight away unless another thread is already flushing; hand
+        # whatever the socket does not take to the writer thread.
+        if self._flush_lock.acquire(blocking=False):
+            try:
+                pending = self._flush_locked()
+            finally:
+                self._flush_lock.release()
+            if not pending:
+                return
+        chat_writer.notify(self)
+
+    def flush(self):
+        """Writes queued data until the socket would block. Returns True while data remains."""
+        with self._flush_lock:
+            return self._flush_locked()
+
+    def _flush_locked(self):
+        while not self.closed:
+            chunk = self.queue.peek_chunk()
+            if not chunk:
+                return False
+            try:
+                sent = self.write_sock.send(chunk)
+            except BlockingIOError:
+                return True
+            except OSError as e:
+                print(f"TCP Server: Error sending to client {self.addr}: {e}")
+                unregister_tcp_client(self)
+                self.close()
+                return False
+            self.queue.consume(sent)
+        return False
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError as e:
+            print(f"TCP Server: Error during socket shutdown/close for {self.addr}: {e}")
+        self.sock.close()
+        self.write_sock.close()
+
+
+class AsyncClientConnection(ChatConnection):
+    """A chat client on the asyncio event loop. Queued data is handed to the transport
+       only while it is below its high-water mark, so the outbound queue bound applies."""
+
+    def __init__(self, transport, addr, loop):
+        self.transport = transport
+        self.addr = addr
+        self._init_protocol()
+        self.closed = False
+        self.paused = False
+        self._loop = loop
+        self._loop_thread_id = threading.get_ident()
+        self._flush_scheduled = False
+
+    def send_bytes(self, data, droppable=False, bounded=True):
+        if self.closed:
+            return
+        if not self.queue.push(data, droppable, bounded):
+            drop_slow_tcp_client(self)
+            return
+        if threading.get_ident() == self._loop_thread_id:
+            self.flush()
+        elif not self._flush_scheduled:
+            self._flush_scheduled = True
+            self._loop.call_soon_threadsafe(self._scheduled_flush)
+
+    def _scheduled_flush(self):
+        self._flush_scheduled = False
+        self.flush()
+
+    def flush(self):
+        # transport.write() calls pause_writing() once its buffer passes the high-water mark.
+        while not self.paused and not self.closed:
+            chunk = self.queue.peek_chunk()
+            if not chunk:
+                return
+            self.transport.write(chunk)
+            self.queue.consume(len(chunk))
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        if threading.get_ident() == self._loop_thread_id:
+            self.transport.close()
+        else:
+            self._loop.call_soon_threadsafe(self.transport.close)
+
+
+def drop_slow_tcp_client(connection):
+    """Disconnects a client whose outbound queue overflowed beyond what its policy can drop."""
+    chat_outbound_totals["overflow_disconnects"] += 1
+    print(f"TCP Server: Outbound queue for {connection.addr} overflowed "
+          f"({connection.queue.queued_bytes // 1024}KB queued), disconnecting.")
+    unregister_tcp_client(connection)
+    connection.close()
+
+
+def log_chat_outbound_stats():
     with tcp_clients_lock:
-        connected_tcp_clients[addr] = client_socket
-    
+        connections = list(connected_tcp_clients.values())
+    if not connections:
+        return
+    queued = sum(c.queue.queued_bytes for c in connections)
+    dropped = sum(c.queue.dropped for c in connections)
+    coalesced = sum(c.queue.coalesced for c in connections)
+    deepest = sorted(connections, key=lambda c: c.queue.queued_bytes, reverse=True)[:3]
+    laggards = ", ".join(f"{c.addr} depth={c.queue.depth} (max {c.queue.max_depth}) dropped={c.queue.dropped}"
+                         for c in deepest if c.queue.depth)
+    print(f"TCP Server: Outbound queues: {len(connections)} clients, {queued // 1024}KB queued, "
+          f"dropped={dropped} coalesced={coalesced} "
+          f"overflow disconnects={chat_outbound_totals['overflow_disconnects']}"
+          + (f" | deepest: {laggards}" if laggards else ""))
+
+
+def register_tcp_client(connection):
+    print(f"TCP Server: Client connected from: {connection.addr}")
+    with tcp_clients_lock:
+        connected_tcp_clients[connection.addr] = connection
+
+
+def unregister_tcp_client(connection):
+    print(f"TCP Server: Closing connection for client: {connection.addr}")
+    with tcp_clients_lock:
+        if connected_tcp_clients.get(connection.addr) is connection:
+            del connected_tcp_clients[connection.addr]
 
-    client_socket.settimeout(1.0) 
+
+def send_initial_state(connection):
+    """Sends stored announcements and chat history to a newly connected client. Both are
+       queued outside the outbound byte limit, however many announcements are stored."""
+    with announcements_lock:
+        initial_message = encode_tcp_message("loadOldAnnouncements", announcements) if announcements else None
+    if initial_message:
+        connection.send_bytes(initial_message, bounded=False)
+
+    messages, _ = chat_history_page()
+    if messages:
+        try:
+            connection.send("loadOldChatMessages", messages, bounded=False)
+        except socket.error as e:
+            print(f"TCP Server: Error sending initial chat history to {connection.addr}: {e}")
+
+
+def process_tcp_message(connection, msg_type, msg_payload):
+    """Handles one protocol message from a client. Socket errors while replying are re-raised."""
+    addr = connection.addr
+    print(f"TCP Server: Received '{msg_type}' from {addr}: {msg_payload}")
 
     try:
+        if msg_type == "hello":
+            offered = msg_payload.get("framing") or []
+            if CHAT_BINARY_FRAMING and FRAMING_BINARY in offered:
+                # The client switches once it reads the acknowledgement, so whatever
+                # it sends next is binary.
+                connection.reader.framing = FRAMING_BINARY
+                connection.switch_framing(FRAMING_BINARY)
+            else:
+                connection.send("framing", {"framing": FRAMING_JSON})
+
+        elif msg_type == "createAnnouncement":
+            if chat_upstream is not None:
+                # The upstream only takes announcements from HOST_IP, never from a relay.
+                connection.send("announcementError", {"message": "Announcements can only be created on the origin server."})
+            elif addr[0] == HOST_IP: 
+                announcement_text = msg_payload.get("message")
+                if announcement_text and announcement_text.strip():
+                    new_announcement = {
+                        "id": str(datetime.datetime.now()),
+                        "message": announcement_text.strip(),
+                        "timestamp": datetime.datetime.now().isoformat()
+                    }
+                    
+                    print(f"TCP Server: New announcement created by host {addr}: {new_announcement['message']}")
+                    publish_announcement(new_announcement)
+                else:
+                    connection.send("announcementError", {"message": "Announcement message cannot be empty."})
+            else:
+                connection.send("announcementError", {"message": "Only the designated host can create announcements."})
+
+        elif msg_type == "chatMessage":
+            chat_text = msg_payload.get("message")
+            sender_id = msg_payload.get("sender_id", f"UnknownClient-{addr[1]}") 
+            if chat_text and chat_text.strip():
+                new_chat_message = {
+                    "sender": sender_id,
+                    "message": chat_text.strip(),
+                    "timestamp": datetime.datetime.now().isoformat()
+                }
+
+                print(f"TCP Server: New chat message from {sender_id} ({addr}): {new_chat_message['message']}")
+                if not publish_chat_message(new_chat_message):
+                    connection.send("serverError", {"message": "Chat is unavailable: no connection to the upstream server."})
+
+        elif msg_type == "fetchChatHistory":
+            if chat_bus_client is not None:
+                # Only the hub has the chat log; its reply is routed back by request id.
+                request_id = next(history_request_ids)
+                pending_history_requests[request_id] = connection
+                chat_bus_client.send("fetchChatHistory", {"request": request_id, "query": dict(msg_payload)})
+            elif chat_upstream is not None:
+                request_upstream_history(connection, msg_payload)
+            else:
+                connection.send(*fetch_chat_history(msg_payload))
 
-        with announcements_lock:
-            if announcements:
-                initial_message = json.dumps({
-                    "type": "loadOldAnnouncements",
-                    "payload": announcements
-                })
-                try:
-                    client_socket.sendall(initial_message.encode('utf-8') + b'\n')
-                except socket.error as e:
-                    print(f"TCP Server: Error sending initial announcements to {addr}: {e}")
-                    return 
+        else:
+            connection.send("serverError", {"message": f"Unknown message type: {msg_type}."})
 
-        with chat_history_lock:
-            if chat_history:
-                initial_chat_message = json.dumps({
-                    "type": "loadOldChatMessages",
-                    "payload": chat_history
-                })
-                try:
-                    client_socket.sendall(initial_chat_message.encode('utf-8') + b'\n')
-                except socket.error as e:
-                    print(f"TCP Server: Error sending initial chat history to {addr}: {e}")
+    except socket.error:
+        raise
+    except Exception as e:
+        print(f"TCP Server: Error processing message from {addr}: {e}")
+        error = {"message": f"Server error: {e}"}
+        connection.send("serverError", history_reply(msg_payload, error) if msg_type == "fetchChatHistory" else error)
 
-        
-        buffer = b'' 
-        while not stop_server_event.is_set():
+
+def read_tcp_messages(connection):
+    """Handles every complete message buffered in connection.reader. Returns False if
+       the connection should be closed: an oversized message or a malformed binary
+       frame leaves the stream unusable, while a bad JSON line is answered and skipped."""
+    while True:
+        try:
+            message = connection.reader.next_message()
+        except FrameTooLarge as e:
+            print(f"TCP Server: Client {connection.addr} sent an oversized message, disconnecting: {e}")
+            connection.send("serverError", {"message": f"Message too large (limit {CHAT_MAX_MESSAGE_BYTES} bytes)."})
+            return False
+        except ProtocolError as e:
+            print(f"TCP Server: Invalid message from {connection.addr}: {e}")
+            if connection.reader.framing == FRAMING_BINARY:
+                return False
+            connection.send("serverError", {"message": "Invalid JSON format."})
+            continue
+        if message is None:
+            break
+        process_tcp_message(connection, *message)
+    return True
+
+
+def publish_chat_message(chat_message):
+    """Records a new chat message and broadcasts it; a chat worker leaves both to the hub
+       and a relay to its upstream, which echoes it back. Returns False if it was dropped."""
+    if chat_bus_client is not None:
+        chat_bus_client.send("chatMessage", chat_message)
+        return True
+    if chat_upstream is not None:
+        return chat_upstream.send("chatMessage", {"sender_id": chat_message["sender"], "message": chat_message["message"]})
+    add_chat_message(chat_message)
+    queue_broadcast("chatMessage", chat_message)
+    return True
+
+
+def publish_announcement(announcement):
+    """Saves a new announcement and broadcasts it; a chat worker leaves both to the hub."""
+    if chat_bus_client is not None:
+        chat_bus_client.send("createAnnouncement", announcement)
+        return
+    add_announcement_and_save(announcement)
+    queue_broadcast("newAnnouncement", announcement)
+
+
+def handle_tcp_client(client_socket, addr):
+    """Handles a single TCP client connection for announcements and chat (threads backend)."""
+    # Small messages and batches are written as soon as they are ready; don't let
+    # Nagle hold one back waiting for the client's (delayed) ACK of the previous one.
+    client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    connection = TcpClientConnection(client_socket, addr)
+    register_tcp_client(connection)
+
+    client_socket.settimeout(1.0) 
+
+    try:
+        try:
+            send_initial_state(connection)
+        except socket.error as e:
+            print(f"TCP Server: Error sending initial announcements to {addr}: {e}")
+            return 
+
+        while not stop_server_event.is_set() and not connection.closed:
             try:
-                data = client_socket.recv(4096) 
-                if not data:
+                if not connection.reader.receive(client_socket):
                     print(f"TCP Server: Client {addr} disconnected gracefully.")
                     break 
 
-                buffer += data
-                while b'\n' in buffer:
-                    message_bytes, buffer = buffer.split(b'\n', 1)
-                    message_str = message_bytes.decode('utf-8').strip()
-                    print(f"TCP Server: Received from {addr}: {message_str}")
-
-                    try:
-                        message = json.loads(message_str)
-                        msg_type = message.get("type")
-                        msg_payload = message.get("payload")
-
-                        if msg_type == "createAnnouncement":
-                            if addr[0] == HOST_IP: 
-                                announcement_text = msg_payload.get("message")
-                                if announcement_text and announcement_text.strip():
-                                    new_announcement = {
-                                        "id": str(datetime.datetime.now()),
-                                        "message": announcement_text.strip(),
-                                        "timestamp": datetime.datetime.now().isoformat()
-                                    }
-                                    
-                                    add_announcement_and_save(new_announcement)
-                                    
-                                    print(f"TCP Server: New announcement created by host {addr}: {new_announcement['message']}")
-                                    broadcast_message("newAnnouncement", new_announcement)
-                                else:
-                                    error_msg = json.dumps({
-                                        "type": "announcementError",
-                                        "payload": {"message": "Announcement message cannot be empty."}
-                                    })
-                                    client_socket.sendall(error_msg.encode('utf-8') + b'\n')
-                            else:
-                                error_msg = json.dumps({
-                                    "type": "announcementError",
-                                    "payload": {"message": "Only the designated host can create announcements."}
-                                })
-                                client_socket.sendall(error_msg.encode('utf-8') + b'\n')
-
-                        elif msg_type == "chatMessage":
-                            chat_text = msg_payload.get("message")
-                            sender_id = msg_payload.get("sender_id", f"UnknownClient-{addr[1]}") 
-                            if chat_text and chat_text.strip():
-                                new_chat_message = {
-                                    "sender": sender_id,
-                                    "message": chat_text.strip(),
-                                    "timestamp": datetime.datetime.now().isoformat()
-                                }
-
-                                with chat_history_lock:
-                                    chat_history.append(new_chat_message)
-                                
-                                print(f"TCP Server: New chat message from {sender_id} ({addr}): {new_chat_message['message']}")
-                                broadcast_message("chatMessage", new_chat_message)
-                            else:
-
-                                pass 
-
-                        else:
-                            error_msg = json.dumps({
-                                "type": "serverError", 
-                                "payload": {"message": f"Unknown message type: {msg_type}."}
-                            })
-                            client_socket.sendall(error_msg.encode('utf-8') + b'\n')
-
-                    except json.JSONDecodeError:
-                        print(f"TCP Server: Invalid JSON from {addr}: {message_str}")
-                        error_msg = json.dumps({
-                            "type": "serverError",
-                            "payload": {"message": "Invalid JSON format."}
-                        })
-                        client_socket.sendall(error_msg.encode('utf-8') + b'\n')
-                    except socket.error as e: 
-                        print(f"TCP Server: Socket error sending response to {addr}: {e}")
-                        break
-                    except Exception as e:
-                        print(f"TCP Server: Error processing message from {addr}: {e}")
-                        error_msg = json.dumps({
-                            "type": "serverError",
-                            "payload": {"message": f"Server error: {e}"}
-                        })
-                        client_socket.sendall(error_msg.encode('utf-8') + b'\n')
+                if not read_tcp_messages(connection):
+                    break
 
             except socket.timeout:
                 continue 
@@ -256,31 +758,24 @@ def handle_tcp_client(client_socket, addr):
     except Exception as e:
         print(f"TCP Server: Unexpected error handling client {addr}: {e}")
     finally:
-        print(f"TCP Server: Closing connection for client: {addr}")
-        with tcp_clients_lock:
-            if addr in connected_tcp_clients:
-                del connected_tcp_clients[addr]
-        try:
-            client_socket.shutdown(socket.SHUT_RDWR)
-            client_socket.close()
-        except OSError as e:
-            print(f"TCP Server: Error during socket shutdown/close for {addr}: {e}")
+        unregister_tcp_client(connection)
+        connection.close()
 
 def broadcast_message(message_type, payload, exclude_sender_addr=None):
     """Sends a message to all connected TCP clients, optionally excluding one."""
-    message = json.dumps({"type": message_type, "payload": payload}) + '\n'
-    encoded_message = message.encode('utf-8')
+    encoded = {}  # per framing, shared by every connection
+    droppable = message_type in ("chatMessage", "chatBatch")
 
     clients_to_remove = []
     with tcp_clients_lock:
         current_clients = list(connected_tcp_clients.items())
 
-    for addr, client_socket in current_clients:
+    for addr, connection in current_clients:
         if exclude_sender_addr and addr == exclude_sender_addr:
             continue 
 
         try:
-            client_socket.sendall(encoded_message)
+            connection.send(message_type, payload, droppable, encoded)
         except socket.error as e:
             print(f"TCP Server: Error sending to client {addr}: {e}")
             clients_to_remove.append(addr)
@@ -291,22 +786,59 @@ def broadcast_message(message_type, payload, exclude_sender_addr=None):
     with tcp_clients_lock:
         for addr_to_remove in clients_to_remove:
             if addr_to_remove in connected_tcp_clients:
-                sock = connected_tcp_clients.pop(addr_to_remove)
-                try:
-                    sock.shutdown(socket.SHUT_RDWR)
-                    sock.close()
-                    print(f"TCP Server: Removed and closed problematic client socket for {addr_to_remove}")
-                except OSError as e:
-                    print(f"TCP Server: Error closing problematic socket for {addr_to_remove}: {e}")
+                connected_tcp_clients.pop(addr_to_remove).close()
+                print(f"TCP Server: Removed and closed problematic client socket for {addr_to_remove}")
+
+    print(f"TCP Server: Broadcasted '{message_type}' to {len(current_clients)} clients (excluding sender if applicable).")
+
+def queue_broadcast(message_type, payload):
+    """Broadcasts a message, through the chat batcher when batching is enabled.
+       Only chat messages wait for the batch window; anything else flushes it first."""
+    if chat_batcher is None:
+        broadcast_message(message_type, payload)
+    else:
+        chat_batcher.add((message_type, payload), urgent=message_type != "chatMessage")
+
+
+def broadcast_batch(items):
+    """Broadcasts batched (message_type, payload) items in order, runs of chat
+       messages as chatBatch messages of up to CHAT_BATCH_MAX_MESSAGES each."""
+    chat_run = []
+    for message_type, payload in items + [(None, None)]:
+        if message_type == "chatMessage":
+            chat_run.append(payload)
+            if len(chat_run) < CHAT_BATCH_MAX_MESSAGES:
+                continue
+        if len(chat_run) == 1:
+            broadcast_message("chatMessage", chat_run[0])
+        elif chat_run:
+            broadcast_message("chatBatch", chat_run)
+        chat_run = []
+        if message_type not in (None, "chatMessage"):
+            broadcast_message(message_type, payload)
+
+
+def start_chat_batcher(deliver=broadcast_batch):
+    global chat_batcher
+    if CHAT_BATCH_WINDOW > 0:
+        chat_batcher = BroadcastBatcher(CHAT_BATCH_WINDOW, deliver, stop_server_event)
+        chat_batcher.start()
 
-    print(f"TCP Server: Broadcasted '{message_type}' to {len(connected_tcp_clients)} clients (excluding sender if applicable).")
 
 def tcp_announcement_listener():
     """Listens for new TCP client connections for announcements and chat."""
+    global chat_writer
+    chat_writer = SocketWriter(stop_server_event)
+    chat_writer.start()
+    start_chat_batcher()
+
     tcp_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     tcp_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if CHAT_WORKERS:
+        # Every chat worker listens on the port; the kernel spreads connections across them.
+        tcp_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
     tcp_server_socket.bind((TCP_HOST, TCP_PORT))
-    tcp_server_socket.listen(5)
+    tcp_server_socket.listen(CHAT_LISTEN_BACKLOG)
     tcp_server_socket.settimeout(1.0) 
 
     print(f"TCP Server: Listening for announcements and chat on {TCP_HOST}:{TCP_PORT}")
@@ -331,6 +863,606 @@ def tcp_announcement_listener():
     print("TCP Server: Listener thread exited.")
 
 
+class AsyncChatProtocol(asyncio.Protocol):
+    """One chat connection on the asyncio backend: buffers input and handles complete messages."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.connection = None
+
+    def connection_made(self, transport):
+        addr = transport.get_extra_info('peername')[:2]
+        transport.set_write_buffer_limits(high=OUTBOUND_WRITE_CHUNK)
+        self.connection = AsyncClientConnection(transport, addr, self.loop)
+        register_tcp_client(self.connection)
+        try:
+            send_initial_state(self.connection)
+        except socket.error as e:
+            print(f"TCP Server: Error sending initial announcements to {addr}: {e}")
+            transport.close()
+
+    def data_received(self, data):
+        self.connection.reader.feed(data)
+        try:
+            keep_open = read_tcp_messages(self.connection)
+        except Exception as e:
+            print(f"TCP Server: Unhandled error for client {self.connection.addr}: {e}")
+            keep_open = False
+        if not keep_open:
+            self.connection.transport.close()
+
+    def pause_writing(self):
+        self.connection.paused = True
+
+    def resume_writing(self):
+        self.connection.paused = False
+        self.connection.flush()
+
+    def connection_lost(self, exc):
+        self.connection.closed = True
+        if exc is None:
+            print(f"TCP Server: Client {self.connection.addr} disconnected gracefully.")
+        unregister_tcp_client(self.connection)
+
+
+def _raise_open_file_limit():
+    """Raises the soft open-file limit to the hard limit so the event loop can hold many connections."""
+    try:
+        import resource
+    except ImportError:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        except (ValueError, OSError) as e:
+            print(f"TCP Server: Could not raise open file limit from {soft}: {e}")
+
+
+async def _serve_chat_async():
+    loop = asyncio.get_running_loop()
+    server = await loop.create_server(lambda: AsyncChatProtocol(loop), TCP_HOST, TCP_PORT,
+                                      reuse_address=True, reuse_port=CHAT_WORKERS > 0,
+                                      backlog=CHAT_LISTEN_BACKLOG)
+    # Batches are broadcast on the event loop, so each one costs a single wakeup.
+    start_chat_batcher(lambda items: loop.call_soon_threadsafe(broadcast_batch, items))
+    print(f"TCP Server: Listening for announcements and chat on {TCP_HOST}:{TCP_PORT} (asyncio)")
+    try:
+        while not stop_server_event.is_set():
+            await asyncio.sleep(0.5)
+    finally:
+        server.close()
+        with tcp_clients_lock:
+            connections = list(connected_tcp_clients.values())
+        for connection in connections:
+            connection.close()
+        await server.wait_closed()
+
+
+def tcp_announcement_listener_async():
+    """Serves every chat connection from one asyncio event loop on this thread."""
+    _raise_open_file_limit()
+    try:
+        asyncio.run(_serve_chat_async())
+    except Exception as e:
+        if not stop_server_event.is_set():
+            print(f"TCP Server: Event loop error: {e}")
+    print("TCP Server: Listener thread exited.")
+
+
+def sync_chat_worker(worker):
+    """Hub: sends a newly connected worker the announcements and chat history it serves from."""
+    with announcements_lock:
+        current_announcements = announcements.copy()
+    with chat_history_lock:
+        state = {"announcements": current_announcements, "chat": list(chat_history), "next_id": next_chat_message_id}
+    worker.send("state", state)
+
+
+def handle_chat_bus_message(worker, message_type, payload):
+    """Hub: records what a worker forwards and publishes it to every worker in one order."""
+    if message_type == "chatMessage":
+        add_chat_message(payload)
+        chat_bus_hub.publish("chatMessage", payload)
+    elif message_type == "createAnnouncement":
+        add_announcement_and_save(payload)
+        chat_bus_hub.publish("newAnnouncement", payload)
+    elif message_type == "fetchChatHistory":
+        reply_type, reply = fetch_chat_history(payload["query"])
+        worker.send("chatHistoryReply", {"request": payload["request"], "type": reply_type, "payload": reply})
+    else:
+        print(f"Chat Bus: Unknown message type from worker: {message_type}")
+
+
+def handle_chat_hub_message(message_type, payload):
+    """Chat worker: applies and broadcasts what the hub publishes."""
+    global announcements, next_chat_message_id
+    if message_type == "chatMessage":
+        record_chat_message(payload)
+        queue_broadcast("chatMessage", payload)
+    elif message_type == "newAnnouncement":
+        with announcements_lock:
+            announcements.insert(0, payload)
+        queue_broadcast("newAnnouncement", payload)
+    elif message_type == "chatHistoryReply":
+        connection = pending_history_requests.pop(payload["request"], None)
+        if connection is not None and not connection.closed:
+            try:
+                connection.send(payload["type"], payload["payload"])
+            except socket.error as e:
+                print(f"TCP Server: Error sending chat history to {connection.addr}: {e}")
+    elif message_type == "state":
+        with announcements_lock:
+            announcements = payload["announcements"]
+        with chat_history_lock:
+            chat_history.clear()
+            chat_history.extend(payload["chat"])
+            next_chat_message_id = payload["next_id"]
+        chat_worker_ready.set()
+    else:
+        print(f"Chat Bus: Unknown message type from hub: {message_type}")
+
+
+def run_chat_worker(index):
+    """Body of a chat worker process: serves chat clients on the shared port through the hub."""
+    global chat_bus_client
+    try:
+        chat_bus_client = ChatBusClient(CHAT_BUS_PATH, handle_chat_hub_message, stop_server_event).connect()
+    except OSError as e:
+        print(f"Chat worker {index}: Could not connect to the hub at '{CHAT_BUS_PATH}': {e}")
+        return
+    chat_bus_client.start()
+    if not chat_worker_ready.wait(CHAT_BUS_CONNECT_TIMEOUT):
+        print(f"Chat worker {index}: No state from the hub, exiting.")
+        return
+
+    chat_listener = tcp_announcement_listener_async if CHAT_BACKEND == "asyncio" else tcp_announcement_listener
+    tcp_thread = threading.Thread(target=chat_listener, daemon=True)
+    tcp_thread.start()
+    print(f"Chat worker {index} (pid {os.getpid()}) started.")
+
+    next_chat_stats_time = time.time() + CHAT_STATS_INTERVAL
+    try:
+        while not stop_server_event.is_set():
+            time.sleep(0.5)
+            if time.time() >= next_chat_stats_time:
+                log_chat_outbound_stats()
+                next_chat_stats_time = time.time() + CHAT_STATS_INTERVAL
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop_server_event.set()
+        tcp_thread.join(timeout=2.0)
+        chat_bus_client.close()
+
+
+def start_chat_workers():
+    """Forks CHAT_WORKERS chat worker processes. Must run before this process starts any
+       threads: the workers inherit the module's configuration, not its running state."""
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for index in range(CHAT_WORKERS):
+        process = context.Process(target=run_chat_worker, args=(index,), name=f"chat-worker-{index}", daemon=True)
+        process.start()
+        workers.append(process)
+    return workers
+
+
+def request_upstream_history(connection, request):
+    """Relay: asks the upstream for a history page, since only the origin has the chat log.
+       Replies are matched by request id; with no upstream connection the ring answers."""
+    request_id = next(history_request_ids)
+    with upstream_history_lock:
+        upstream_history_requests[request_id] = (connection, request.get("request"))
+        if chat_upstream.send("fetchChatHistory", dict(request, request=request_id)):
+            return
+        del upstream_history_requests[request_id]
+    connection.send(*fetch_chat_history(request))
+
+
+def reset_upstream_history_requests():
+    """Relay: a new upstream connection answers none of the requests sent on the old one."""
+    with upstream_history_lock:
+        upstream_history_requests.clear()
+
+
+def handle_upstream_chat_message(message_type, payload):
+    """Relay: mirrors the upstream's announcements and chat and broadcasts them to local clients."""
+    global announcements, next_chat_message_id
+    if message_type in ("chatMessage", "chatBatch"):
+        chat_messages = [payload] if message_type == "chatMessage" else payload
+        for index, chat_message in enumerate(chat_messages):
+            record_chat_message(chat_message)
+            # The upstream has batched these already; holding them for another window
+            # would add CHAT_BATCH_WINDOW of latency at every hop.
+            if chat_batcher is None:
+                broadcast_message("chatMessage", chat_message)
+            else:
+                chat_batcher.add(("chatMessage", chat_message), urgent=index == len(chat_messages) - 1)
+    elif message_type == "newAnnouncement":
+        with announcements_lock:
+            announcements.insert(0, payload)
+        queue_broadcast("newAnnouncement", payload)
+    elif message_type == "loadOldAnnouncements":
+        with announcements_lock:
+            announcements = list(payload)
+        queue_broadcast("loadOldAnnouncements", payload)
+    elif message_type == "loadOldChatMessages":
+        # Sent on every (re)connect, and when the upstream coalesced our backlog: start over from it.
+        with chat_history_lock:
+            chat_history.clear()
+            chat_history.extend(payload)
+            if payload:
+                next_chat_message_id = payload[-1]["id"] + 1
+        queue_broadcast("loadOldChatMessages", payload)
+    elif message_type in ("chatHistoryPage", "serverError"):
+        # Only replies to our fetchChatHistory carry a request id; other errors are just logged.
+        request_id = payload.get("request") if isinstance(payload, dict) else None
+        with upstream_history_lock:
+            waiting = upstream_history_requests.pop(request_id, None)
+        if waiting is None:
+            print(f"Relay: Upstream sent '{message_type}': {payload}")
+            return
+        connection, client_request_id = waiting
+        payload = dict(payload)
+        del payload["request"]
+        if client_request_id is not None:
+            payload["request"] = client_request_id
+        if not connection.closed:
+            try:
+                connection.send(message_type, payload)
+            except socket.error as e:
+                print(f"TCP Server: Error sending chat history to {connection.addr}: {e}")
+    else:
+        print(f"Relay: Ignoring '{message_type}' from the upstream.")
+
+
+class UdpViewer:
+    """Server-side state for one UDP video viewer."""
+
+    def __init__(self, addr, tier=0, channel=0):
+        self.addr = addr
+        self.channel = channel
+        self.requested_tier = tier  # best tier the viewer asked for; ABR never goes above it
+        self.tier = tier
+        self.frame_divisor = 1      # send every Nth frame
+        self.last_contact = time.time()
+
+        self.capacity_bps = 0.0     # 0 until the viewer has reported congestion
+        self.clean_reports = 0
+        self.last_report = None
+        self.packets_sent = 0
+        self.packets_sent_at_last_report = 0
+
+        self.multicast = False           # receiving its tier's multicast group instead of unicast
+        self.multicast_failed = False    # reported no multicast reception; unicast from now on
+        self.multicast_announced = None  # (group, port) last sent in VIDEO_MULTICAST, or None
+        self.silent_reports = 0
+
+    def wants_frame(self, frame_id):
+        return frame_id % self.frame_divisor == 0
+
+
+class PacketRing:
+    """Fixed-size ring of recently sent frames for one tier: slot frame_id % size holds
+    (frame_id, send_time, fec_k, fec_m, packets). A relay fills frames in packet by
+    packet as they arrive, so its packet lists have None where a packet is missing."""
+
+    def __init__(self, size):
+        self._slots = [None] * size
+        self._lock = threading.Lock()
+
+    def store(self, frame_id, fec_k, fec_m, packets):
+        with self._lock:
+            self._slots[frame_id % len(self._slots)] = (frame_id, time.time(), fec_k, fec_m, packets)
+
+    def add_packet(self, frame_id, fec_k, fec_m, packet_index, num_packets, packet):
+        """Stores one received data packet, replacing whatever frame held its slot."""
+        position = data_packet_position(packet_index, fec_k, fec_m)
+        with self._lock:
+            slot = frame_id % len(self._slots)
+            entry = self._slots[slot]
+            if entry is None or entry[0] != frame_id:
+                entry = (frame_id, time.time(), fec_k, fec_m,
+                         [None] * (data_packet_position(num_packets - 1, fec_k, fec_m) + 1))
+                self._slots[slot] = entry
+            packets = entry[4]
+            if position < len(packets):
+                packets[position] = packet
+
+    def lookup(self, frame_id, packet_indexes, max_age):
+        """Returns the stored data packets for a frame, or None if it was overwritten or is too old."""
+        with self._lock:
+            entry = self._slots[frame_id % len(self._slots)]
+        if entry is None:
+            return None
+        stored_frame_id, send_time, fec_k, fec_m, packets = entry
+        if stored_frame_id != frame_id or time.time() - send_time > max_age:
+            return None
+        found = []
+        for index in packet_indexes:
+            position = data_packet_position(index, fec_k, fec_m)
+            if position < len(packets) and packets[position] is not None:
+                found.append(packets[position])
+        return found
+
+    def missing(self, frame_id, packet_indexes):
+        """Returns the packet_indexes the ring has no packet for; all of them if the frame is not stored."""
+        with self._lock:
+            entry = self._slots[frame_id % len(self._slots)]
+        if entry is None or entry[0] != frame_id:
+            return list(packet_indexes)
+        _, _, fec_k, fec_m, packets = entry
+        missing = []
+        for index in packet_indexes:
+            position = data_packet_position(index, fec_k, fec_m)
+            if position >= len(packets) or packets[position] is None:
+                missing.append(index)
+        return missing
+
+
+def channel_tier_ladder(channel):
+    return VIDEO_CHANNELS[channel][3]
+
+
+def resolve_video_channel(channel_value):
+    """Maps a channel name or index from a handshake to a channel index, or None if unknown."""
+    for index, channel in enumerate(VIDEO_CHANNELS):
+        if channel_value == channel[0] or channel_value == str(index):
+            return index
+    return None
+
+
+def resolve_video_tier(tier_value, tier_ladder=VIDEO_TIER_LADDER):
+    """Maps a tier name or index from a handshake to a ladder index, or None if unknown."""
+    for index, (name, _, _) in enumerate(tier_ladder):
+        if tier_value == name or tier_value == str(index):
+            return index
+    return None
+
+
+def parse_udp_control_message(message):
+    """Parses '<COMMAND> [key=value ...]' (VIDEO_HELLO, VIDEO_REPORT) into (command, options)."""
+    parts = message.split()
+    if not parts:
+        return None, {}
+    options = {}
+    for part in parts[1:]:
+        key, sep, value = part.partition('=')
+        if sep:
+            options[key] = value
+    return parts[0], options
+
+
+def multicast_group_address(channel, tier):
+    """(group, port) that carries a channel tier in multicast mode; every stream gets its own
+       group, so switches only deliver what was joined, and its own port, so hosts don't either."""
+    stream = channel * MULTICAST_MAX_TIERS + tier
+    group = ipaddress.IPv4Address(int(ipaddress.IPv4Address(MULTICAST_GROUP_BASE)) + 1 + stream)
+    return str(group), MULTICAST_PORT_BASE + stream
+
+
+def register_udp_viewer(addr, options):
+    """Adds or refreshes a viewer from its VIDEO_HELLO options."""
+    channel = 0
+    if "channel" in options:
+        channel = resolve_video_channel(options["channel"])
+        if channel is None:
+            print(f"UDP Handshake Listener: Unknown channel '{options['channel']}' from {addr}, ignoring hello.")
+            return
+    channel_name, tier_ladder = VIDEO_CHANNELS[channel][0], channel_tier_ladder(channel)
+
+    tier = 0
+    if "tier" in options:
+        tier = resolve_video_tier(options["tier"], tier_ladder)
+        if tier is None:
+            print(f"UDP Handshake Listener: Unknown tier '{options['tier']}' from {addr}, using '{tier_ladder[0][0]}'")
+            tier = 0
+
+    with udp_clients_lock:
+        viewer = active_udp_clients.get(addr)
+        if viewer is None or viewer.channel != channel:
+            viewer = active_udp_clients[addr] = UdpViewer(addr, tier, channel)
+            print(f"UDP Handshake Listener: New viewer {addr} on channel '{channel_name}' tier '{tier_ladder[tier][0]}'")
+        else:
+            # Periodic hellos keep the ABR-chosen tier unless the requested tier changed.
+            if viewer.requested_tier != tier:
+                print(f"UDP Handshake Listener: Viewer {addr} switched to tier '{tier_ladder[tier][0]}'")
+                viewer.requested_tier = tier
+                viewer.tier = tier
+                viewer.frame_divisor = 1
+                viewer.clean_reports = 0
+            viewer.last_contact = time.time()
+        multicast = MULTICAST_ENABLED and options.get("multicast") == "1" and not viewer.multicast_failed
+        if multicast != viewer.multicast:
+            viewer.multicast = multicast
+            viewer.frame_divisor = 1  # a group carries every frame of its tier
+            viewer.silent_reports = 0
+            print(f"UDP Handshake Listener: Viewer {addr} now receives by {'multicast' if multicast else 'unicast'}")
+
+
+def send_multicast_assignment(handshake_socket, addr, refresh=False):
+    """Tells a viewer that offered multicast which group to receive (VIDEO_MULTICAST group=<ip>
+       port=<n>), or VIDEO_MULTICAST off. Sent when that changes, and again on refresh (each
+       hello), in case the last one was lost."""
+    with udp_clients_lock:
+        viewer = active_udp_clients.get(addr)
+        if viewer is None or not (viewer.multicast or viewer.multicast_announced or viewer.multicast_failed):
+            return
+        group = multicast_group_address(viewer.channel, viewer.tier) if viewer.multicast else None
+        if group == viewer.multicast_announced and not refresh:
+            return
+        viewer.multicast_announced = group
+    message = f"VIDEO_MULTICAST group={group[0]} port={group[1]}" if group else "VIDEO_MULTICAST off"
+    try:
+        handshake_socket.sendto(message.encode('utf-8'), addr)
+    except socket.error as e:
+        print(f"UDP Handshake Listener: Error sending multicast assignment to {addr}: {e}")
+
+
+def parse_receiver_report(options):
+    """Converts VIDEO_REPORT options into numbers, or returns None if the report is malformed."""
+    try:
+        return {
+            "frames": int(options.get("frames", 0)),
+            "dropped": int(options.get("dropped", 0)),
+            "received": int(options.get("received", 0)),
+            "lost": int(options.get("lost", 0)),
+            "bytes": int(options.get("bytes", 0)),
+            "latency_ms": float(options.get("latency_ms", 0.0)),
+            "interval_ms": max(1.0, float(options.get("interval_ms", 1000.0))),
+        }
+    except ValueError:
+        return None
+
+
+def estimate_viewer_bitrate(channel, tier, frame_divisor):
+    """Expected bits/sec for a channel's tier at a frame divisor, from the encoder's recent frame sizes."""
+    pipeline = video_pipelines.get(channel)
+    if pipeline is None:
+        return 0.0
+    return pipeline.tier_frame_bytes_estimate[tier] * 8 * pipeline.fps / frame_divisor
+
+
+def _step_viewer_down(viewer):
+    if viewer.tier < len(channel_tier_ladder(viewer.channel)) - 1:
+        viewer.tier += 1
+        return True
+    if viewer.frame_divisor < ABR_MAX_FRAME_DIVISOR and not VIDEO_DELTA_MODE and not viewer.multicast:
+        viewer.frame_divisor *= 2
+        return True
+    return False
+
+
+def _next_step_up(viewer):
+    """Returns the (tier, frame_divisor) one step above the viewer's current setting, or None."""
+    if viewer.frame_divisor > 1:
+        return viewer.tier, viewer.frame_divisor // 2
+    if viewer.tier > viewer.requested_tier:
+        return viewer.tier - 1, 1
+    return None
+
+
+def _check_multicast_reception(viewer, report):
+    """Counts reports with nothing received although the viewer's group was sent to, and
+       moves the viewer to unicast after MULTICAST_FALLBACK_REPORTS of them. Returns False
+       for such a report: it says nothing about the viewer's bandwidth."""
+    if report["received"] or viewer.packets_sent == viewer.packets_sent_at_last_report:
+        viewer.silent_reports = 0
+        return True
+    viewer.packets_sent_at_last_report = viewer.packets_sent
+    viewer.silent_reports += 1
+    if viewer.silent_reports >= MULTICAST_FALLBACK_REPORTS:
+        viewer.multicast = False
+        viewer.multicast_failed = True
+        print(f"UDP Handshake Listener: Viewer {viewer.addr} receives no multicast, falling back to unicast")
+    return False
+
+
+def apply_receiver_report(addr, report):
+    """Updates a viewer's capacity estimate from a receiver report and moves it along the ladder."""
+    with udp_clients_lock:
+        viewer = active_udp_clients.get(addr)
+        if viewer is None:
+            return
+        viewer.last_contact = time.time()
+        viewer.last_report = report
+        if viewer.multicast and not _check_multicast_reception(viewer, report):
+            return
+        if not ABR_ENABLED:
+            return
+
+        received_bps = report["bytes"] * 8 * 1000.0 / report["interval_ms"]
+        packets = report["received"] + report["lost"]
+        loss_rate = report["lost"] / packets if packets else 0.0
+        # The client only sees gaps inside frames it partly received; compare with what
+        # we actually sent to also catch frames that vanished entirely.
+        packets_sent = viewer.packets_sent - viewer.packets_sent_at_last_report
+        viewer.packets_sent_at_last_report = viewer.packets_sent
+        if packets_sent > 0:
+            loss_rate = max(loss_rate, (packets_sent - report["received"]) / packets_sent)
+        frames = report["frames"] + report["dropped"]
+        drop_rate = report["dropped"] / frames if frames else 0.0
+        before = (viewer.tier, viewer.frame_divisor)
+
+        if loss_rate > ABR_LOSS_HIGH or drop_rate > ABR_LOSS_HIGH * 2:
+            # Under congestion the delivered rate is our best measure of capacity.
+            viewer.capacity_bps = received_bps
+            viewer.clean_reports = 0
+            _step_viewer_down(viewer)
+        else:
+            if viewer.capacity_bps:
+                viewer.capacity_bps = max(viewer.capacity_bps * ABR_CAPACITY_PROBE_GROWTH, received_bps)
+                # Content got heavier: stay under the measured capacity without waiting for loss.
+                while estimate_viewer_bitrate(viewer.channel, viewer.tier, viewer.frame_divisor) > viewer.capacity_bps:
+                    if not _step_viewer_down(viewer):
+                        break
+
+            if loss_rate < ABR_LOSS_LOW:
+                viewer.clean_reports += 1
+            if viewer.clean_reports >= ABR_UPGRADE_REPORTS:
+                viewer.clean_reports = 0
+                step_up = _next_step_up(viewer)
+                if step_up is not None:
+                    expected_bps = estimate_viewer_bitrate(viewer.channel, *step_up)
+                    if not viewer.capacity_bps or expected_bps <= viewer.capacity_bps * ABR_CAPACITY_HEADROOM:
+                        viewer.tier, viewer.frame_divisor = step_up
+
+        if (viewer.tier, viewer.frame_divisor) != before:
+            print(f"UDP ABR: Viewer {addr} -> tier '{channel_tier_ladder(viewer.channel)[viewer.tier][0]}' at 1/{viewer.frame_divisor} frames "
+                  f"(loss {loss_rate * 100:.1f}%, delivered {received_bps / 1e6:.2f} Mbps, "
+                  f"capacity {viewer.capacity_bps / 1e6:.2f} Mbps)")
+
+
+def handle_nack(handshake_socket, addr, entries):
+    """Resends the packets a viewer reported missing, from its channel pipeline's packet rings."""
+    if not RETRANSMIT_ENABLED:
+        return
+    with udp_clients_lock:
+        viewer = active_udp_clients.get(addr)
+    pipeline = video_pipelines.get(viewer.channel) if viewer is not None else None
+    if pipeline is None:
+        return
+
+    budget = RETRANSMIT_MAX_PACKETS_PER_NACK
+    resent = 0
+    for tier, frame_id, packet_indexes in parse_nack_entries(entries):
+        pipeline.nacked_packets_requested += len(packet_indexes)
+        if not 0 <= tier < len(pipeline.packet_rings) or budget <= 0:
+            continue
+        packet_indexes = packet_indexes[:budget]
+        packets = pipeline.packet_rings[tier].lookup(frame_id, packet_indexes, RETRANSMIT_MAX_AGE)
+        if packets is None or len(packets) < len(packet_indexes):
+            pipeline.request_retransmit(tier, frame_id, packet_indexes)
+        if packets is None:
+            pipeline.nacked_packets_expired += len(packet_indexes)
+            continue
+        for packet in packets:
+            try:
+                handshake_socket.sendto(packet, addr)
+                resent += 1
+            except socket.error as e:
+                print(f"UDP Handshake Listener: Error retransmitting to {addr}: {e}")
+                break
+        budget -= len(packets)
+
+    if resent:
+        pipeline.nacked_packets_resent += resent
+        record_packets_sent([addr], resent)
+
+
+def handle_keyframe_request(addr):
+    """Asks a viewer's channel pipeline for a keyframe on the tier the viewer is receiving."""
+    with udp_clients_lock:
+        viewer = active_udp_clients.get(addr)
+        if viewer is None:
+            return
+        channel, tier = viewer.channel, viewer.tier
+    pipeline = video_pipelines.get(channel)
+    if pipeline is not None:
+        pipeline.request_keyframe(tier)
+
+
 def udp_handshake_listener():
     """Listens for initial UDP 'hello' messages from clients to discover their addresses."""
     handshake_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
@@ -340,12 +1472,21 @@ def udp_handshake_listener():
 
     while not stop_server_event.is_set():
         try:
-            data, addr = handshake_socket.recvfrom(1024) 
+            data, addr = handshake_socket.recvfrom(4096) 
             message = data.decode('utf-8').strip()
-            if message == "VIDEO_HELLO":
-
-                with udp_clients_lock:
-                    active_udp_clients[addr] = time.time() 
+            command, options = parse_udp_control_message(message)
+            if command == "VIDEO_NACK":
+                handle_nack(handshake_socket, addr, message.split()[1:])
+            elif command == "VIDEO_HELLO":
+                register_udp_viewer(addr, options)
+                send_multicast_assignment(handshake_socket, addr, refresh=True)
+            elif command == "VIDEO_REPORT":
+                report = parse_receiver_report(options)
+                if report is not None:
+                    apply_receiver_report(addr, report)
+                    send_multicast_assignment(handshake_socket, addr)  # ABR may have moved it to another group
+            elif command == "VIDEO_KEYFRAME":
+                handle_keyframe_request(addr)
         except socket.timeout:
             pass 
         except Exception as e:
@@ -360,94 +1501,736 @@ def udp_handshake_listener():
     print("UDP Handshake Listener: Thread exited.")
 
 
-def video_stream_server_udp():
-    """Streams video frames over UDP to all known active clients."""
-    udp_sender_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-
-    print(f"UDP Video Server: Preparing to stream video...")
-
-    global video_capture_object, video_mode_active
-    
-    video_file_path = 'C:\\Users\\abdul\\Videos\\Captures\\sample_video.mp4' 
-
-    video_capture_object = cv2.VideoCapture(video_file_path)
+class LatestQueue:
+    """Bounded hand-off queue between pipeline stages; when full, the oldest item is dropped."""
+
+    def __init__(self, maxsize):
+        self._items = collections.deque()
+        self._maxsize = maxsize
+        self._condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._condition:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """Returns the oldest queued item, or None if nothing arrived within timeout."""
+        with self._condition:
+            if not self._items:
+                self._condition.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def __len__(self):
+        return len(self._items)
+
+
+class StageStats:
+    """Thread-safe timing counters for one pipeline stage."""
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total_time = 0.0
+        self._max_time = 0.0
+
+    def record(self, seconds):
+        with self._lock:
+            self._count += 1
+            self._total_time += seconds
+            if seconds > self._max_time:
+                self._max_time = seconds
+
+    def snapshot_and_reset(self):
+        """Returns (count, average_seconds, max_seconds) since the last call."""
+        with self._lock:
+            count, total, peak = self._count, self._total_time, self._max_time
+            self._count = 0
+            self._total_time = 0.0
+            self._max_time = 0.0
+        return count, (total / count if count else 0.0), peak
+
+
+def get_udp_viewers_by_tier(channel, frame_id):
+    """Drops viewers that have not said hello recently and groups the channel's viewers
+       that want this frame by tier: {tier: [addr, ...]}. Multicast viewers are not
+       listed; their tier's group address is, once."""
+    viewers_by_tier = {}
+    multicast_tiers = set()
+    with udp_clients_lock:
+        now = time.time()
+        clients_to_remove = [addr for addr, viewer in active_udp_clients.items() if now - viewer.last_contact > UDP_CLIENT_TIMEOUT]
+        for addr_to_remove in clients_to_remove:
+            del active_udp_clients[addr_to_remove]
+            print(f"UDP Video Server: Removed inactive client: {addr_to_remove}")
+        for addr, viewer in active_udp_clients.items():
+            if viewer.channel != channel:
+                continue
+            if viewer.multicast:
+                multicast_tiers.add(viewer.tier)
+            elif viewer.wants_frame(frame_id):
+                viewers_by_tier.setdefault(viewer.tier, []).append(addr)
+    for tier in multicast_tiers:
+        viewers_by_tier.setdefault(tier, []).append(multicast_group_address(channel, tier))
+    return viewers_by_tier
+
+
+def record_packets_sent(addrs, packet_count):
+    """Adds to the per-viewer sent-packet counters that receiver reports are compared against.
+       Packets sent to a multicast group count for every viewer receiving it."""
+    with udp_clients_lock:
+        for addr in addrs:
+            viewer = active_udp_clients.get(addr)
+            if viewer is not None:
+                viewer.packets_sent += packet_count
+            elif MULTICAST_ENABLED:
+                for member in active_udp_clients.values():
+                    if member.multicast and multicast_group_address(member.channel, member.tier) == addr:
+                        member.packets_sent += packet_count
+
+
+def get_subscribed_tiers(channel, frame_id):
+    """Returns the set of the channel's ladder tiers that have at least one viewer wanting this frame."""
+    with udp_clients_lock:
+        return {viewer.tier for viewer in active_udp_clients.values()
+                if viewer.channel == channel and viewer.wants_frame(frame_id)}
+
+
+class VideoPipeline:
+    """Capture -> encode -> send pipeline for one video source.
+
+    A capture thread reads frames at the target FPS, a pool of encoder threads
+    JPEG-encodes them (cv2 releases the GIL, so encoders run on separate cores)
+    and a single sender thread packetizes and fans frames out in frame order.
+    Stages are joined by small LatestQueues so a slow stage drops stale frames
+    instead of delaying the ones behind it.
+    """
+
+    def __init__(self, source_path, fps=FPS, tier_ladder=VIDEO_TIER_LADDER, encoder_threads=ENCODER_THREADS,
+                 channel=0, name="main", fanout_sender=None):
+        self.channel = channel
+        self.name = name
+        self.source_path = source_path
+        self.fps = fps
+        self.frame_delay = 1.0 / fps
+        self.tier_ladder = tier_ladder
+        self.encoder_threads = encoder_threads
+
+        self.capture_queue = LatestQueue(PIPELINE_QUEUE_SIZE)
+        self.send_queue = LatestQueue(PIPELINE_QUEUE_SIZE)
+        self.capture_stats = StageStats("capture")
+        self.encode_stats = StageStats("encode")
+        self.send_stats = StageStats("send")
+
+        # Channels share the caller's sender; a standalone pipeline owns its own.
+        self._owns_fanout_sender = fanout_sender is None
+        self.fanout_sender = fanout_sender if fanout_sender is not None else UdpFanoutSender()
+        datagram_size = VIDEO_DATAGRAM_SIZE if PACKETIZER_MODE == "mtu" else MAX_UDP_PACKET_SIZE
+        self.chunk_size = payload_size_for_datagram(datagram_size)
+        self.fec_mode = FEC_MODES.get(FEC_MODE)
+        if self.fec_mode is None:
+            print(f"UDP Video Server [{self.name}]: Unknown FEC_MODE '{FEC_MODE}', FEC disabled.")
+            self.fec_mode = FEC_MODES["off"]
+        self.fec_k, self.fec_m = fec_group_params(self.fec_mode, FEC_OVERHEAD, FEC_RS_GROUP_SIZE)
+        self.packet_rings = [PacketRing(RETRANSMIT_RING_FRAMES) for _ in tier_ladder]
+        self.capture = None
+        self.cache = None
+        self.frames_skipped_no_viewers = 0
+        self.frames_out_of_order = 0
+        # Packets viewers NACKed on this channel, resent from the packet rings, and
+        # asked for after they had left the rings.
+        self.nacked_packets_requested = 0
+        self.nacked_packets_resent = 0
+        self.nacked_packets_expired = 0
+        self.tier_frames_encoded = [0] * len(tier_ladder)
+        self.tier_bytes_encoded = [0] * len(tier_ladder)
+        # Smoothed encoded frame size per tier, used by ABR to predict bitrates.
+        # Tiers not encoded yet are extrapolated from the tier above by pixel count.
+        self.tier_frame_bytes_estimate = [0.0] * len(tier_ladder)
+        self._last_sent_frame_id = -1
+
+        # Delta mode state. The capture thread records, per tile, the last frame it changed
+        # in; encoders send the tiles newer than the last frame sent on each tier.
+        self._previous_frame = None
+        self._tile_versions = None
+        self._tile_diff = None
+        self._delta_lock = threading.Lock()
+        self.delta_last_sent = [-1] * len(tier_ladder)
+        self.delta_last_keyframe = [-1] * len(tier_ladder)
+        self.keyframe_requested = [False] * len(tier_ladder)
+        self._last_keyframe_request = [0.0] * len(tier_ladder)
+        self.delta_frames_sent = 0
+        self.delta_tiles_sent = 0
+        self.keyframes_sent = 0
+
+    def open_source(self):
+        self.capture = cv2.VideoCapture(self.source_path)
+        if not self.capture.isOpened():
+            print(f"Error: Could not open video file: {self.source_path}. Video streaming disabled.")
+            return False
+        print(f"UDP Video Server [{self.name}]: Streaming from video file: {self.source_path}")
+        return True
+
+    def run(self):
+        """Runs all stages until the server stops or the source fails."""
+        print(f"UDP Video Server [{self.name}]: Pipeline starting with {self.encoder_threads} encoder thread(s), "
+              f"fan-out mode: {self.fanout_sender.mode}, packetizer: {PACKETIZER_MODE} ({self.chunk_size}-byte chunks), "
+              f"FEC: {FEC_MODE} (k={self.fec_k}, m={self.fec_m}), delta mode: {VIDEO_DELTA_MODE}")
+        if VIDEO_CACHE_ENABLED and not VIDEO_DELTA_MODE:
+            self.cache = self.open_cache()
+        if self.cache is not None:
+            threads = [threading.Thread(target=self._replay_loop, name="video-replay", daemon=True)]
+        else:
+            threads = [threading.Thread(target=self._capture_loop, name="video-capture", daemon=True)]
+            threads += [threading.Thread(target=self._encode_loop, name=f"video-encode-{i}", daemon=True)
+                        for i in range(self.encoder_threads)]
+            threads.append(threading.Thread(target=self._send_loop, name="video-send", daemon=True))
+        for t in threads:
+            t.start()
+
+        next_stats_time = time.time() + PIPELINE_STATS_INTERVAL
+        while not stop_server_event.is_set() and threads[0].is_alive():
+            time.sleep(0.5)
+            if time.time() >= next_stats_time:
+                self.log_stats()
+                next_stats_time = time.time() + PIPELINE_STATS_INTERVAL
+
+        for t in threads:
+            t.join(timeout=1.0)
+
+    def log_stats(self):
+        parts = []
+        for stats in (self.capture_stats, self.encode_stats, self.send_stats):
+            count, avg, peak = stats.snapshot_and_reset()
+            parts.append(f"{stats.name} {count} fr avg {avg * 1000:.1f}ms max {peak * 1000:.1f}ms")
+        print(f"UDP Video Server [{self.name}]: Stages: {' | '.join(parts)} | "
+              f"queue drops capture={self.capture_queue.dropped} encode={self.send_queue.dropped} | "
+              f"skipped (no viewers)={self.frames_skipped_no_viewers} out-of-order={self.frames_out_of_order} | "
+              f"NACKed packets requested={self.nacked_packets_requested} resent={self.nacked_packets_resent} "
+              f"expired={self.nacked_packets_expired}")
+        self._log_tier_stats()
+        if VIDEO_DELTA_MODE:
+            print(f"UDP Video Server [{self.name}]: Delta: {self.delta_frames_sent} delta frames ({self.delta_tiles_sent} tiles), "
+                  f"{self.keyframes_sent} keyframes")
+            self.delta_frames_sent = self.delta_tiles_sent = self.keyframes_sent = 0
+
+    def _log_tier_stats(self):
+        tier_parts = []
+        for index, (name, _, _) in enumerate(self.tier_ladder):
+            frames, total_bytes = self.tier_frames_encoded[index], self.tier_bytes_encoded[index]
+            self.tier_frames_encoded[index] = 0
+            self.tier_bytes_encoded[index] = 0
+            if frames:
+                tier_parts.append(f"{name} {frames} fr avg {total_bytes // frames // 1024}KB")
+        if tier_parts:
+            print(f"UDP Video Server [{self.name}]: Tiers: {' | '.join(tier_parts)}")
+
+    def _cache_settings(self):
+        """Everything besides the source file that changes the cached packets."""
+        return {
+            "tier_ladder": [list(tier) for tier in self.tier_ladder],
+            "chunk_size": self.chunk_size,
+            "fec": [self.fec_mode, self.fec_k, self.fec_m],
+            "channel": self.channel,
+        }
+
+    def open_cache(self):
+        """Maps the packet cache for the source, building it first if needed. Returns None on failure."""
+        cache = EncodedFrameCache(VIDEO_CACHE_DIR, self.source_path, self._cache_settings(),
+                                  name=f"{self.name}.{os.path.basename(self.source_path)}")
+        try:
+            if cache.load():
+                print(f"UDP Video Server [{self.name}]: Replaying {cache.num_frames} cached frames from '{cache.data_path}'")
+            else:
+                print(f"UDP Video Server [{self.name}]: Building packet cache '{cache.data_path}'...")
+                start_time = time.time()
+                if not cache.build(self._read_source_frames(), len(self.tier_ladder), self._encode_for_cache):
+                    print(f"UDP Video Server [{self.name}]: Source has no frames, not caching.")
+                    return None
+                print(f"UDP Video Server [{self.name}]: Cached {cache.num_frames} frames in {time.time() - start_time:.1f}s")
+        except InterruptedError:
+            return None
+        except OSError as e:
+            print(f"UDP Video Server [{self.name}]: Packet cache unavailable, encoding live: {e}")
+            return None
+        for tier in range(len(self.tier_ladder)):
+            self.tier_frame_bytes_estimate[tier] = cache.mean_frame_bytes(tier)
+        return cache
+
+    def _read_source_frames(self):
+        self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+        while True:
+            if stop_server_event.is_set():
+                raise InterruptedError("Server stopping")
+            ret, frame = self.capture.read()
+            if not ret:
+                return
+            yield frame
+
+    def _encode_for_cache(self, frame):
+        encoded = []
+        for tier in range(len(self.tier_ladder)):
+            frame_data = self.encode_tier(frame, tier)
+            packets = []
+            if frame_data is not None:
+                try:
+                    packets = packetize_frame(0, frame_data, self.chunk_size, self.fec_mode, self.fec_k, self.fec_m,
+                                              tier, channel=self.channel)
+                except ValueError as e:
+                    print(f"UDP Video Server [{self.name}]: Not caching oversized frame: {e}")
+            encoded.append((len(frame_data) if frame_data is not None else 0, packets))
+        return encoded
+
+    def _replay_loop(self):
+        """Cache mode: sends pre-packetized frames at the target FPS, looping over the cache."""
+        frame_id = 0
+        while not stop_server_event.is_set():
+            start_time = time.time()
+            viewers_by_tier = get_udp_viewers_by_tier(self.channel, frame_id)
+            if viewers_by_tier:
+                frame_index = frame_id % self.cache.num_frames
+                capture_time = capture_timestamp(time.monotonic())
+                for tier, tier_viewers in viewers_by_tier.items():
+                    packets = self.cache.frame_packets(tier, frame_index, frame_id, capture_time)
+                    if packets:
+                        self.tier_frames_encoded[tier] += 1
+                        self.tier_bytes_encoded[tier] += int(self.cache.frames[tier, frame_index, 2])
+                        self._send_tier_packets(tier, frame_id, packets, tier_viewers)
+                self.send_stats.record(time.time() - start_time)
+            else:
+                self.frames_skipped_no_viewers += 1
+            frame_id += 1
 
-    if not video_capture_object.isOpened():
-        print(f"Error: Could not open video file: {video_file_path}. Video streaming disabled.")
-        video_mode_active = False
-    else:
-        video_mode_active = True
-        print(f"UDP Video Server: Streaming from video file: {video_file_path}")
+            elapsed_time = time.time() - start_time
+            if elapsed_time < self.frame_delay:
+                time.sleep(self.frame_delay - elapsed_time)
 
-    frame_id = 0
-    try:
-        while not stop_server_event.is_set() and video_mode_active:
+    def _capture_loop(self):
+        frame_id = 0
+        while not stop_server_event.is_set():
             start_time = time.time()
-            ret, frame = video_capture_object.read()
+            ret, frame = self.capture.read()
             if not ret:
-                print("UDP Video Server: End of video stream or failed to read frame. Looping video.")
-                video_capture_object.set(cv2.CAP_PROP_POS_FRAMES, 0) 
-                ret, frame = video_capture_object.read()
+                print(f"UDP Video Server [{self.name}]: End of video stream or failed to read frame. Looping video.")
+                self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0) 
+                ret, frame = self.capture.read()
                 if not ret: 
-                    print("UDP Video Server: Failed to read frame after seeking. Exiting video stream thread.")
+                    print(f"UDP Video Server [{self.name}]: Failed to read frame after seeking. Exiting video stream thread.")
                     break
+            capture_time = capture_timestamp(time.monotonic())
+            tile_versions = self._update_tile_versions(frame_id, frame) if VIDEO_DELTA_MODE else None
+            self.capture_stats.record(time.time() - start_time)
+
+            self.capture_queue.put((frame_id, capture_time, frame, tile_versions))
+            frame_id += 1
 
-            ret, encoded_image = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), 80])
+            elapsed_time = time.time() - start_time
+            if elapsed_time < self.frame_delay:
+                time.sleep(self.frame_delay - elapsed_time)
+
+    def _update_tile_versions(self, frame_id, frame):
+        """Marks the tiles that differ from the previous captured frame with frame_id.
+           Returns a snapshot of the (rows, cols) tile version array."""
+        tile = DELTA_TILE_SIZE
+        height, width = frame.shape[:2]
+        if self._previous_frame is None or self._previous_frame.shape != frame.shape:
+            rows, cols = (height + tile - 1) // tile, (width + tile - 1) // tile
+            self._tile_versions = np.full((rows, cols), frame_id, dtype=np.int64)
+            # Channels are folded into the row so a tile is a (tile, tile * 3) block.
+            self._tile_diff = np.zeros((rows * tile, cols * tile * 3), dtype=np.uint8)
+        else:
+            rows, cols = self._tile_versions.shape
+            self._tile_diff[:height, :width * 3] = cv2.absdiff(frame, self._previous_frame).reshape(height, width * 3)
+            changed = self._tile_diff.reshape(rows, tile, cols, tile * 3).max(axis=(1, 3)) > DELTA_TILE_THRESHOLD
+            self._tile_versions[changed] = frame_id
+        self._previous_frame = frame
+        return self._tile_versions.copy()
+
+    def request_keyframe(self, tier):
+        """Makes the next frame encoded for a tier a keyframe (rate limited)."""
+        now = time.time()
+        with self._delta_lock:
+            if now - self._last_keyframe_request[tier] >= DELTA_KEYFRAME_REQUEST_MIN_INTERVAL:
+                self._last_keyframe_request[tier] = now
+                self.keyframe_requested[tier] = True
+
+    def request_retransmit(self, tier, frame_id, packet_indexes):
+        """Called with NACKed packets the tier's ring could not supply. A source pipeline
+           rings every packet it sends, so those have expired and there is nothing to do."""
+
+    def scale_frame(self, frame, tier):
+        scale = self.tier_ladder[tier][1]
+        if scale == 1.0:
+            return frame
+        height, width = frame.shape[:2]
+        size = (max(1, int(width * scale)), max(1, int(height * scale)))
+        return cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+
+    def encode_tier_delta(self, frame, tier, frame_id, tile_versions):
+        """Encodes a frame for one tier in delta mode. Returns (data, flags); data is None
+           when nothing changed since the last frame sent on the tier."""
+        with self._delta_lock:
+            base_frame_id = self.delta_last_sent[tier]
+            keyframe = (base_frame_id < 0 or self.keyframe_requested[tier]
+                        or frame_id - self.delta_last_keyframe[tier] >= DELTA_KEYFRAME_INTERVAL)
+            if not keyframe:
+                changed_tiles = np.argwhere(tile_versions > base_frame_id)
+                keyframe = len(changed_tiles) > DELTA_MAX_TILE_FRACTION * tile_versions.size
+            if keyframe:
+                self.keyframe_requested[tier] = False
+                self.delta_last_keyframe[tier] = frame_id
+        if keyframe:
+            return self.encode_tier(frame, tier), 0
+        if not len(changed_tiles):
+            return None, 0
+
+        _, scale, quality = self.tier_ladder[tier]
+        scaled = self.scale_frame(frame, tier)
+        height, width = scaled.shape[:2]
+        tile = max(1, round(DELTA_TILE_SIZE * scale))
+        tiles = []
+        for row, col in changed_tiles:
+            y, x = int(row) * tile, int(col) * tile
+            if y >= height or x >= width:
+                continue
+            ret, encoded_tile = cv2.imencode('.jpg', scaled[y:y + tile, x:x + tile], [int(cv2.IMWRITE_JPEG_QUALITY), quality])
             if not ret:
-                print("UDP Video Server: Failed to encode frame to JPEG.")
+                print(f"UDP Video Server [{self.name}]: Failed to encode delta tile, sending a keyframe instead.")
+                return self.encode_tier(frame, tier), 0
+            tiles.append((x, y, encoded_tile.tobytes()))
+        return pack_delta_payload(base_frame_id, width, height, tiles), FLAG_DELTA
+
+    def encode_tier(self, frame, tier):
+        """Scales and JPEG-encodes a frame for one ladder tier. Returns bytes or None."""
+        quality = self.tier_ladder[tier][2]
+        frame = self.scale_frame(frame, tier)
+        ret, encoded_image = cv2.imencode('.jpg', frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        if not ret:
+            print(f"UDP Video Server [{self.name}]: Failed to encode frame to JPEG (tier '{self.tier_ladder[tier][0]}').")
+            return None
+        return encoded_image.tobytes()
+
+    def _update_tier_estimate(self, tier, frame_bytes):
+        estimates = self.tier_frame_bytes_estimate
+        if estimates[tier]:
+            estimates[tier] += 0.1 * (frame_bytes - estimates[tier])
+        else:
+            estimates[tier] = float(frame_bytes)
+        for other, (_, scale, _) in enumerate(self.tier_ladder):
+            if other != tier and not estimates[other]:
+                estimates[other] = frame_bytes * (scale / self.tier_ladder[tier][1]) ** 2
+
+    def _encode_loop(self):
+        while not stop_server_event.is_set():
+            item = self.capture_queue.get(timeout=0.5)
+            if item is None:
                 continue
+            frame_id, capture_time, frame, tile_versions = item
 
-            frame_data = encoded_image.tobytes()
-            data_size = len(frame_data)
+            # Tiers nobody is watching are not encoded at all.
+            subscribed_tiers = get_subscribed_tiers(self.channel, frame_id)
+            if not subscribed_tiers:
+                self.frames_skipped_no_viewers += 1
+                continue
 
-            num_packets = (data_size + MAX_UDP_PACKET_SIZE - 1) // MAX_UDP_PACKET_SIZE
+            start_time = time.time()
+            encoded_tiers = {}
+            for tier in sorted(subscribed_tiers):
+                if VIDEO_DELTA_MODE:
+                    frame_data, flags = self.encode_tier_delta(frame, tier, frame_id, tile_versions)
+                else:
+                    frame_data, flags = self.encode_tier(frame, tier), 0
+                if frame_data is not None:
+                    encoded_tiers[tier] = (frame_data, flags)
+                    self.tier_frames_encoded[tier] += 1
+                    self.tier_bytes_encoded[tier] += len(frame_data)
+                    self._update_tier_estimate(tier, len(frame_data))
+            self.encode_stats.record(time.time() - start_time)
+
+            if encoded_tiers:
+                self.send_queue.put((frame_id, capture_time, encoded_tiers))
+
+    def _send_loop(self):
+        while not stop_server_event.is_set():
+            item = self.send_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            frame_id, capture_time, encoded_tiers = item
 
-            current_udp_clients = []
-            with udp_clients_lock:
-                clients_to_remove = [addr for addr, last_contact in active_udp_clients.items() if time.time() - last_contact > 10]
-                for addr_to_remove in clients_to_remove:
-                    del active_udp_clients[addr_to_remove]
-                    print(f"UDP Video Server: Removed inactive client: {addr_to_remove}")
-                current_udp_clients = list(active_udp_clients.keys()) 
+            # Encoders finish out of order; never send a frame older than one already sent.
+            if frame_id <= self._last_sent_frame_id:
+                self.frames_out_of_order += 1
+                continue
+            self._last_sent_frame_id = frame_id
 
-            if not current_udp_clients:
-                time.sleep(0.1) 
-                continue 
+            viewers_by_tier = get_udp_viewers_by_tier(self.channel, frame_id)
+            if not viewers_by_tier:
+                continue
 
-            for i in range(num_packets):
-                header = frame_id.to_bytes(4, 'big') + i.to_bytes(2, 'big') + num_packets.to_bytes(2, 'big')
-                
-                packet_start = i * MAX_UDP_PACKET_SIZE
-                packet_end = min((i + 1) * MAX_UDP_PACKET_SIZE, data_size)
-                packet_data = frame_data[packet_start:packet_end]
-                
-                packet = header + packet_data
-                
-                for client_addr in current_udp_clients:
+            start_time = time.time()
+            for tier, (frame_data, flags) in encoded_tiers.items():
+                tier_viewers = viewers_by_tier.get(tier)
+                if tier_viewers:
                     try:
-                        udp_sender_socket.sendto(packet, client_addr)
-                    except socket.error as e:
-                        print(f"UDP Video Server: Error sending to {client_addr}: {e}")
-
-            frame_id += 1
+                        packets = packetize_frame(frame_id, frame_data, self.chunk_size, self.fec_mode, self.fec_k,
+                                                  self.fec_m, tier, flags, self.channel, capture_time)
+                    except ValueError as e:
+                        print(f"UDP Video Server [{self.name}]: Dropping frame {frame_id}: {e}")
+                        continue
+                    self._send_tier_packets(tier, frame_id, packets, tier_viewers)
+                    if VIDEO_DELTA_MODE:
+                        self._record_delta_sent(tier, frame_id, frame_data, flags)
+            self.send_stats.record(time.time() - start_time)
+
+    def _send_tier_packets(self, tier, frame_id, packets, tier_viewers):
+        if RETRANSMIT_ENABLED:
+            self.packet_rings[tier].store(frame_id & 0xFFFFFFFF, self.fec_k, self.fec_m, packets)
+        self.fanout_sender.send_packets(packets, tier_viewers)
+        record_packets_sent(tier_viewers, len(packets))
+
+    def _record_delta_sent(self, tier, frame_id, frame_data, flags):
+        with self._delta_lock:
+            self.delta_last_sent[tier] = frame_id
+        if flags & FLAG_DELTA:
+            self.delta_frames_sent += 1
+            self.delta_tiles_sent += DELTA_HEADER.unpack_from(frame_data)[3]
+        else:
+            self.keyframes_sent += 1
+
+    def close(self):
+        if self.capture is not None and self.capture.isOpened():
+            self.capture.release()
+        if self.cache is not None:
+            self.cache.close()
+        if self._owns_fanout_sender:
+            self.fanout_sender.close()
+
+
+class RelayPipeline(VideoPipeline):
+    """Re-serves one channel of the upstream server (RELAY_UPSTREAM_HOST) to local viewers.
+
+    Each tier with local viewers gets a UDP socket subscribed to the same channel
+    tier upstream with VIDEO_HELLO, exactly as a viewer would. Packets are forwarded
+    unchanged as they arrive, a burst at a time, without reassembling frames, and are
+    kept in the tier's packet ring so local NACKs are answered here; NACKs for
+    packets the relay never got, and keyframe requests, are passed upstream. The
+    relay sends no receiver reports, so the upstream keeps it on the tiers it asked
+    for and ABR runs between the relay and its own viewers.
+    """
+
+    def __init__(self, fps=FPS, tier_ladder=VIDEO_TIER_LADDER, channel=0, name="main", fanout_sender=None):
+        super().__init__(None, fps, tier_ladder, encoder_threads=0, channel=channel, name=name,
+                         fanout_sender=fanout_sender)
+        self.upstream_addr = (RELAY_UPSTREAM_HOST, RELAY_UPSTREAM_UDP_PORT)
+        self.tier_sockets = [None] * len(tier_ladder)
+        self.selector = None
+        self.forward_stats = StageStats("forward")
+        self._last_hello = [0.0] * len(tier_ladder)
+        self._last_frame_ids = [-1] * len(tier_ladder)
+        self.packets_relayed = 0
+        self.packets_invalid = 0
+        self.nacked_packets_forwarded = 0
+
+    def open_source(self):
+        self.selector = selectors.DefaultSelector()
+        print(f"UDP Video Server [{self.name}]: Relaying from upstream {self.upstream_addr[0]}:{self.upstream_addr[1]}")
+        return True
+
+    def run(self):
+        """Forwards upstream packets until the server stops, following local viewers' tiers."""
+        print(f"UDP Video Server [{self.name}]: Relay starting, fan-out mode: {self.fanout_sender.mode}")
+        next_subscription_time = 0.0
+        next_stats_time = time.time() + PIPELINE_STATS_INTERVAL
+        while not stop_server_event.is_set():
+            now = time.time()
+            if now >= next_subscription_time:
+                self._update_subscriptions(now)
+                next_subscription_time = now + 0.25
+            if now >= next_stats_time:
+                self.log_stats()
+                next_stats_time = now + PIPELINE_STATS_INTERVAL
+            if not self.selector.get_map():
+                stop_server_event.wait(0.25)  # select() without sockets is an error on Windows
+                continue
+            for key, _ in self.selector.select(timeout=0.25):
+                self._forward_burst(key.fileobj, key.data)
+
+    def _update_subscriptions(self, now):
+        """Subscribes upstream to the tiers local viewers are on and drops the rest.
+           Without hellos the upstream forgets a dropped tier after UDP_CLIENT_TIMEOUT."""
+        subscribed_tiers = get_subscribed_tiers(self.channel, 0)  # every viewer wants frame 0
+        for tier, sock in enumerate(self.tier_sockets):
+            if tier not in subscribed_tiers:
+                if sock is not None:
+                    self.tier_sockets[tier] = None
+                    self.selector.unregister(sock)
+                    sock.close()
+                    print(f"UDP Video Server [{self.name}]: No local viewers on tier '{self.tier_ladder[tier][0]}', unsubscribed.")
+                continue
+            if sock is None:
+                try:
+                    sock = self._open_tier_socket(tier)
+                except OSError as e:
+                    print(f"UDP Video Server [{self.name}]: Could not subscribe to tier '{self.tier_ladder[tier][0]}': {e}")
+                    continue
+                self._last_hello[tier] = 0.0
+                print(f"UDP Video Server [{self.name}]: Subscribed to tier '{self.tier_ladder[tier][0]}' upstream.")
+            if now - self._last_hello[tier] >= RELAY_HELLO_INTERVAL:
+                self._last_hello[tier] = now
+                self._send_upstream(tier, f"VIDEO_HELLO channel={self.name} tier={self.tier_ladder[tier][0]}".encode('utf-8'))
+
+    def _open_tier_socket(self, tier):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RELAY_RECEIVE_BUFFER_BYTES)
+        except OSError:
+            pass
+        # Not connected: video comes from the upstream's fan-out socket, not its handshake port.
+        sock.setblocking(False)
+        self.selector.register(sock, selectors.EVENT_READ, tier)
+        self.tier_sockets[tier] = sock
+        return sock
+
+    def _send_upstream(self, tier, message):
+        sock = self.tier_sockets[tier]
+        if sock is None:
+            return
+        try:
+            sock.sendto(message, self.upstream_addr)
+        except OSError as e:
+            print(f"UDP Video Server [{self.name}]: Error sending to upstream: {e}")
+
+    def _forward_burst(self, sock, tier):
+        """Reads what has arrived on a tier's socket (up to RELAY_BURST_PACKETS) and forwards it,
+           one fan-out call per run of packets from the same frame."""
+        start_time = time.time()
+        runs = []  # [(frame_id, [packet, ...])] in arrival order
+        for _ in range(RELAY_BURST_PACKETS):
+            try:
+                packet = sock.recv(MAX_UDP_PACKET_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                break  # e.g. Windows reports ICMP port unreachable as a receive error
+            header = parse_packet_header(packet)
+            if header is None or header.tier != tier:
+                self.packets_invalid += 1
+                continue
+            frame_id = header.frame_id
+            if frame_id > self._last_frame_ids[tier] or self._last_frame_ids[tier] - frame_id > RETRANSMIT_RING_FRAMES:
+                # First packet of a new frame (or the upstream restarted its frame ids).
+                self._last_frame_ids[tier] = frame_id
+                self.tier_frames_encoded[tier] += 1
+                self.tier_bytes_encoded[tier] += header.frame_size
+                self._update_tier_estimate(tier, header.frame_size)
+            if RETRANSMIT_ENABLED and not header.flags & FLAG_PARITY:
+                self.packet_rings[tier].add_packet(frame_id, header.fec_k, header.fec_m, header.packet_index,
+                                                   header.num_packets, packet)
+            if runs and runs[-1][0] == frame_id:
+                runs[-1][1].append(packet)
+            else:
+                runs.append((frame_id, [packet]))
+        if not runs:
+            return
+
+        for frame_id, packets in runs:
+            tier_viewers = get_udp_viewers_by_tier(self.channel, frame_id).get(tier)
+            if tier_viewers:
+                self.fanout_sender.send_packets(packets, tier_viewers)
+                record_packets_sent(tier_viewers, len(packets))
+            self.packets_relayed += len(packets)
+        self.forward_stats.record(time.time() - start_time)
+
+    def request_keyframe(self, tier):
+        """Passes a viewer's keyframe request upstream, rate limited like a source pipeline's."""
+        now = time.time()
+        with self._delta_lock:
+            if now - self._last_keyframe_request[tier] < DELTA_KEYFRAME_REQUEST_MIN_INTERVAL:
+                return
+            self._last_keyframe_request[tier] = now
+        self._send_upstream(tier, b"VIDEO_KEYFRAME")
+
+    def request_retransmit(self, tier, frame_id, packet_indexes):
+        """NACKs the packets the relay never received to the upstream; what it resends is
+           forwarded to the tier's viewers like any other packet."""
+        missing = self.packet_rings[tier].missing(frame_id, packet_indexes)
+        if missing:
+            for message in format_nack_messages([(tier, frame_id, sorted(missing))]):
+                self._send_upstream(tier, message.encode('utf-8'))
+            self.nacked_packets_forwarded += len(missing)
+
+    def log_stats(self):
+        count, avg, peak = self.forward_stats.snapshot_and_reset()
+        subscribed = [self.tier_ladder[tier][0] for tier, sock in enumerate(self.tier_sockets) if sock is not None]
+        print(f"UDP Video Server [{self.name}]: Relay: {self.packets_relayed} packets in {count} bursts, "
+              f"forward avg {avg * 1000:.2f}ms max {peak * 1000:.2f}ms | subscribed: {', '.join(subscribed) or 'none'} | "
+              f"invalid={self.packets_invalid} | NACKed packets resent={self.nacked_packets_resent} "
+              f"passed upstream={self.nacked_packets_forwarded}")
+        self.packets_relayed = 0
+        self._log_tier_stats()
+
+    def close(self):
+        for tier, sock in enumerate(self.tier_sockets):
+            if sock is not None:
+                self.tier_sockets[tier] = None
+                sock.close()
+        if self.selector is not None:
+            self.selector.close()
+        super().close()
+
+
+def run_video_channel(pipeline):
+    """Streams one channel until the server stops or its source fails."""
+    try:
+        if pipeline.open_source():
+            pipeline.run()
+        else:
+            print(f"UDP Video Server [{pipeline.name}]: Video streaming is not active (e.g., file not found).")
+    except Exception as e:
+        print(f"UDP Video Server [{pipeline.name}]: Streaming error: {e}")
+    finally:
+        pipeline.close()
+        print(f"UDP Video Server [{pipeline.name}]: Channel thread exited.")
 
-            elapsed_time = time.time() - start_time
-            if elapsed_time < FRAME_DELAY:
-                time.sleep(FRAME_DELAY - elapsed_time)
-        
-        if not video_mode_active:
-            print("UDP Video Server: Video streaming is not active (e.g., file not found).")
 
-    except Exception as e:
-        print(f"UDP Video Server: Streaming error: {e}")
+def video_stream_server_udp():
+    """Streams every configured channel over UDP to its viewers, one pipeline per channel."""
+    global video_mode_active
+
+    print(f"UDP Video Server: Preparing to stream {len(VIDEO_CHANNELS)} channel(s)...")
+    fanout_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    if MULTICAST_ENABLED:
+        fanout_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, MULTICAST_TTL)
+        print(f"UDP Video Server: Multicast enabled, groups from {MULTICAST_GROUP_BASE} ports from {MULTICAST_PORT_BASE} "
+              f"(TTL {MULTICAST_TTL})")
+    fanout_sender = UdpFanoutSender(fanout_socket)
+    threads = []
+    for channel, (name, source_path, fps, tier_ladder) in enumerate(VIDEO_CHANNELS):
+        if RELAY_UPSTREAM_HOST:
+            pipeline = RelayPipeline(fps, tier_ladder, channel=channel, name=name, fanout_sender=fanout_sender)
+        else:
+            pipeline = VideoPipeline(source_path, fps, tier_ladder, channel=channel, name=name, fanout_sender=fanout_sender)
+        video_pipelines[channel] = pipeline
+        thread = threading.Thread(target=run_video_channel, args=(pipeline,), name=f"video-channel-{name}", daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    video_mode_active = True
+    try:
+        while not stop_server_event.is_set() and any(t.is_alive() for t in threads):
+            time.sleep(0.5)
+        for t in threads:
+            t.join(timeout=2.0)
     finally:
-        if video_capture_object and video_capture_object.isOpened():
-            video_capture_object.release()
-        if udp_sender_socket:
-            try:
-                udp_sender_socket.close()
-            except OSError as e:
-                print(f"UDP Video Server: Error closing sender socket: {e}")
+        video_mode_active = False
+        fanout_sender.close()
         print("UDP Video Server: Stream thread exited.")
 
 
@@ -456,12 +2239,32 @@ def video_stream_server_udp():
 
 
 def main_server():
+    global chat_bus_hub, chat_upstream
     print("Starting Combined Server...")
-    
-    load_announcements_from_file()
-
-    tcp_thread = threading.Thread(target=tcp_announcement_listener, daemon=True)
-    tcp_thread.start()
+    chat_workers = start_chat_workers() if CHAT_WORKERS and not RELAY_UPSTREAM_HOST else []
+
+    if RELAY_UPSTREAM_HOST:
+        # Announcements and chat history are mirrored from the upstream, not stored here.
+        print(f"Relay mode: upstream {RELAY_UPSTREAM_HOST} (chat port {RELAY_UPSTREAM_TCP_PORT}, "
+              f"video port {RELAY_UPSTREAM_UDP_PORT})")
+        if CHAT_WORKERS:
+            print("Relay mode: chat workers are not supported, serving chat from this process.")
+        chat_upstream = UpstreamChatClient(RELAY_UPSTREAM_HOST, RELAY_UPSTREAM_TCP_PORT, handle_upstream_chat_message,
+                                           reset_upstream_history_requests, stop_server_event,
+                                           binary_framing=CHAT_BINARY_FRAMING).start()
+    else:
+        load_announcements_from_file()
+        open_chat_log()
+
+    print(f"Chat backend: {CHAT_BACKEND}")
+    tcp_thread = None
+    if chat_workers:
+        chat_bus_hub = ChatBusHub(CHAT_BUS_PATH, handle_chat_bus_message, sync_chat_worker, stop_server_event).start()
+        print(f"Chat: {len(chat_workers)} worker processes on port {TCP_PORT}, hub at '{CHAT_BUS_PATH}'")
+    else:
+        chat_listener = tcp_announcement_listener_async if CHAT_BACKEND == "asyncio" else tcp_announcement_listener
+        tcp_thread = threading.Thread(target=chat_listener, daemon=True)
+        tcp_thread.start()
 
     udp_handshake_thread = threading.Thread(target=udp_handshake_listener, daemon=True)
     udp_handshake_thread.start()
@@ -471,22 +2274,44 @@ def main_server():
 
     print("Combined Server is running. Press Ctrl+C to stop.")
 
+    next_chat_stats_time = time.time() + CHAT_STATS_INTERVAL
     try:
         while not stop_server_event.is_set():
             time.sleep(0.5) 
+            if time.time() >= next_chat_stats_time:
+                log_chat_outbound_stats()
+                next_chat_stats_time = time.time() + CHAT_STATS_INTERVAL
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt received. Initiating server shutdown.")
     finally:
         stop_server_event.set() 
+        for process in chat_workers:
+            process.terminate()
+            process.join(timeout=2.0)
+        if chat_upstream is not None:
+            chat_upstream.close()
         
         print("Saving announcements before shutdown...")
         save_announcements_to_file()
         
         print("Waiting for server threads to finish...")
-        tcp_thread.join(timeout=2.0)
+        if tcp_thread is not None:
+            tcp_thread.join(timeout=2.0)
         udp_handshake_thread.join(timeout=2.0)
         udp_stream_thread.join(timeout=2.0)
+        close_chat_log()
         print("All server threads stopped. Server exited.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Combined chat/announcement and UDP video server.")
+    parser.add_argument("--chat-backend", choices=["threads", "asyncio"], default=CHAT_BACKEND,
+                        help="thread per chat connection, or one asyncio event loop for all of them")
+    parser.add_argument("--chat-workers", type=int, default=CHAT_WORKERS,
+                        help="serve chat from this many processes sharing the port (0 = this process)")
+    parser.add_argument("--relay-from", metavar="HOST", default=RELAY_UPSTREAM_HOST,
+                        help="relay the video and chat of the server at HOST instead of streaming local sources")
+    args = parser.parse_args()
+    CHAT_BACKEND = args.chat_backend
+    CHAT_WORKERS = args.chat_workers
+    RELAY_UPSTREAM_HOST = args.relay_from
     main_server()
\ No newline at end of file
@@ -0,0 +1,238 @@
+import socket
+import ctypes
+import ctypes.util
+import threading
+import errno
+import os
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+
+# Linux caps a single sendmmsg() call at UIO_MAXIOV messages.
+SENDMMSG_MAX_BATCH = 1024
+
+# Fallback (no sendmmsg): viewer lists smaller than this are sent inline,
+# larger ones are split into shards sent from a small thread pool.
+FANOUT_SHARD_MIN_VIEWERS = 32
+FANOUT_WORKERS = max(2, min(8, (os.cpu_count() or 2)))
+
+# Prepared sendmmsg tables kept around, one per distinct viewer set
+# (e.g. one per simulcast tier).
+FANOUT_TABLE_CACHE_SIZE = 16
+
+
+class _Iovec(ctypes.Structure):
+    _fields_ = [
+        ("iov_base", ctypes.c_char_p),
+        ("iov_len", ctypes.c_size_t),
+    ]
+
+
+class _Msghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_name", ctypes.c_void_p),
+        ("msg_namelen", ctypes.c_uint32),
+        ("msg_iov", ctypes.POINTER(_Iovec)),
+        ("msg_iovlen", ctypes.c_size_t),
+        ("msg_control", ctypes.c_void_p),
+        ("msg_controllen", ctypes.c_size_t),
+        ("msg_flags", ctypes.c_int),
+    ]
+
+
+class _Mmsghdr(ctypes.Structure):
+    _fields_ = [
+        ("msg_hdr", _Msghdr),
+        ("msg_len", ctypes.c_uint),
+    ]
+
+
+class _SockaddrIn(ctypes.Structure):
+    _fields_ = [
+        ("sin_family", ctypes.c_ushort),
+        ("sin_port", ctypes.c_ubyte * 2),
+        ("sin_addr", ctypes.c_ubyte * 4),
+        ("sin_zero", ctypes.c_ubyte * 8),
+    ]
+
+
+def _load_sendmmsg():
+    """Returns libc's sendmmsg() as a ctypes function, or None where it is unavailable."""
+    if not hasattr(socket, "AF_INET") or os.name != "posix":
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        sendmmsg = libc.sendmmsg
+    except (OSError, AttributeError):
+        return None
+    sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+    sendmmsg.restype = ctypes.c_int
+    return sendmmsg
+
+
+def _make_sockaddr(addr):
+    """Builds a sockaddr_in for an (ip, port) tuple."""
+    sockaddr = _SockaddrIn()
+    sockaddr.sin_family = socket.AF_INET
+    sockaddr.sin_port[:] = addr[1].to_bytes(2, 'big')
+    sockaddr.sin_addr[:] = socket.inet_aton(socket.gethostbyname(addr[0]))
+    return sockaddr
+
+
+class _MessageTable:
+    """Prepared (packet slot x viewer) mmsghdr table for one viewer set."""
+
+    def __init__(self, viewers):
+        num_viewers = len(viewers)
+        self.viewers = viewers
+        self.packets_per_call = max(1, SENDMMSG_MAX_BATCH // num_viewers)
+
+        self.sockaddrs = (_SockaddrIn * num_viewers)(*[_make_sockaddr(addr) for addr in viewers])
+        self.iovecs = (_Iovec * self.packets_per_call)()
+        self.messages = (_Mmsghdr * (self.packets_per_call * num_viewers))()
+
+        sockaddr_size = ctypes.sizeof(_SockaddrIn)
+        sockaddr_base = ctypes.addressof(self.sockaddrs)
+        for slot in range(self.packets_per_call):
+            iovec_ptr = ctypes.pointer(self.iovecs[slot])
+            for v in range(num_viewers):
+                hdr = self.messages[slot * num_viewers + v].msg_hdr
+                hdr.msg_name = sockaddr_base + v * sockaddr_size
+                hdr.msg_namelen = sockaddr_size
+                hdr.msg_iov = iovec_ptr
+                hdr.msg_iovlen = 1
+
+
+class UdpFanoutSender:
+    """Sends the same list of UDP packets to many viewers with as few syscalls as possible.
+
+    On Linux every sendmmsg() call carries up to SENDMMSG_MAX_BATCH (packet, viewer)
+    datagrams. The message table is built once per viewer set and only the iovec
+    entries are refreshed per frame, so Python work is O(packets), not O(packets x viewers).
+    Elsewhere viewers are sharded across a thread pool issuing plain sendto() calls.
+    """
+
+    def __init__(self, sock=None, use_sendmmsg=True, workers=FANOUT_WORKERS):
+        self.sock = sock if sock is not None else socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sendmmsg = _load_sendmmsg() if use_sendmmsg else None
+        self._workers = workers
+        self._pool = None
+        self._lock = threading.Lock()
+
+        self._tables = collections.OrderedDict()
+
+        self.datagrams_sent = 0
+        self.send_errors = 0
+        self.syscalls = 0
+
+    @property
+    def mode(self):
+        return "sendmmsg" if self._sendmmsg is not None else "sharded-sendto"
+
+    def send_packets(self, packets, viewers):
+        """Sends every packet to every viewer address. Returns the number of datagrams sent."""
+        if not packets or not viewers:
+            return 0
+        with self._lock:
+            if self._sendmmsg is not None:
+                return self._send_with_sendmmsg(packets, viewers)
+            return self._send_sharded(packets, viewers)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+        try:
+            self.sock.close()
+        except OSError as e:
+            print(f"UDP Fanout: Error closing sender socket: {e}")
+
+    # sendmmsg path
+
+    def _get_message_table(self, viewers):
+        """Returns the prepared table for a viewer set, building it on first use."""
+        viewers = tuple(viewers)
+        table = self._tables.get(viewers)
+        if table is None:
+            table = _MessageTable(viewers)
+            self._tables[viewers] = table
+            if len(self._tables) > FANOUT_TABLE_CACHE_SIZE:
+                self._tables.popitem(last=False)
+        else:
+            self._tables.move_to_end(viewers)
+        return table
+
+    def _send_with_sendmmsg(self, packets, viewers):
+        table = self._get_message_table(viewers)
+        num_viewers = len(table.viewers)
+        iovecs = table.iovecs
+        fd = self.sock.fileno()
+        message_size = ctypes.sizeof(_Mmsghdr)
+        messages_base = ctypes.addressof(table.messages)
+        total_sent = 0
+
+        for start in range(0, len(packets), table.packets_per_call):
+            chunk = packets[start:start + table.packets_per_call]
+            for slot, packet in enumerate(chunk):
+                iovecs[slot].iov_base = packet
+                iovecs[slot].iov_len = len(packet)
+
+            pending = len(chunk) * num_viewers
+            offset = 0
+            while offset < pending:
+                count = min(SENDMMSG_MAX_BATCH, pending - offset)
+                sent = self._sendmmsg(fd, messages_base + offset * message_size, count, 0)
+                self.syscalls += 1
+                if sent < 0:
+                    err = ctypes.get_errno()
+                    if err == errno.EINTR:
+                        continue
+                    # Skip the datagram the kernel refused and carry on with the rest.
+                    self.send_errors += 1
+                    if self.send_errors <= 10 or self.send_errors % 1000 == 0:
+                        bad_addr = table.viewers[offset % num_viewers]
+                        print(f"UDP Fanout: Error sending to {bad_addr}: {os.strerror(err)}")
+                    offset += 1
+                    continue
+                offset += sent
+                total_sent += sent
+
+        self.datagrams_sent += total_sent
+        return total_sent
+
+    # sendto fallback path
+
+    def _send_shard(self, packets, shard):
+        sent = 0
+        errors = 0
+        sendto = self.sock.sendto
+        for packet in packets:
+            for addr in shard:
+                try:
+                    sendto(packet, addr)
+                    sent += 1
+                except socket.error as e:
+                    errors += 1
+                    if errors <= 3:
+                        print(f"UDP Fanout: Error sending to {addr}: {e}")
+        return sent, errors
+
+    def _send_sharded(self, packets, viewers):
+        viewers = list(viewers)
+        if len(viewers) < FANOUT_SHARD_MIN_VIEWERS or self._workers <= 1:
+            results = [self._send_shard(packets, viewers)]
+        else:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="udp-fanout")
+            shard_size = (len(viewers) + self._workers - 1) // self._workers
+            futures = [
+                self._pool.submit(self._send_shard, packets, viewers[i:i + shard_size])
+                for i in range(0, len(viewers), shard_size)
+            ]
+            results = [future.result() for future in futures]
+
+        total_sent = sum(sent for sent, _ in results)
+        self.send_errors += sum(errors for _, errors in results)
+        self.syscalls += len(packets) * len(viewers)
+        self.datagrams_sent += total_sent
+        return total_sent
@@ -0,0 +1,162 @@
+import hashlib
+import json
+import mmap
+import os
+
+import numpy as np
+
+from video_protocol import VIDEO_HEADER_CAPTURE_TIME_OFFSET, VIDEO_HEADER_FRAME_ID_OFFSET, VIDEO_PACKET_VERSION
+
+
+# On-disk cache of a looping file source, encoded and packetized once.
+#
+# <cache_dir>/<name>.<key hash>.packets  every packet of every frame and tier, back to back
+# <cache_dir>/<name>.<key hash>.index.npz
+#   frames          (tiers, frames, 3) int64: first packet, packet count, encoded (JPEG) frame bytes
+#   packet_offsets  (packets + 1,) int64 byte offsets into the .packets file
+#   key             JSON of the source file identity and encode settings
+#
+# Packets are stored with frame_id and capture_time 0 and restamped when replayed, so playback costs
+# one mmap slice per packet and no decode, encode or FEC work. The key hash covers
+# the source's path, size and mtime plus every setting that changes the packets, so
+# editing the file or the settings selects (and builds) a new cache.
+VIDEO_CACHE_SUFFIX = ".packets"
+VIDEO_CACHE_INDEX_SUFFIX = ".index.npz"
+
+
+def cache_key(source_path, settings):
+    """Returns the dict identifying a cache built from source_path with the given encode settings."""
+    stat = os.stat(source_path)
+    return {
+        "source": os.path.abspath(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+        "packet_version": VIDEO_PACKET_VERSION,
+        "settings": settings,
+    }
+
+
+class EncodedFrameCache:
+    """Memory-mapped pre-packetized frames for one source and one set of encode settings."""
+
+    def __init__(self, cache_dir, source_path, settings, name=None):
+        self.key = cache_key(source_path, settings)
+        key_json = json.dumps(self.key, sort_keys=True)
+        digest = hashlib.sha1(key_json.encode('utf-8')).hexdigest()[:16]
+        self._name = name or os.path.basename(source_path)
+        base = os.path.join(cache_dir, f"{self._name}.{digest}")
+        self.cache_dir = cache_dir
+        self.data_path = base + VIDEO_CACHE_SUFFIX
+        self.index_path = base + VIDEO_CACHE_INDEX_SUFFIX
+        self._key_json = key_json
+
+        self.frames = None
+        self.packet_offsets = None
+        self.num_frames = 0
+        self._file = None
+        self._mmap = None
+
+    def load(self):
+        """Maps an existing cache. Returns False if there is none or it does not match the key."""
+        if not (os.path.exists(self.data_path) and os.path.exists(self.index_path)):
+            return False
+        try:
+            with np.load(self.index_path) as index:
+                if str(index["key"]) != self._key_json:
+                    return False
+                frames = index["frames"]
+                packet_offsets = index["packet_offsets"]
+            data_file = open(self.data_path, 'rb')
+        except (OSError, KeyError, ValueError) as e:
+            print(f"Video Cache: Ignoring unreadable cache '{self.index_path}': {e}")
+            return False
+
+        if os.fstat(data_file.fileno()).st_size != int(packet_offsets[-1]) or not frames.shape[1]:
+            data_file.close()
+            print(f"Video Cache: Ignoring truncated cache '{self.data_path}'.")
+            return False
+        self._file = data_file
+        self._mmap = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.frames = frames
+        self.packet_offsets = packet_offsets
+        self.num_frames = frames.shape[1]
+        return True
+
+    def build(self, frames, num_tiers, encode_frame):
+        """Encodes every frame of a source once and writes the cache, then maps it.
+
+        frames:       iterable of decoded frames, in order; raising from it abandons the build
+        encode_frame: callable(frame) -> [(encoded size, packets), ...] per tier, packets for frame_id 0
+        Returns False if the source yielded no frames.
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        tmp_data_path = self.data_path + ".tmp"
+        frame_table = [[] for _ in range(num_tiers)]
+        packet_offsets = [0]
+        offset = 0
+
+        try:
+            with open(tmp_data_path, 'wb') as data_file:
+                for frame in frames:
+                    for tier, (encoded_size, packets) in enumerate(encode_frame(frame)):
+                        frame_table[tier].append((len(packet_offsets) - 1, len(packets), encoded_size))
+                        for packet in packets:
+                            data_file.write(packet)
+                            offset += len(packet)
+                            packet_offsets.append(offset)
+        except BaseException:
+            os.remove(tmp_data_path)
+            raise
+
+        if not frame_table[0]:
+            os.remove(tmp_data_path)
+            return False
+
+        tmp_index_path = self.index_path[:-len(".npz")] + ".tmp.npz"
+        np.savez(tmp_index_path,
+                 frames=np.array(frame_table, dtype=np.int64),
+                 packet_offsets=np.array(packet_offsets, dtype=np.int64),
+                 key=np.array(self._key_json))
+        os.replace(tmp_data_path, self.data_path)
+        os.replace(tmp_index_path, self.index_path)
+        self._remove_stale_caches()
+        return self.load()
+
+    def _remove_stale_caches(self):
+        """Deletes caches with the same name built from an older file or other settings."""
+        current = {os.path.basename(self.data_path), os.path.basename(self.index_path)}
+        prefix = self._name + "."
+        for name in os.listdir(self.cache_dir):
+            digest, _, suffix = name[len(prefix):].partition(".")
+            if (name.startswith(prefix) and name not in current and len(digest) == 16
+                    and "." + suffix in (VIDEO_CACHE_SUFFIX, VIDEO_CACHE_INDEX_SUFFIX)):
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                except OSError as e:
+                    print(f"Video Cache: Could not remove stale cache '{name}': {e}")
+
+    def frame_packets(self, tier, frame_index, frame_id, capture_time=0):
+        """Returns the cached packets of one frame, restamped with frame_id and capture_time."""
+        first, count, _ = self.frames[tier, frame_index]
+        offsets = self.packet_offsets[first:first + count + 1].tolist()
+        frame_id_bytes = (frame_id & 0xFFFFFFFF).to_bytes(4, 'big')
+        capture_time_bytes = capture_time.to_bytes(4, 'big')
+        mm = self._mmap
+        packets = []
+        for start, end in zip(offsets, offsets[1:]):
+            stamp = start + VIDEO_HEADER_FRAME_ID_OFFSET
+            capture_stamp = start + VIDEO_HEADER_CAPTURE_TIME_OFFSET
+            packets.append(mm[start:stamp] + frame_id_bytes + mm[stamp + 4:capture_stamp] + capture_time_bytes
+                           + mm[capture_stamp + 4:end])
+        return packets
+
+    def mean_frame_bytes(self, tier):
+        return float(self.frames[tier, :, 2].mean())
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
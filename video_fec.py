@@ -0,0 +1,147 @@
+import numpy as np
+
+
+# Forward error correction for UDP video frames.
+#
+# A frame's n data packets are split into groups of k packets and each group
+# gets m parity packets, so a client can rebuild up to m missing packets per
+# group without a retransmission:
+#   FEC_XOR - one XOR parity packet per group (m = 1)
+#   FEC_RS  - systematic Reed-Solomon-style code over GF(256) using a Cauchy
+#             matrix; any k of the k + m packets in a group rebuild the rest.
+# The last group may be short; its missing rows are treated as known zeros.
+FEC_NONE = 0
+FEC_XOR = 1
+FEC_RS = 2
+FEC_MODES = {"off": FEC_NONE, "xor": FEC_XOR, "rs": FEC_RS}
+
+
+def _build_gf_tables():
+    exp = np.zeros(512, dtype=np.int32)
+    log = np.zeros(256, dtype=np.int32)
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        x <<= 1
+        if x & 0x100:
+            x ^= 0x11d
+    exp[255:510] = exp[:255]
+
+    # Full 256 x 256 product table so a whole packet is multiplied by one
+    # coefficient with a single fancy-indexing lookup.
+    a = np.arange(256)
+    mul = exp[(log[a][:, None] + log[a][None, :]) % 255].astype(np.uint8)
+    mul[0, :] = 0
+    mul[:, 0] = 0
+    return exp, log, mul
+
+
+GF_EXP, GF_LOG, GF_MUL = _build_gf_tables()
+
+
+def gf_inv(a):
+    return int(GF_EXP[255 - GF_LOG[a]])
+
+
+def cauchy_coefficient(parity_row, data_row, k):
+    """Coefficient of data row i in parity row j: 1 / (x_j + y_i) with x_j = k + j, y_i = i."""
+    return gf_inv((k + parity_row) ^ data_row)
+
+
+def fec_group_params(fec_mode, overhead, rs_group_size):
+    """Returns (k, m) for a mode and target parity overhead ratio (e.g. 0.2 for 20%)."""
+    if fec_mode == FEC_XOR:
+        return max(1, min(255, round(1.0 / max(overhead, 1e-3)))), 1
+    if fec_mode == FEC_RS:
+        k = max(1, min(rs_group_size, 200))
+        m = max(1, min(255 - k, int(np.ceil(k * overhead))))
+        return k, m
+    return 0, 0
+
+
+def _grouped_rows(frame_data, chunk_size, k):
+    """Returns the frame as a zero-padded (groups, k, chunk_size) uint8 array."""
+    num_packets = max(1, (len(frame_data) + chunk_size - 1) // chunk_size)
+    groups = (num_packets + k - 1) // k
+    padded = np.zeros(groups * k * chunk_size, dtype=np.uint8)
+    padded[:len(frame_data)] = np.frombuffer(frame_data, dtype=np.uint8)
+    return padded.reshape(groups, k, chunk_size)
+
+
+def encode_parity(frame_data, chunk_size, fec_mode, k, m):
+    """Computes parity payloads for a frame.
+
+    Returns a (groups, m, chunk_size) uint8 array; parity packet index for
+    group g, row j is g * m + j.
+    """
+    rows = _grouped_rows(frame_data, chunk_size, k)
+    if fec_mode == FEC_XOR:
+        return np.bitwise_xor.reduce(rows, axis=1)[:, None, :]
+
+    groups = rows.shape[0]
+    parity = np.zeros((groups, m, chunk_size), dtype=np.uint8)
+    for j in range(m):
+        acc = parity[:, j, :]
+        for i in range(k):
+            acc ^= GF_MUL[cauchy_coefficient(j, i, k)][rows[:, i, :]]
+    return parity
+
+
+def _gf_invert_matrix(matrix):
+    """Inverts a small square matrix over GF(256) with Gauss-Jordan elimination."""
+    size = len(matrix)
+    aug = [list(row) + [1 if r == c else 0 for c in range(size)] for r, row in enumerate(matrix)]
+    for col in range(size):
+        pivot = next(r for r in range(col, size) if aug[r][col])
+        aug[col], aug[pivot] = aug[pivot], aug[col]
+        inv_pivot = gf_inv(aug[col][col])
+        aug[col] = [int(GF_MUL[inv_pivot][v]) for v in aug[col]]
+        for r in range(size):
+            if r != col and aug[r][col]:
+                factor = aug[r][col]
+                aug[r] = [v ^ int(GF_MUL[factor][p]) for v, p in zip(aug[r], aug[col])]
+    return [row[size:] for row in aug]
+
+
+def recover_group(fec_mode, k, group_rows, present, parity_rows):
+    """Rebuilds missing data rows of one group in place.
+
+    group_rows:  (group_len, chunk_size) writable uint8 array, group_len <= k
+    present:     sequence of bools, one per row in group_rows
+    parity_rows: {parity_row j: (chunk_size,) uint8 array} received for this group
+    Returns the list of rebuilt row indexes, or [] if there is not enough data.
+    """
+    missing = [i for i, ok in enumerate(present) if not ok]
+    if not missing or len(parity_rows) < len(missing):
+        return []
+
+    if fec_mode == FEC_XOR:
+        if len(missing) != 1 or 0 not in parity_rows:
+            return []
+        acc = parity_rows[0].copy()
+        for i, ok in enumerate(present):
+            if ok:
+                acc ^= group_rows[i]
+        group_rows[missing[0]] = acc
+        return missing
+
+    if fec_mode != FEC_RS:
+        return []
+
+    used_parity = sorted(parity_rows)[:len(missing)]
+    syndromes = []
+    for j in used_parity:
+        syndrome = parity_rows[j].copy()
+        for i, ok in enumerate(present):
+            if ok:
+                syndrome ^= GF_MUL[cauchy_coefficient(j, i, k)][group_rows[i]]
+        syndromes.append(syndrome)
+
+    inverse = _gf_invert_matrix([[cauchy_coefficient(j, i, k) for i in missing] for j in used_parity])
+    for c, i in enumerate(missing):
+        acc = np.zeros_like(syndromes[0])
+        for r, syndrome in enumerate(syndromes):
+            acc ^= GF_MUL[inverse[c][r]][syndrome]
+        group_rows[i] = acc
+    return missing
@@ -0,0 +1,246 @@
+import struct
+from collections import namedtuple
+
+from video_fec import FEC_NONE, encode_parity
+
+
+# UDP video packet format shared by combined_server.py and combined_client.py.
+#
+# Every datagram starts with VIDEO_HEADER:
+#   version      (1 byte)   VIDEO_PACKET_VERSION
+#   flags        (1 byte)   FLAG_PARITY for FEC parity packets, FLAG_DELTA for delta frames
+#   fec_mode     (1 byte)   video_fec.FEC_NONE / FEC_XOR / FEC_RS
+#   fec_k        (1 byte)   data packets per FEC group
+#   fec_m        (1 byte)   parity packets per FEC group
+#   tier         (1 byte)   simulcast tier the frame was encoded for (used in NACKs)
+#   channel      (1 byte)   index of the server channel the frame belongs to
+#   frame_id     (4 bytes)  wraps at 2**32
+#   frame_size   (4 bytes)  total encoded frame size, lets the client preallocate
+#   packet_index (2 bytes)  data packet index, or g * fec_m + j for parity row j of group g
+#   num_packets  (2 bytes)  number of data packets in the frame
+#   chunk_size   (2 bytes)  payload size of every packet except possibly the last,
+#                           so packet i lands at offset i * chunk_size
+#   capture_time (4 bytes)  when the frame was captured, in milliseconds on the sending
+#                           server's monotonic clock; wraps at 2**32. Only differences
+#                           between frames mean anything (client jitter buffer).
+VIDEO_PACKET_VERSION = 5
+VIDEO_HEADER = struct.Struct('!BBBBBBBIIHHHI')
+VIDEO_HEADER_SIZE = VIDEO_HEADER.size
+# Byte offsets of frame_id and capture_time, so pre-built packets can be restamped.
+VIDEO_HEADER_FRAME_ID_OFFSET = 7
+VIDEO_HEADER_CAPTURE_TIME_OFFSET = 21
+
+FLAG_PARITY = 0x01
+FLAG_DELTA = 0x02
+
+# Datagram size (header + payload) in MTU mode. 1200 bytes leaves room for
+# IP/UDP headers and tunnels under a 1280-1500 byte path MTU, so datagrams are
+# never IP-fragmented and one lost packet only costs one chunk.
+DEFAULT_VIDEO_DATAGRAM_SIZE = 1200
+MAX_VIDEO_PACKETS_PER_FRAME = 0xFFFF
+MAX_VIDEO_CHUNK_SIZE = 0xFFFF
+# Largest frame a receiver reassembles: its data packets plus FEC parity packets, each
+# padded to chunk_size. Headers describing more are rejected, so a spoofed datagram
+# can't make a client allocate gigabytes.
+MAX_VIDEO_FRAME_BYTES = 8 * 1024 * 1024
+
+VideoPacketHeader = namedtuple(
+    "VideoPacketHeader",
+    "flags fec_mode fec_k fec_m tier channel frame_id frame_size packet_index num_packets chunk_size capture_time",
+)
+
+
+def capture_timestamp(monotonic_time):
+    """capture_time header field for a time.monotonic() value."""
+    return int(monotonic_time * 1000) & 0xFFFFFFFF
+
+# Delta frames (FLAG_DELTA) carry only the tiles that changed since base_frame_id
+# instead of one JPEG; frames without the flag are full JPEG keyframes:
+#   DELTA_HEADER: base_frame_id (4 bytes), width (2), height (2), tile count (2)
+#   per tile:     DELTA_TILE_HEADER x (2), y (2), JPEG length (4), then the JPEG bytes
+DELTA_HEADER = struct.Struct('!IHHH')
+DELTA_TILE_HEADER = struct.Struct('!HHI')
+
+# NACKs are text control messages sent to the server's handshake port:
+#   VIDEO_NACK <tier>/<frame_id>:<index>[,<index>|,<first>-<last>...] ...
+NACK_MAX_MESSAGE_BYTES = 1000
+
+
+def payload_size_for_datagram(datagram_size):
+    """Returns the per-packet payload size for a given datagram size."""
+    return min(MAX_VIDEO_CHUNK_SIZE, datagram_size - VIDEO_HEADER_SIZE)
+
+
+def packetize_frame(frame_id, frame_data, chunk_size, fec_mode=FEC_NONE, fec_k=0, fec_m=0, tier=0, flags=0,
+                    channel=0, capture_time=0):
+    """Splits an encoded frame into datagrams of at most chunk_size payload bytes.
+
+    With FEC enabled, each group's parity packets follow its fec_k data packets.
+    Raises ValueError if the frame would need more than MAX_VIDEO_PACKETS_PER_FRAME packets
+    or, with parity, more than MAX_VIDEO_FRAME_BYTES.
+    """
+    data_size = len(frame_data)
+    num_packets = max(1, (data_size + chunk_size - 1) // chunk_size)
+    if num_packets > MAX_VIDEO_PACKETS_PER_FRAME:
+        raise ValueError(f"Frame of {data_size} bytes needs {num_packets} packets at {chunk_size} bytes each")
+    if fec_mode == FEC_NONE:
+        fec_k = fec_m = 0
+    if reassembly_size(num_packets, chunk_size, fec_mode, fec_k, fec_m) > MAX_VIDEO_FRAME_BYTES:
+        raise ValueError(f"Frame of {data_size} bytes is over the {MAX_VIDEO_FRAME_BYTES} byte limit "
+                         f"with padding and parity")
+
+    frame_id &= 0xFFFFFFFF
+    pack = VIDEO_HEADER.pack
+    view = memoryview(frame_data)
+    data_packets = [
+        pack(VIDEO_PACKET_VERSION, flags, fec_mode, fec_k, fec_m, tier, channel, frame_id, data_size,
+             i, num_packets, chunk_size, capture_time)
+        + view[i * chunk_size:(i + 1) * chunk_size]
+        for i in range(num_packets)
+    ]
+    if fec_mode == FEC_NONE:
+        return data_packets
+
+    parity = encode_parity(frame_data, chunk_size, fec_mode, fec_k, fec_m)
+    packets = []
+    for group in range(parity.shape[0]):
+        packets.extend(data_packets[group * fec_k:(group + 1) * fec_k])
+        for j in range(fec_m):
+            parity_index = group * fec_m + j
+            packets.append(
+                pack(VIDEO_PACKET_VERSION, flags | FLAG_PARITY, fec_mode, fec_k, fec_m, tier, channel, frame_id,
+                     data_size, parity_index, num_packets, chunk_size, capture_time)
+                + parity[group, j].tobytes()
+            )
+    return packets
+
+
+def pack_delta_payload(base_frame_id, width, height, tiles):
+    """Builds a delta frame payload from [(x, y, jpeg_bytes), ...]."""
+    parts = [DELTA_HEADER.pack(base_frame_id & 0xFFFFFFFF, width, height, len(tiles))]
+    for x, y, jpeg in tiles:
+        parts.append(DELTA_TILE_HEADER.pack(x, y, len(jpeg)))
+        parts.append(jpeg)
+    return b''.join(parts)
+
+
+def parse_delta_payload(data):
+    """Returns (base_frame_id, width, height, [(x, y, jpeg memoryview), ...]).
+    Raises ValueError if the payload is truncated."""
+    view = memoryview(data)
+    if len(view) < DELTA_HEADER.size:
+        raise ValueError("Delta payload too short")
+    base_frame_id, width, height, count = DELTA_HEADER.unpack_from(view)
+    offset = DELTA_HEADER.size
+    tiles = []
+    for _ in range(count):
+        if offset + DELTA_TILE_HEADER.size > len(view):
+            raise ValueError("Truncated delta tile header")
+        x, y, length = DELTA_TILE_HEADER.unpack_from(view, offset)
+        offset += DELTA_TILE_HEADER.size
+        if offset + length > len(view):
+            raise ValueError("Truncated delta tile")
+        tiles.append((x, y, view[offset:offset + length]))
+        offset += length
+    return base_frame_id, width, height, tiles
+
+
+def parse_packet_header(data):
+    """Returns a VideoPacketHeader, or None if the header is invalid."""
+    if len(data) < VIDEO_HEADER_SIZE:
+        return None
+    version, *fields = VIDEO_HEADER.unpack_from(data)
+    if version != VIDEO_PACKET_VERSION:
+        return None
+    header = VideoPacketHeader(*fields)
+    if header.chunk_size == 0 or header.frame_size > header.num_packets * header.chunk_size:
+        return None
+    if header.num_packets > 1 and header.frame_size <= (header.num_packets - 1) * header.chunk_size:
+        return None  # only the last packet may be short
+    if reassembly_size(header.num_packets, header.chunk_size, header.fec_mode, header.fec_k,
+                       header.fec_m) > MAX_VIDEO_FRAME_BYTES:
+        return None
+    if header.flags & FLAG_PARITY:
+        if header.fec_k == 0 or header.fec_m == 0:
+            return None
+        groups = (header.num_packets + header.fec_k - 1) // header.fec_k
+        if header.packet_index >= groups * header.fec_m:
+            return None
+    elif header.packet_index >= header.num_packets:
+        return None
+    return header
+
+
+def reassembly_size(num_packets, chunk_size, fec_mode, fec_k, fec_m):
+    """Bytes of data and parity packets of a frame, each padded to chunk_size."""
+    num_parity = 0
+    if fec_mode != FEC_NONE and fec_k:
+        num_parity = (num_packets + fec_k - 1) // fec_k * fec_m
+    return (num_packets + num_parity) * chunk_size
+
+
+def data_packet_position(packet_index, fec_k, fec_m):
+    """Position of data packet packet_index in the list returned by packetize_frame."""
+    if not fec_k:
+        return packet_index
+    group, row = divmod(packet_index, fec_k)
+    return group * (fec_k + fec_m) + row
+
+
+def _index_range_parts(indexes):
+    """Sorted packet indexes as "first-last" / "index" range strings."""
+    parts = []
+    start = prev = indexes[0]
+    for index in indexes[1:]:
+        if index == prev + 1:
+            prev = index
+            continue
+        parts.append(str(start) if start == prev else f"{start}-{prev}")
+        start = prev = index
+    parts.append(str(start) if start == prev else f"{start}-{prev}")
+    return parts
+
+
+def format_nack_messages(requests):
+    """Builds VIDEO_NACK messages for [(tier, frame_id, sorted packet indexes), ...],
+    split so none exceeds NACK_MAX_MESSAGE_BYTES. A frame with more ranges than fit
+    in one message is split into several entries for the same frame."""
+    messages = []
+    current = "VIDEO_NACK"
+    for tier, frame_id, indexes in requests:
+        prefix = f" {tier}/{frame_id}:"
+        in_entry = False  # current ends with an entry for this frame that can take more ranges
+        for part in _index_range_parts(indexes):
+            if in_entry and len(current) + 1 + len(part) <= NACK_MAX_MESSAGE_BYTES:
+                current += "," + part
+                continue
+            if len(current) + len(prefix) + len(part) > NACK_MAX_MESSAGE_BYTES and current != "VIDEO_NACK":
+                messages.append(current)
+                current = "VIDEO_NACK"
+            current += prefix + part
+            in_entry = True
+    if current != "VIDEO_NACK":
+        messages.append(current)
+    return messages
+
+
+def parse_nack_entries(entries):
+    """Parses the entries of a VIDEO_NACK message into [(tier, frame_id, [indexes]), ...], skipping malformed ones."""
+    requests = []
+    for entry in entries:
+        try:
+            stream, _, ranges = entry.partition(':')
+            tier, _, frame_id = stream.partition('/')
+            indexes = []
+            for part in ranges.split(','):
+                first, _, last = part.partition('-')
+                first, last = int(first), int(last or first)
+                if not 0 <= first <= last < MAX_VIDEO_PACKETS_PER_FRAME:
+                    raise ValueError(part)
+                indexes.extend(range(first, last + 1))
+                if len(indexes) > MAX_VIDEO_PACKETS_PER_FRAME:
+                    raise ValueError(entry)
+            requests.append((int(tier), int(frame_id), indexes))
+        except ValueError:
+            continue
+    return requests